@@ -21,6 +21,9 @@ app.config["SESSION_REFRESH_EACH_REQUEST"] = True  # Keep session alive during u
 # Configure MongoDB Atlas connection
 MONGODB_URI = ' '
 
+# Command listener used by utils.query_counter to count queries per block
+from utils.query_counter import query_listener
+
 # Connect to MongoDB with more lenient settings
 db = connect(
     db='exam_evaluator',
@@ -31,6 +34,7 @@ db = connect(
     socketTimeoutMS=60000,
     connectTimeoutMS=30000,
     connect=False,  # Lazy connection
+    event_listeners=[query_listener],
 )
 
 # Ensure instance directory exists
@@ -39,6 +43,7 @@ if not os.path.exists(instance_path):
     os.makedirs(instance_path, mode=0o777)
 app.config["UPLOAD_FOLDER"] = "uploads"
 app.config["MAX_CONTENT_LENGTH"] = 16 * 1024 * 1024  # 16MB max-limit
+app.config["BULK_MAX_CONTENT_LENGTH"] = 512 * 1024 * 1024  # 512MB limit for bulk class uploads
 
 
 # Initialize Flask-Login
@@ -71,6 +76,18 @@ app.register_blueprint(database_bp)
 from routes.student_routes import student_bp
 app.register_blueprint(student_bp)
 
+from routes.queue_routes import queue_bp
+app.register_blueprint(queue_bp)
+
+from routes.bulk_routes import bulk_bp
+app.register_blueprint(bulk_bp)
+
+from routes.download_routes import download_bp
+app.register_blueprint(download_bp)
+
+from routes.stats_routes import stats_bp
+app.register_blueprint(stats_bp)
+
 # Add favicon route
 @app.route('/favicon.ico')
 def favicon():
@@ -44,7 +44,11 @@ def check_trocr():
     try:
         import torch
         import transformers
-        return True, "TrOCR dependencies (torch, transformers) are installed"
+        from utils.trocr_service import TROCR_MODEL, TROCR_QUANTIZE, TROCR_MAX_BATCH, TROCR_NUM_THREADS
+        threads = TROCR_NUM_THREADS or torch.get_num_threads()
+        return True, (f"TrOCR dependencies (torch, transformers) are installed; model {TROCR_MODEL}, "
+                      f"int8 quantization {'on' if TROCR_QUANTIZE else 'off'}, "
+                      f"batch size {TROCR_MAX_BATCH}, {threads} CPU thread(s)")
     except ImportError as e:
         return False, f"TrOCR dependencies not installed: {str(e)}"
 
@@ -2,10 +2,19 @@
 OCR Configuration Helper
 
 This file is kept for backward compatibility but OCR.Space has been removed.
-The project now uses:
-1. Gemini API (primary text extraction)
+Engines run as a confidence-driven cascade (utils/ocr_router.py), cheapest
+first, stopping as soon as one result is confident enough:
+1. PyTesseract (handwritten, then printed preprocessing)
 2. TrOCR (deep learning for handwritten text)
-3. PyTesseract (fallback OCR)
+3. Gemini API (most expensive, used when the local engines are unsure)
+
+Tune with OCR_ACCEPT_THRESHOLD, OCR_ENABLE_TROCR and OCR_ENABLE_GEMINI.
+TrOCR runs as a shared, warm in-process service with micro-batching
+(utils/trocr_service.py); see TROCR_NUM_THREADS, TROCR_QUANTIZE,
+TROCR_MAX_BATCH and TROCR_MAX_WAIT_MS.
+Gemini calls share one rate-limited async client (utils/gemini_client.py);
+see GEMINI_MAX_CONCURRENCY, GEMINI_REQUESTS_PER_MINUTE and
+GEMINI_IMAGES_PER_REQUEST.
 
 To use TrOCR, install dependencies:
     pip install torch transformers
@@ -18,17 +27,28 @@ logger = logging.getLogger(__name__)
 def get_ocr_setup_instructions():
     """Return setup instructions for OCR services"""
     return """
-    The project uses the following OCR technologies:
+    Pages go through a confidence-driven cascade (utils/ocr_router.py),
+    cheapest engine first. Each result gets a 0-1 score and the cascade stops
+    at the first engine whose score reaches OCR_ACCEPT_THRESHOLD (default 0.6);
+    if none does, the best-scoring result is used.
     
-    1. Gemini API (Primary - Always Active):
-       - Configured with API key in gemini_processor.py
-       - Used for both handwritten and typed text extraction
+    1. PyTesseract (First - Always Available):
+       - Requires Tesseract OCR to be installed on system
+       - Runs on the handwritten, then the printed preprocessing of the page
+       - Score: 0.6 x mean word confidence + 0.4 x share of real words
     
     2. TrOCR (Deep Learning - Optional):
        - Install dependencies: pip install torch transformers
-       - Automatically used for handwritten text if available
+       - Joins the cascade when installed, unless OCR_ENABLE_TROCR=0
+       - Score: 0.7 x sequence probability + 0.3 x share of real words
+       - Model is loaded once per process (worker.py preloads it) and
+         requests are micro-batched; int8 quantization is on by default
     
-    3. PyTesseract (Fallback - Always Available):
-       - Requires Tesseract OCR to be installed on system
-       - Used as fallback when other methods fail
+    3. Gemini API (Last - Most Expensive):
+       - Configured with the GEMINI_API_KEY environment variable
+       - Joins the cascade when the key is set, unless OCR_ENABLE_GEMINI=0
+       - Only reached for pages the local engines are not confident about
+       - Score: share of real words (the API reports no confidence)
+       - Pages are extracted concurrently at the configured quota, packed
+         several to a request, with retries on 429/5xx responses
     """
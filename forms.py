@@ -1,5 +1,5 @@
 from flask_wtf import FlaskForm
-from flask_wtf.file import FileField, FileAllowed, FileRequired
+from flask_wtf.file import FileField, FileAllowed, FileRequired, MultipleFileField
 from wtforms import StringField, PasswordField, BooleanField, TextAreaField, FloatField, IntegerField, SelectField
 from wtforms.validators import DataRequired, Email, EqualTo, Length, ValidationError, Optional
 
@@ -64,6 +64,29 @@ class SubmissionForm(FlaskForm):
         FileAllowed(['pdf', 'jpg', 'jpeg', 'png'], 'Only PDF and image files are allowed!')
     ])
 
+class BulkSubmissionForm(FlaskForm):
+    archive = FileField('Answer Papers (ZIP)', validators=[
+        Optional(),
+        FileAllowed(['zip'], 'Only ZIP archives are allowed!')
+    ])
+    answer_files = MultipleFileField('Answer Papers (PDF/Image)', validators=[
+        Optional(),
+        FileAllowed(['pdf', 'jpg', 'jpeg', 'png'], 'Only PDF and image files are allowed!')
+    ])
+    student_mapping = FileField('Student Mapping (CSV: filename, usn)', validators=[
+        Optional(),
+        FileAllowed(['csv'], 'Only CSV files are allowed!')
+    ])
+
+    def validate(self, extra_validators=None):
+        if not super().validate(extra_validators):
+            return False
+        has_files = any(f and f.filename for f in (self.answer_files.data or []))
+        if not self.archive.data and not has_files:
+            self.archive.errors.append('Upload a ZIP archive or select answer files.')
+            return False
+        return True
+
 class ManualAnswerForm(FlaskForm):
     answer_text = TextAreaField('Student Answer Text', validators=[DataRequired()])
     question_id = IntegerField('Question ID', validators=[DataRequired()])
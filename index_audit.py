@@ -0,0 +1,181 @@
+"""
+MongoDB Index Audit
+Runs explain() on every hot query shape of the application and reports the
+ones that scan a whole collection (COLLSCAN) or sort in memory (SORT).
+
+Query shapes are run with ids taken from the database when there is data,
+so the plans match what report pages actually get.
+
+Deploying: submission_answers has a unique (submission, question) index, which
+MongoDB refuses to build while older duplicate answers exist. Run
+`python index_audit.py --ensure` once before starting the upgraded app and
+workers; it removes the duplicates (keeping the newest answer) and then
+creates every declared index.
+
+Usage:
+    python index_audit.py                 # audit, exit code 1 if any shape needs attention
+    python index_audit.py --ensure        # drop duplicate answers, create the declared indexes, audit
+    python index_audit.py --fix-duplicates  # only drop duplicate answers blocking the unique index
+"""
+import os
+import sys
+import argparse
+
+from bson import ObjectId
+
+# Add parent directory to path
+sys.path.insert(0, os.path.abspath(os.path.dirname(__file__)))
+
+from models import (User, Exam, Question, QuestionIndex, Submission, SubmissionAnswer, Grade,
+                    OCRDocument, ProcessingJob, ExamStats)
+from utils.job_queue import claimable_jobs
+
+# MongoDB connection will be handled by MongoEngine through Flask app
+from app import app
+
+PROBLEM_STAGES = {'COLLSCAN': 'collection scan', 'SORT': 'in-memory sort'}
+
+
+class Sample:
+    """Ids the query shapes are run with: real ones when the database has data"""
+
+    def __init__(self):
+        exam = Exam.objects.no_dereference().only('id', 'faculty').first()
+        submission = None
+        if exam is not None:
+            submission = Submission.objects(exam=exam.id).no_dereference().only('id', 'student_id').first()
+        self.exam_id = exam.id if exam else ObjectId()
+        self.faculty_id = exam.faculty.id if exam and exam.faculty else ObjectId()
+        self.submission_id = submission.id if submission else ObjectId()
+        self.student_id = (submission.student_id if submission else None) or "0"
+        self.submission_ids = list(Submission.objects(exam=self.exam_id).scalar('id')[:50]) or [self.submission_id]
+
+
+# name -> callable(sample) returning the QuerySet the application runs
+QUERY_SHAPES = {
+    "exam list of a faculty": lambda s: Exam.objects(faculty=s.faculty_id),
+    "exam.questions": lambda s: Exam(id=s.exam_id).questions,
+    "exam.submissions": lambda s: Exam(id=s.exam_id).submissions,
+    "processed submissions of an exam": lambda s: Submission.objects(exam=s.exam_id, processed=True),
+    "submission of a student in an exam": lambda s: Submission.objects(exam=s.exam_id, student_id=s.student_id),
+    "submission.answers": lambda s: Submission(id=s.submission_id).answers,
+    "answers of an exam report": lambda s: SubmissionAnswer.objects(submission__in=s.submission_ids),
+    "answer of one question": lambda s: SubmissionAnswer.objects(submission=s.submission_id, question=ObjectId()),
+    "grades of an exam report": lambda s: Grade.objects(submission__in=s.submission_ids).order_by(
+        'submission', 'question'),
+    "answer-key index of an exam": lambda s: QuestionIndex.objects(exam=s.exam_id),
+    "OCR document of a submission": lambda s: OCRDocument.objects(submission=s.submission_id),
+    "exam statistics": lambda s: ExamStats.objects(exam=s.exam_id),
+    "job claim": lambda s: claimable_jobs(),
+    "jobs of an exam": lambda s: ProcessingJob.objects(exam=s.exam_id),
+}
+
+
+def plan_stages(plan):
+    """All stage names in an explain() plan tree"""
+    stages = []
+    if isinstance(plan, dict):
+        if 'stage' in plan:
+            stages.append(plan['stage'])
+        for value in plan.values():
+            stages.extend(plan_stages(value))
+    elif isinstance(plan, list):
+        for item in plan:
+            stages.extend(plan_stages(item))
+    return stages
+
+
+def index_names(plan):
+    """Index names used by the IXSCAN stages of a plan"""
+    names = []
+    if isinstance(plan, dict):
+        if plan.get('stage') == 'IXSCAN' and plan.get('indexName'):
+            names.append(plan['indexName'])
+        for value in plan.values():
+            names.extend(index_names(value))
+    elif isinstance(plan, list):
+        for item in plan:
+            names.extend(index_names(item))
+    return names
+
+
+def audit(shapes=None):
+    """
+    Explain every query shape
+
+    Returns:
+        List of (name, problems, indexes) tuples
+    """
+    sample = Sample()
+    results = []
+    for name, build in (shapes or QUERY_SHAPES).items():
+        try:
+            explanation = build(sample).explain()
+        except Exception as e:
+            results.append((name, [f"explain failed: {e}"], []))
+            continue
+        winning = explanation.get('queryPlanner', {}).get('winningPlan', {})
+        stages = plan_stages(winning)
+        problems = [PROBLEM_STAGES[stage] for stage in PROBLEM_STAGES if stage in stages]
+        results.append((name, problems, sorted(set(index_names(winning)))))
+    return results
+
+
+def ensure_indexes():
+    """Create the indexes declared in the models' meta, removing duplicate answers first"""
+    for model in (User, Exam, Question, QuestionIndex, Submission, SubmissionAnswer, Grade,
+                  OCRDocument, ProcessingJob, ExamStats):
+        if model is SubmissionAnswer:
+            # The unique (submission, question) index cannot be built over duplicates
+            remove_duplicate_answers()
+        try:
+            model.ensure_indexes()
+            print(f"✓ Indexes of {model._get_collection_name()}")
+        except Exception as e:
+            print(f"✗ Indexes of {model._get_collection_name()}: {e}")
+
+
+def remove_duplicate_answers():
+    """Keep only the newest answer per (submission, question), as the unique index requires"""
+    collection = SubmissionAnswer._get_collection()
+    removed = 0
+    for group in collection.aggregate([
+        {"$sort": {"created_at": -1}},
+        {"$group": {"_id": {"submission": "$submission", "question": "$question"},
+                    "ids": {"$push": "$_id"}, "count": {"$sum": 1}}},
+        {"$match": {"count": {"$gt": 1}}},
+    ], allowDiskUse=True):
+        removed += collection.delete_many({"_id": {"$in": group["ids"][1:]}}).deleted_count
+    print(f"✓ Removed {removed} duplicate answers")
+    return removed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Report query shapes that scan collections or sort in memory")
+    parser.add_argument('--ensure', action='store_true', help="create the declared indexes before auditing")
+    parser.add_argument('--fix-duplicates', action='store_true',
+                        help="remove duplicate submission answers so the unique index can be built")
+    args = parser.parse_args()
+
+    with app.app_context():
+        if args.fix_duplicates and not args.ensure:
+            remove_duplicate_answers()
+        if args.ensure:
+            ensure_indexes()
+
+        results = audit()
+        width = max(len(name) for name, _, _ in results)
+        print(f"\n{'Query shape':<{width}}  Result")
+        print('=' * (width + 40))
+        for name, problems, indexes in results:
+            status = f"✗ {', '.join(problems)}" if problems else "✓"
+            used = f"  [{', '.join(indexes)}]" if indexes else ""
+            print(f"{name:<{width}}  {status}{used}")
+
+        flagged = [name for name, problems, _ in results if problems]
+        print(f"\n{len(flagged)} of {len(results)} query shapes need attention")
+        sys.exit(1 if flagged else 0)
+
+
+if __name__ == "__main__":
+    main()
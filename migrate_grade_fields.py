@@ -0,0 +1,85 @@
+"""
+Grade Feedback Field Migration
+Converts Grade.strengths, Grade.improvements and Grade.grammar_issues from
+JSON-encoded strings to native arrays, in place.
+
+Only documents that still hold a string in one of the fields are read, with
+a projection of just those fields, and they are rewritten with unordered
+bulk writes, so the script can be re-run safely and resumes where it stopped.
+
+Usage:
+    python migrate_grade_fields.py [--batch-size 1000] [--dry-run]
+"""
+import os
+import sys
+import argparse
+
+from pymongo import UpdateOne
+
+# Add parent directory to path
+sys.path.insert(0, os.path.abspath(os.path.dirname(__file__)))
+
+from models import Grade, feedback_list, grammar_issue_list
+
+# MongoDB connection will be handled by MongoEngine through Flask app
+from app import app
+
+LIST_FIELDS = ('strengths', 'improvements', 'grammar_issues')
+
+
+def converted_fields(document):
+    """$set document for one raw grade, covering only the fields still stored as strings"""
+    changes = {}
+    for field in LIST_FIELDS:
+        value = document.get(field)
+        if value is not None and not isinstance(value, str):
+            continue
+        if field == 'grammar_issues':
+            changes[field] = [issue.to_mongo().to_dict() for issue in grammar_issue_list(value)]
+        else:
+            changes[field] = feedback_list(value)
+    return changes
+
+
+def migrate_grades(batch_size=1000, dry_run=False):
+    """
+    Rewrite every grade whose feedback lists are still JSON strings
+
+    Returns:
+        Number of grades converted (or that would be, with dry_run)
+    """
+    collection = Grade._get_collection()
+    legacy = {"$or": [{field: {"$type": "string"}} for field in LIST_FIELDS]}
+    total = collection.count_documents(legacy)
+    print(f"Found {total} grades with JSON-encoded feedback fields")
+    if not total or dry_run:
+        return total
+
+    converted = 0
+    operations = []
+    cursor = collection.find(legacy, {field: 1 for field in LIST_FIELDS}, batch_size=batch_size)
+    for document in cursor:
+        operations.append(UpdateOne({"_id": document["_id"]}, {"$set": converted_fields(document)}))
+        if len(operations) >= batch_size:
+            converted += collection.bulk_write(operations, ordered=False).modified_count
+            operations = []
+            print(f"  converted {converted}/{total}")
+    if operations:
+        converted += collection.bulk_write(operations, ordered=False).modified_count
+
+    print(f"✓ Converted {converted} grades")
+    return converted
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert JSON-string grade feedback fields to arrays")
+    parser.add_argument('--batch-size', type=int, default=1000, help="documents per bulk write (default: 1000)")
+    parser.add_argument('--dry-run', action='store_true', help="only count the grades that need converting")
+    args = parser.parse_args()
+
+    with app.app_context():
+        migrate_grades(args.batch_size, args.dry_run)
+
+
+if __name__ == "__main__":
+    main()
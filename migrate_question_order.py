@@ -0,0 +1,92 @@
+"""
+Question Order Backfill
+Derives Question.sort_order from the Question.order label for existing
+questions, rewrites labels that older migrations stored as numbers instead
+of strings, and copies each question's sort_order onto its submission
+answers (SubmissionAnswer.sort_order), which reports are ordered by.
+
+Only the order fields are read, and changed questions are written with
+unordered bulk updates, so the script can be re-run safely.
+
+Usage:
+    python migrate_question_order.py [--batch-size 1000] [--dry-run]
+"""
+import os
+import sys
+import argparse
+
+from pymongo import UpdateOne
+
+# Add parent directory to path
+sys.path.insert(0, os.path.abspath(os.path.dirname(__file__)))
+
+from models import Question, question_sort_order, sync_answer_sort_order
+
+# MongoDB connection will be handled by MongoEngine through Flask app
+from app import app
+
+
+def order_changes(document):
+    """$set document for one raw question, or None if it is already up to date"""
+    order = document.get('order')
+    label = "" if order is None else str(order)
+    changes = {}
+    if order != label:
+        changes['order'] = label
+    sort_order = question_sort_order(label)
+    if document.get('sort_order') != sort_order:
+        changes['sort_order'] = sort_order
+    return changes or None
+
+
+def backfill_sort_order(batch_size=1000, dry_run=False):
+    """
+    Set sort_order (and a string order label) on every question that needs it
+
+    Returns:
+        Number of questions updated (or that would be, with dry_run)
+    """
+    collection = Question._get_collection()
+    updated = 0
+    pending = 0
+    operations = []
+    for document in collection.find({}, {'order': 1, 'sort_order': 1}, batch_size=batch_size):
+        changes = order_changes(document)
+        if changes is None:
+            continue
+        pending += 1
+        if dry_run:
+            continue
+        operations.append(UpdateOne({"_id": document["_id"]}, {"$set": changes}))
+        if len(operations) >= batch_size:
+            updated += collection.bulk_write(operations, ordered=False).modified_count
+            operations = []
+            print(f"  updated {updated} questions")
+    if operations:
+        updated += collection.bulk_write(operations, ordered=False).modified_count
+
+    if dry_run:
+        print(f"{pending} questions need a sort order")
+        return pending
+    print(f"✓ Backfilled sort order for {updated} questions")
+    return updated
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Backfill Question.sort_order from the order labels")
+    parser.add_argument('--batch-size', type=int, default=1000, help="documents per bulk write (default: 1000)")
+    parser.add_argument('--dry-run', action='store_true', help="only count the questions that need updating")
+    args = parser.parse_args()
+
+    with app.app_context():
+        backfill_sort_order(args.batch_size, args.dry_run)
+        if args.dry_run:
+            return
+        print(f"✓ Copied sort order to {sync_answer_sort_order()} submission answers")
+        # The (exam, sort_order, _id) index serves Exam.questions from here on; answer
+        # indexes need duplicate answers removed first (python index_audit.py --ensure)
+        Question.ensure_indexes()
+
+
+if __name__ == "__main__":
+    main()
@@ -5,14 +5,23 @@ Transfers all data from SQLite database to MongoDB Atlas
 import os
 import sys
 import sqlite3
+import hashlib
+import argparse
+import mimetypes
 from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+import gridfs
+from bson import ObjectId
+from pymongo import ReplaceOne, UpdateOne
+from pymongo.errors import BulkWriteError
 from werkzeug.security import generate_password_hash
 
 # Add parent directory to path
 sys.path.insert(0, os.path.abspath(os.path.dirname(__file__)))
 
 # Import MongoDB models
-from models import User, Exam, Question, Submission, SubmissionAnswer, Grade
+from models import (User, Exam, Question, Submission, SubmissionAnswer, Grade, feedback_list, grammar_issue_list,
+                    question_sort_order, sync_answer_sort_order)
 
 # MongoDB connection will be handled by MongoEngine through Flask app
 from app import app
@@ -134,7 +143,7 @@ def migrate_questions(cursor, exam_id_map):
             max_score=float(max_score) if max_score else 1.0,
             min_word_count=int(min_word_count) if min_word_count else 50,
             question_type=question_type or "text",
-            order=int(order) if order else 0,
+            order=str(order) if order is not None else "",
             created_at=datetime.utcnow()
         )
         question.save()
@@ -195,14 +204,572 @@ def migrate_submissions(cursor, exam_id_map):
 def migrate_submission_answers(cursor, submission_id_map):
     """Migrate submission answers from SQLite to MongoDB - Note: SQLite structure is different"""
     print("\n=== Migrating Submission Answers ===")
-    # SQLite has question_id and other fields, but MongoDB model expects question_number
-    # We'll skip this migration as the data structure is incompatible
-    print("⚠ Skipping submission_answer migration - data structure differs between SQLite and MongoDB")
-    print("   SQLite uses question_id (FK), MongoDB uses question_number (integer)")
-    print("   This data will be regenerated when processing submissions in the new system")
+    # Answers need the question id map, which only the batched mode keeps
+    print("⚠ Skipping submission_answer migration in row-by-row mode")
+    print("   Run with --batch to migrate answers, grades and uploaded files incrementally")
+
+# ---------------------------------------------------------------------------
+# Batched migration mode
+#
+# Streams SQLite rows with fetchmany, resolves existing MongoDB documents with
+# one $in query per batch and writes each batch with a single unordered
+# insert_many. Progress and the old-id -> new-id maps are kept in a small
+# SQLite state file, so an interrupted run resumes after the last batch.
+# ---------------------------------------------------------------------------
+
+DEFAULT_BATCH_SIZE = 500
+DEFAULT_FILE_WORKERS = 4
+DEFAULT_STATE_PATH = os.path.join(os.getcwd(), 'instance', 'migration_state.db')
+
+
+def parse_datetime(value):
+    """Parse an SQLite timestamp, defaulting to now"""
+    try:
+        return datetime.fromisoformat(value) if value else datetime.utcnow()
+    except (TypeError, ValueError):
+        return datetime.utcnow()
+
+
+class MigrationState:
+    """Checkpoint store: last migrated SQLite id per table plus the id maps"""
+
+    def __init__(self, path=DEFAULT_STATE_PATH):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.conn = sqlite3.connect(path)
+        self.conn.execute("CREATE TABLE IF NOT EXISTS progress (table_name TEXT PRIMARY KEY, last_id INTEGER)")
+        self.conn.execute("""CREATE TABLE IF NOT EXISTS id_map (
+            table_name TEXT, old_id INTEGER, new_id TEXT, PRIMARY KEY (table_name, old_id))""")
+        # Incremental stages: checksum of what was last written for each row
+        self.conn.execute("""CREATE TABLE IF NOT EXISTS row_state (
+            table_name TEXT, old_id INTEGER, new_id TEXT, checksum TEXT, PRIMARY KEY (table_name, old_id))""")
+        self.conn.commit()
+
+    def reset(self):
+        self.conn.execute("DELETE FROM progress")
+        self.conn.execute("DELETE FROM id_map")
+        self.conn.execute("DELETE FROM row_state")
+        self.conn.commit()
+
+    def last_id(self, table):
+        row = self.conn.execute("SELECT last_id FROM progress WHERE table_name = ?", (table,)).fetchone()
+        return row[0] if row else 0
+
+    def id_map(self, table):
+        """Old SQLite id -> MongoDB ObjectId for a table"""
+        return {old_id: ObjectId(new_id) for old_id, new_id in
+                self.conn.execute("SELECT old_id, new_id FROM id_map WHERE table_name = ?", (table,))}
+
+    def checkpoint(self, table, last_id, mapping):
+        """Record a finished batch atomically"""
+        with self.conn:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO id_map (table_name, old_id, new_id) VALUES (?, ?, ?)",
+                [(table, old_id, str(new_id)) for old_id, new_id in mapping.items()]
+            )
+            self.conn.execute("INSERT OR REPLACE INTO progress (table_name, last_id) VALUES (?, ?)", (table, last_id))
+
+    def row_states(self, table, old_ids):
+        """Old id -> (new ObjectId, checksum) for rows written by earlier runs"""
+        states = {}
+        old_ids = list(old_ids)
+        # Stay under SQLite's bound-parameter limit
+        for start in range(0, len(old_ids), 900):
+            chunk = old_ids[start:start + 900]
+            placeholders = ", ".join("?" * len(chunk))
+            for old_id, new_id, checksum in self.conn.execute(
+                f"SELECT old_id, new_id, checksum FROM row_state WHERE table_name = ? AND old_id IN ({placeholders})",
+                [table] + chunk
+            ):
+                states[old_id] = (ObjectId(new_id), checksum)
+        return states
+
+    def record_rows(self, table, entries):
+        """Store (old_id, new_id, checksum) for rows written in this batch"""
+        with self.conn:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO row_state (table_name, old_id, new_id, checksum) VALUES (?, ?, ?, ?)",
+                [(table, old_id, str(new_id), checksum) for old_id, new_id, checksum in entries]
+            )
+
+    def close(self):
+        self.conn.close()
+
+
+def iter_batches(conn, query, last_id, batch_size):
+    """Stream rows with id > last_id (id must be the first column) in batches"""
+    cursor = conn.cursor()
+    cursor.execute(query, (last_id,))
+    while True:
+        rows = cursor.fetchmany(batch_size)
+        if not rows:
+            break
+        yield rows
+    cursor.close()
+
+
+def migrated_object_id(table, old_id):
+    """
+    MongoDB _id for an SQLite row, derived from the table and the row id
+
+    The same row always gets the same id, so a batch that was written but
+    not checkpointed (e.g. the run was killed in between) is not inserted a
+    second time when the migration resumes.
+    """
+    return ObjectId(hashlib.md5(f"{table}:{old_id}".encode('utf-8')).hexdigest()[:24])
+
+
+def is_duplicate_id(error):
+    """Whether a bulk write error is the _id of a document an earlier run already inserted"""
+    if error.get('code') != 11000:
+        return False
+    key_pattern = error.get('keyPattern')
+    if key_pattern is not None:
+        return list(key_pattern) == ['_id']
+    return 'index: _id_ ' in error.get('errmsg', '')
+
+
+def bulk_insert(model, table, pending):
+    """
+    Insert documents with one unordered insert_many
+
+    Args:
+        model: MongoEngine document class
+        table: SQLite table the rows come from (part of their MongoDB _id)
+        pending: List of (old_id, document) pairs
+
+    Returns:
+        Dict of old_id -> new ObjectId for the documents that were written
+        (or already existed from an earlier run)
+    """
+    if not pending:
+        return {}
+    payload = []
+    for old_id, document in pending:
+        document.validate()
+        son = document.to_mongo().to_dict()
+        son['_id'] = migrated_object_id(table, old_id)
+        payload.append((old_id, son))
+
+    failed = set()
+    try:
+        model._get_collection().insert_many([son for _, son in payload], ordered=False)
+    except BulkWriteError as e:
+        for error in e.details.get('writeErrors', []):
+            if is_duplicate_id(error):
+                continue
+            failed.add(error['index'])
+            print(f"  ⚠ {model.__name__} row {payload[error['index']][0]} not written: {error.get('errmsg')}")
+
+    return {old_id: son['_id'] for i, (old_id, son) in enumerate(payload) if i not in failed}
+
+
+def checkpoint_batch(state, table, rows, pending, mapping):
+    """
+    Checkpoint a batch up to, but not including, its first row that was not written
+
+    Returns:
+        False if a row failed; the stage then stops, so the next run resumes at that row
+    """
+    failed = [old_id for old_id, _ in pending if old_id not in mapping]
+    if not failed:
+        state.checkpoint(table, rows[-1][0], mapping)
+        return True
+    first_failed = min(failed)
+    last_id = max((row[0] for row in rows if row[0] < first_failed), default=state.last_id(table))
+    state.checkpoint(table, last_id, mapping)
+    print(f"  ⚠ {table}: stopped before row {first_failed}, re-run to resume from it")
+    return False
+
+
+def migrate_users_batched(conn, state, batch_size):
+    """Migrate users, matching existing accounts by email"""
+    print("\n=== Migrating Users (batched) ===")
+    migrated = 0
+    query = """SELECT id, username, email, password_hash, department, is_faculty, created_at
+               FROM user WHERE id > ? ORDER BY id"""
+    for rows in iter_batches(conn, query, state.last_id('user'), batch_size):
+        existing = {user.email: user.id for user in User.objects(email__in=[row[2] for row in rows]).only('id', 'email')}
+        mapping = {}
+        pending = []
+        for old_id, username, email, password_hash, department, is_faculty, created_at in rows:
+            if email in existing:
+                mapping[old_id] = existing[email]
+                continue
+            pending.append((old_id, User(
+                username=username,
+                email=email,
+                password=password_hash,  # Already hashed from SQLite
+                department=department or "",
+                is_faculty=bool(is_faculty),
+                created_at=parse_datetime(created_at)
+            )))
+        mapping.update(bulk_insert(User, 'user', pending))
+        completed = checkpoint_batch(state, 'user', rows, pending, mapping)
+        migrated += len(mapping)
+        print(f"✓ Users batch up to id {rows[-1][0]}: {len(pending)} inserted, {len(rows) - len(pending)} existing")
+        if not completed:
+            break
+    print(f"Total users migrated this run: {migrated}")
+
+
+def migrate_exams_batched(conn, state, batch_size):
+    """Migrate exams, matching existing exams by (title, faculty)"""
+    print("\n=== Migrating Exams (batched) ===")
+    user_map = state.id_map('user')
+    migrated = 0
+    query = "SELECT id, title, description, faculty_id, created_at FROM exam WHERE id > ? ORDER BY id"
+    for rows in iter_batches(conn, query, state.last_id('exam'), batch_size):
+        titles = [row[1] for row in rows]
+        faculty_ids = list({user_map[row[3]] for row in rows if row[3] in user_map})
+        existing = {
+            (exam.title, exam.faculty.id): exam.id
+            for exam in Exam.objects(title__in=titles, faculty__in=faculty_ids).no_dereference().only('id', 'title', 'faculty')
+        }
+        mapping = {}
+        pending = []
+        for old_id, title, description, faculty_id, created_at in rows:
+            mongo_user_id = user_map.get(faculty_id)
+            if not mongo_user_id:
+                print(f"Warning: Faculty ID {faculty_id} not found for exam {title}")
+                continue
+            if (title, mongo_user_id) in existing:
+                mapping[old_id] = existing[(title, mongo_user_id)]
+                continue
+            pending.append((old_id, Exam(
+                title=title,
+                description=description or "",
+                faculty=mongo_user_id,
+                created_at=parse_datetime(created_at)
+            )))
+        mapping.update(bulk_insert(Exam, 'exam', pending))
+        completed = checkpoint_batch(state, 'exam', rows, pending, mapping)
+        migrated += len(mapping)
+        print(f"✓ Exams batch up to id {rows[-1][0]}: {len(pending)} inserted")
+        if not completed:
+            break
+    print(f"Total exams migrated this run: {migrated}")
+
+
+def migrate_questions_batched(conn, state, batch_size):
+    """Migrate questions; the exam id map replaces a lookup per row"""
+    print("\n=== Migrating Questions (batched) ===")
+    exam_map = state.id_map('exam')
+    migrated = 0
+    query = """SELECT id, exam_id, text, answer_key, max_score, min_word_count, question_type, `order`
+               FROM question WHERE id > ? ORDER BY id"""
+    for rows in iter_batches(conn, query, state.last_id('question'), batch_size):
+        pending = []
+        for old_id, exam_id, text, answer_key, max_score, min_word_count, question_type, order in rows:
+            mongo_exam_id = exam_map.get(exam_id)
+            if not mongo_exam_id:
+                print(f"Warning: Exam ID {exam_id} not found for question")
+                continue
+            pending.append((old_id, Question(
+                exam=mongo_exam_id,
+                text=text or "",
+                answer_key=answer_key or "",
+                max_score=float(max_score) if max_score else 1.0,
+                min_word_count=int(min_word_count) if min_word_count else 50,
+                question_type=question_type or "text",
+                order=str(order) if order is not None else "",
+                # Bulk inserts bypass Question.save(), which derives it otherwise
+                sort_order=question_sort_order(order),
+                created_at=datetime.utcnow()
+            )))
+        mapping = bulk_insert(Question, 'question', pending)
+        completed = checkpoint_batch(state, 'question', rows, pending, mapping)
+        migrated += len(mapping)
+        print(f"✓ Questions batch up to id {rows[-1][0]}: {len(mapping)} inserted")
+        if not completed:
+            break
+    print(f"Total questions migrated this run: {migrated}")
+
+
+def migrate_submissions_batched(conn, state, batch_size):
+    """Migrate submissions"""
+    print("\n=== Migrating Submissions (batched) ===")
+    exam_map = state.id_map('exam')
+    migrated = 0
+    query = """SELECT id, exam_id, student_name, student_id, original_file, total_score, submitted_at
+               FROM submission WHERE id > ? ORDER BY id"""
+    for rows in iter_batches(conn, query, state.last_id('submission'), batch_size):
+        pending = []
+        for old_id, exam_id, student_name, student_id, original_file, total_score, submitted_at in rows:
+            mongo_exam_id = exam_map.get(exam_id)
+            if not mongo_exam_id:
+                print(f"Warning: Exam ID {exam_id} not found for submission")
+                continue
+            submitted_dt = parse_datetime(submitted_at)
+            pending.append((old_id, Submission(
+                exam=mongo_exam_id,
+                student_name=student_name or "",
+                student_id=student_id or "",
+                file_path=original_file or "",
+                total_score=float(total_score) if total_score else 0.0,
+                max_possible_score=0.0,  # Will be calculated
+                processed=True if total_score else False,
+                uploaded_at=submitted_dt,
+                processed_at=submitted_dt if total_score else None
+            )))
+        mapping = bulk_insert(Submission, 'submission', pending)
+        completed = checkpoint_batch(state, 'submission', rows, pending, mapping)
+        migrated += len(mapping)
+        print(f"✓ Submissions batch up to id {rows[-1][0]}: {len(mapping)} inserted")
+        if not completed:
+            break
+    print(f"Total submissions migrated this run: {migrated}")
+
+
+def sqlite_table_columns(conn, table):
+    """Column names of an SQLite table, or [] if it does not exist"""
+    return [row[1] for row in conn.execute(f"PRAGMA table_info(`{table}`)")]
+
+
+def row_checksum(row):
+    """Stable checksum of an SQLite row, used to detect changed rows on re-runs"""
+    return hashlib.sha256(repr(tuple(row)).encode('utf-8')).hexdigest()
+
+
+def file_checksum(path):
+    """SHA-256 of a file, read in chunks"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def build_submission_answer(record, submission_map, question_map):
+    """SubmissionAnswer for an SQLite submission_answer row (None if its parents were not migrated)"""
+    submission_id = submission_map.get(record.get('submission_id'))
+    question_id = question_map.get(record.get('question_id'))
+    if not submission_id or not question_id:
+        return None
+    return SubmissionAnswer(
+        submission=submission_id,
+        question=question_id,
+        extracted_text=record.get('extracted_text') or record.get('answer_text') or "",
+        score=float(record.get('score') or 0.0),
+        similarity_score=float(record.get('similarity_score') or 0.0),
+        feedback=record.get('feedback') or "",
+        created_at=parse_datetime(record.get('created_at'))
+    )
+
+
+def build_grade(record, submission_map, question_map):
+    """Grade for an SQLite grade row (None if its parents were not migrated)"""
+    submission_id = submission_map.get(record.get('submission_id'))
+    question_id = question_map.get(record.get('question_id'))
+    if not submission_id or not question_id:
+        return None
+    scores = {
+        field: float(record.get(field) or 0.0)
+        for field in ('relevance_score', 'accuracy_score', 'grammar_score',
+                      'completeness_score', 'word_count_score', 'final_score')
+    }
+    return Grade(
+        submission=submission_id,
+        question=question_id,
+        student_answer=record.get('student_answer') or "",
+        detailed_feedback=record.get('detailed_feedback') or "",
+        strengths=feedback_list(record.get('strengths')),
+        improvements=feedback_list(record.get('improvements')),
+        grammar_issues=grammar_issue_list(record.get('grammar_issues')),
+        graded_at=parse_datetime(record.get('graded_at') or record.get('created_at')),
+        **scores
+    )
+
+
+def sync_table_incremental(conn, state, table, model, build, batch_size):
+    """
+    Copy an SQLite table into MongoDB, writing only new or changed rows
+
+    Every row is checksummed; rows whose checksum matches the last run are
+    skipped, changed rows replace their MongoDB document in place and new rows
+    are upserted under migrated_object_id, so a batch that was written but
+    not recorded is not duplicated by the next run. Each batch is one
+    unordered bulk_write.
+    """
+    columns = sqlite_table_columns(conn, table)
+    if 'id' not in columns:
+        print(f"⚠ Table {table} not found in SQLite, skipping")
+        return
+
+    submission_map = state.id_map('submission')
+    question_map = state.id_map('question')
+    query = f"SELECT {', '.join(f'`{c}`' for c in columns)} FROM `{table}` WHERE id > ? ORDER BY id"
+    id_index = columns.index('id')
+    inserted = updated = unchanged = skipped = 0
+
+    # Full scan on every run: reading SQLite locally is cheap, only changed rows cross the network
+    for rows in iter_batches(conn, query, 0, batch_size):
+        known = state.row_states(table, [row[id_index] for row in rows])
+        operations = []
+        entries = []
+        for row in rows:
+            old_id = row[id_index]
+            checksum = row_checksum(row)
+            previous = known.get(old_id)
+            if previous and previous[1] == checksum:
+                unchanged += 1
+                continue
+            document = build(dict(zip(columns, row)), submission_map, question_map)
+            if document is None:
+                skipped += 1
+                continue
+            document.validate()
+            son = document.to_mongo().to_dict()
+            if previous:
+                son['_id'] = previous[0]
+                operations.append(ReplaceOne({'_id': previous[0]}, son))
+                updated += 1
+            else:
+                son['_id'] = migrated_object_id(table, old_id)
+                operations.append(ReplaceOne({'_id': son['_id']}, son, upsert=True))
+                inserted += 1
+            entries.append((old_id, son['_id'], checksum))
+
+        if operations:
+            try:
+                model._get_collection().bulk_write(operations, ordered=False)
+            except BulkWriteError as e:
+                # A duplicate _id means a concurrent or earlier write already created the row
+                failed = {error['index'] for error in e.details.get('writeErrors', []) if not is_duplicate_id(error)}
+                if failed:
+                    print(f"  ⚠ {len(failed)} {table} rows not written")
+                entries = [entry for i, entry in enumerate(entries) if i not in failed]
+            state.record_rows(table, entries)
+
+    print(f"✓ {table}: {inserted} inserted, {updated} updated, {unchanged} unchanged, {skipped} without parent")
+
+
+def resolve_upload_path(path):
+    """Locate a legacy upload on local disk"""
+    if not path:
+        return None
+    for candidate in (path, os.path.join(app.config["UPLOAD_FOLDER"], os.path.basename(path))):
+        if os.path.isfile(candidate):
+            return candidate
+    return None
+
+
+def migrate_submission_files(conn, state, batch_size, max_workers):
+    """
+    Upload legacy submission files into GridFS with bounded parallelism
+
+    Files whose checksum matches the last run are skipped; a changed file
+    replaces the previous GridFS file.
+    """
+    print("\n=== Migrating Submission Files to GridFS ===")
+    submission_map = state.id_map('submission')
+    fs = gridfs.GridFS(Submission._get_db(), collection='fs')
+    uploaded = unchanged = missing = 0
+
+    def transfer(path, previous_checksum):
+        """Hash the file and upload it unless it matches the last run; returns (checksum, grid_id or None)"""
+        checksum = file_checksum(path)
+        if checksum == previous_checksum:
+            return checksum, None
+        with open(path, 'rb') as f:
+            grid_id = fs.put(
+                f,
+                filename=os.path.basename(path),
+                content_type=mimetypes.guess_type(path)[0] or 'application/octet-stream',
+                sha256=checksum
+            )
+        return checksum, grid_id
+
+    query = "SELECT id, original_file FROM submission WHERE id > ? ORDER BY id"
+    # At most max_workers files are hashed/uploaded at once; batches bound the queued work
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        for rows in iter_batches(conn, query, 0, batch_size):
+            known = state.row_states('submission_file', [row[0] for row in rows])
+            futures = {}
+            for old_id, original_file in rows:
+                submission_id = submission_map.get(old_id)
+                path = resolve_upload_path(original_file)
+                if not submission_id or not path:
+                    missing += 1
+                    continue
+                previous = known.get(old_id)
+                future = executor.submit(transfer, path, previous[1] if previous else None)
+                futures[future] = (old_id, submission_id, previous)
+
+            operations = []
+            entries = []
+            replaced = []
+            for future, (old_id, submission_id, previous) in futures.items():
+                try:
+                    checksum, grid_id = future.result()
+                except Exception as e:
+                    print(f"  ⚠ Upload failed for submission {old_id}: {e}")
+                    continue
+                if grid_id is None:
+                    unchanged += 1
+                    continue
+                operations.append(UpdateOne({'_id': submission_id}, {'$set': {'original_file': grid_id}}))
+                entries.append((old_id, grid_id, checksum))
+                # Kept index-aligned with operations, so failed writes can be matched up
+                replaced.append(previous[0] if previous else None)
+                uploaded += 1
+
+            if operations:
+                try:
+                    Submission._get_collection().bulk_write(operations, ordered=False)
+                except BulkWriteError as e:
+                    failed = {error['index'] for error in e.details.get('writeErrors', [])}
+                    print(f"  ⚠ {len(failed)} submissions not updated, their uploaded files are removed")
+                    # Nothing points at these uploads; the next run uploads them again
+                    for i in sorted(failed):
+                        fs.delete(entries[i][1])
+                    uploaded -= len(failed)
+                    entries = [entry for i, entry in enumerate(entries) if i not in failed]
+                    replaced = [grid_id for i, grid_id in enumerate(replaced) if i not in failed]
+                state.record_rows('submission_file', entries)
+                # Old GridFS files are only dropped once nothing points at them
+                for grid_id in replaced:
+                    if grid_id is not None:
+                        fs.delete(grid_id)
+
+    print(f"✓ Files: {uploaded} uploaded, {unchanged} unchanged, {missing} missing on disk")
+
+
+def run_batched_migration(conn, state, batch_size, file_workers=DEFAULT_FILE_WORKERS):
+    """Run every batched stage in dependency order"""
+    migrate_users_batched(conn, state, batch_size)
+    migrate_exams_batched(conn, state, batch_size)
+    migrate_questions_batched(conn, state, batch_size)
+    migrate_submissions_batched(conn, state, batch_size)
+
+    print("\n=== Migrating Submission Answers and Grades (incremental) ===")
+    sync_table_incremental(conn, state, 'submission_answer', SubmissionAnswer, build_submission_answer, batch_size)
+    # Answers are ordered by their question's position, which only the questions know
+    print(f"✓ submission_answer: sort order set on {sync_answer_sort_order(list(state.id_map('question').values()))} answers")
+    sync_table_incremental(conn, state, 'grade', Grade, build_grade, batch_size)
+    migrate_submission_files(conn, state, batch_size, file_workers)
+
+    print(f"\nSummary (all runs):")
+    print(f"  Users: {len(state.id_map('user'))}")
+    print(f"  Exams: {len(state.id_map('exam'))}")
+    print(f"  Questions: {len(state.id_map('question'))}")
+    print(f"  Submissions: {len(state.id_map('submission'))}")
+
 
 def main():
     """Main migration function"""
+    parser = argparse.ArgumentParser(description="Migrate the SQLite database to MongoDB")
+    parser.add_argument('--batch', action='store_true',
+                        help="batched, resumable migration (bulk writes, one lookup query per batch)")
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE,
+                        help=f"rows per batch in batched mode (default: {DEFAULT_BATCH_SIZE})")
+    parser.add_argument('--state', default=DEFAULT_STATE_PATH,
+                        help="checkpoint file for batched mode")
+    parser.add_argument('--file-workers', type=int, default=DEFAULT_FILE_WORKERS,
+                        help=f"parallel GridFS uploads in batched mode (default: {DEFAULT_FILE_WORKERS})")
+    parser.add_argument('--restart', action='store_true',
+                        help="ignore the checkpoint and start the batched migration from the beginning")
+    args = parser.parse_args()
+
     print("=" * 60)
     print("SQLite to MongoDB Migration Script")
     print("=" * 60)
@@ -230,6 +797,19 @@ def main():
             User.objects().first()
             print("\n✓ MongoDB connection successful")
             
+            if args.batch:
+                state = MigrationState(args.state)
+                try:
+                    if args.restart:
+                        state.reset()
+                    run_batched_migration(conn, state, args.batch_size, args.file_workers)
+                finally:
+                    state.close()
+                print("\n" + "=" * 60)
+                print("✓ Batched migration completed successfully!")
+                print("=" * 60)
+                return
+            
             # Migrate in order (respecting foreign key relationships)
             user_id_map = migrate_users(cursor)
             exam_id_map = migrate_exams(cursor, user_id_map)
@@ -2,10 +2,25 @@
 MongoDB Models for AI Exam Evaluator
 Uses MongoEngine ODM for MongoDB
 """
-from mongoengine import Document, StringField, DateTimeField, ReferenceField, IntField, FloatField, BooleanField, FileField
+from mongoengine import Document, EmbeddedDocument, StringField, DateTimeField, ReferenceField, IntField, FloatField, BooleanField, FileField, DictField, ListField, EmbeddedDocumentField
 from flask_login import UserMixin
+import re
+import json
 from datetime import datetime
 from werkzeug.security import generate_password_hash, check_password_hash
+from utils.grading_cache import GRADING_CACHE_TTL_HOURS
+
+# Read size used when streaming GridFS files
+FILE_CHUNK_SIZE = 256 * 1024
+
+
+def _ref_label(document, field_name, attribute):
+    """Describe a reference for __repr__ without fetching it from the database"""
+    value = document._data.get(field_name)
+    if isinstance(value, Document):
+        return getattr(value, attribute)
+    # Unloaded reference: DBRef or raw ObjectId
+    return getattr(value, 'id', value)
 
 
 class User(Document, UserMixin):
@@ -101,14 +116,15 @@ class Exam(Document):
     
     meta = {
         'collection': 'exams',
-        'indexes': ['faculty', 'created_at'],
+        # Serves exam lists per faculty in the default order without an in-memory sort
+        'indexes': [('faculty', '-created_at'), 'created_at'],
         'ordering': ['-created_at']
     }
     
     @property
     def questions(self):
         """Get all questions for this exam"""
-        return Question.objects(exam=self).order_by('order')
+        return Question.objects(exam=self).order_by('sort_order', 'id')
     
     @property
     def submissions(self):
@@ -119,6 +135,28 @@ class Exam(Document):
         return f'<Exam {self.title}>'
 
 
+# Sub-question slots per question number in Question.sort_order ("2b" -> 2 * 100 + 2)
+SUB_QUESTION_SLOTS = 100
+ORDER_PATTERN = re.compile(r"\s*(?:q(?:uestion)?\.?\s*)?(\d+)\s*[.(]?\s*(?:([a-z])|(\d+))?", re.IGNORECASE)
+
+
+def question_sort_order(order):
+    """
+    Numeric sort key for a question label: "2" -> 200, "2b" / "2(b)" / "2.2" -> 202, "10" -> 1000
+
+    Labels without a number sort first (0) and keep their insertion order.
+    """
+    match = ORDER_PATTERN.match(str(order or ""))
+    if match is None:
+        return 0
+    sub = 0
+    if match.group(2):
+        sub = ord(match.group(2).lower()) - ord('a') + 1
+    elif match.group(3):
+        sub = min(int(match.group(3)), SUB_QUESTION_SLOTS - 1)
+    return int(match.group(1)) * SUB_QUESTION_SLOTS + sub
+
+
 class Question(Document):
     """Question model for MongoDB"""
     
@@ -128,17 +166,55 @@ class Question(Document):
     max_score = FloatField(default=1.0)
     min_word_count = IntField(default=50)
     question_type = StringField(default='text', max_length=50)
-    order = StringField(default="")
+    order = StringField(default="")  # Label as entered, e.g. "2" or "2b"
+    sort_order = IntField(default=0)  # Numeric position derived from order in save()
     created_at = DateTimeField(default=datetime.utcnow)
     
     meta = {
         'collection': 'questions',
-        'indexes': ['exam', 'order'],
-        'ordering': ['order']
+        # Ties on sort_order fall back to insertion order (_id), still from the index
+        'indexes': [('exam', 'sort_order', 'id')],
+        'ordering': ['sort_order', 'id']
+    }
+    
+    def save(self, *args, **kwargs):
+        """Override save to derive sort_order and keep the order of existing answers in sync"""
+        self.sort_order = question_sort_order(self.order)
+        existing = self.pk is not None
+        result = super(Question, self).save(*args, **kwargs)
+        # The answer-key index is rebuilt lazily by utils.answer_index.load_exam_index
+        if existing:
+            sync_answer_sort_order([self.pk])
+        return result
+    
+    def __repr__(self):
+        return f'<Question {self.order} - {_ref_label(self, "exam", "title")}>'
+
+
+class QuestionIndex(Document):
+    """Precomputed answer-key artifacts for a Question, rebuilt when the question changes"""
+    
+    question = ReferenceField(Question, required=True, unique=True, reverse_delete_rule=2)  # CASCADE
+    exam = ReferenceField(Exam, required=True, reverse_delete_rule=2)  # CASCADE
+    content_hash = StringField(required=True, max_length=64)  # Hash of text + answer_key + thresholds + exam vocabulary
+    tokens = ListField(StringField())  # Normalized answer-key tokens
+    keywords = ListField(StringField())  # Distinct key terms
+    key_vector = DictField()  # L2-normalized TF-IDF weights of the answer key (token -> weight)
+    idf = DictField()  # IDF over the exam's answer keys (token -> weight), used to weight answers
+    default_idf = FloatField(default=1.0)  # IDF of a token no answer key contains
+    max_score = FloatField(default=1.0)
+    min_word_count = IntField(default=50)
+    built_at = DateTimeField(default=datetime.utcnow)
+    
+    meta = {
+        'collection': 'question_index',
+        'indexes': ['exam'],
+        # Indexes built before key vectors still carry a term_weights field until rebuilt
+        'strict': False
     }
     
     def __repr__(self):
-        return f'<Question {self.order} - {self.exam.title}>'
+        return f'<QuestionIndex {_ref_label(self, "question", "id")} - {self.content_hash[:12]}>'
 
 
 class Submission(Document):
@@ -162,7 +238,8 @@ class Submission(Document):
     
     meta = {
         'collection': 'submissions',
-        'indexes': ['exam', 'uploaded_at', 'student_name'],
+        # exam.submissions and per-student lookups within an exam; both also cover plain exam= filters
+        'indexes': [('exam', '-uploaded_at'), ('exam', 'student_id'), 'uploaded_at', 'student_name'],
         'ordering': ['-uploaded_at']
     }
     
@@ -172,11 +249,33 @@ class Submission(Document):
         self.save()
     
     def get_file(self):
-        """Retrieve file from GridFS"""
+        """Retrieve file from GridFS (loads the whole file - prefer open_file/iter_file)"""
         if self.original_file:
             return self.original_file.read()
         return None
     
+    def open_file(self):
+        """Open the GridFS file as a seekable, file-like object (or None)"""
+        if self.original_file:
+            grid_out = self.original_file.get()
+            grid_out.seek(0)
+            return grid_out
+        return None
+    
+    def iter_file(self, chunk_size=FILE_CHUNK_SIZE):
+        """Yield the GridFS file in chunks without loading it into memory"""
+        grid_out = self.open_file()
+        if grid_out is None:
+            return
+        try:
+            while True:
+                chunk = grid_out.read(chunk_size)
+                if not chunk:
+                    break
+                yield chunk
+        finally:
+            grid_out.close()
+    
     def get_file_name(self):
         """Get original filename"""
         if self.original_file:
@@ -186,7 +285,7 @@ class Submission(Document):
     @property
     def answers(self):
         """Get all submission answers"""
-        return SubmissionAnswer.objects(submission=self).order_by('question_number')
+        return SubmissionAnswer.objects(submission=self).order_by('sort_order', 'question')
     
     @property
     def grades(self):
@@ -194,7 +293,18 @@ class Submission(Document):
         return Grade.objects(submission=self)
     
     def __repr__(self):
-        return f'<Submission {self.student_name} - {self.exam.title}>'
+        return f'<Submission {self.student_name} - {_ref_label(self, "exam", "title")}>'
+
+
+class AnswerSpan(EmbeddedDocument):
+    """Lines of one OCR page an answer was read from (indexes into OCRDocument.pages[].lines)"""
+    
+    page = IntField(required=True)
+    first_line = IntField(default=-1)  # -1: page without line geometry
+    last_line = IntField(default=-1)
+    
+    def __repr__(self):
+        return f'<AnswerSpan p{self.page} {self.first_line}-{self.last_line}>'
 
 
 class SubmissionAnswer(Document):
@@ -203,6 +313,8 @@ class SubmissionAnswer(Document):
     submission = ReferenceField(Submission, required=True, reverse_delete_rule=2)  # CASCADE
     question = ReferenceField(Question, required=True, reverse_delete_rule=2)  # CASCADE
     extracted_text = StringField()  # OCR extracted answer text
+    spans = ListField(EmbeddedDocumentField(AnswerSpan))  # Where the answer sits in the OCR document
+    sort_order = IntField(default=0)  # Copy of Question.sort_order, so answers sort by question position
     score = FloatField(default=0.0)  # Final score for this answer
     similarity_score = FloatField(default=0.0)  # Semantic similarity score
     feedback = StringField()  # AI-generated feedback
@@ -210,12 +322,99 @@ class SubmissionAnswer(Document):
     
     meta = {
         'collection': 'submission_answers',
-        'indexes': ['submission', 'question'],
-        'ordering': ['created_at']
+        # One answer per question; the default order (question position within each
+        # submission) follows the second index, so $in loads need no in-memory sort
+        'indexes': [
+            {'fields': ('submission', 'question'), 'unique': True},
+            ('submission', 'sort_order', 'question'),
+            'question',
+        ],
+        'ordering': ['submission', 'sort_order', 'question']
     }
     
     def __repr__(self):
-        return f'<SubmissionAnswer {self.submission.student_name} - Q{self.question.order}>'
+        return f'<SubmissionAnswer {_ref_label(self, "submission", "student_name")} - Q{_ref_label(self, "question", "order")}>'
+
+
+def sync_answer_sort_order(question_ids=None):
+    """
+    Copy Question.sort_order onto the answers of the given questions (all questions by default)
+
+    Returns:
+        Number of answers updated
+    """
+    questions = Question.objects(id__in=question_ids) if question_ids is not None else Question.objects
+    updated = 0
+    for question_id, sort_order in questions.scalar('id', 'sort_order'):
+        updated += SubmissionAnswer.objects(question=question_id, sort_order__ne=sort_order).update(
+            set__sort_order=sort_order
+        )
+    return updated
+
+
+def feedback_list(value):
+    """
+    Strengths / improvements as a list of strings
+
+    Accepts a list, a legacy JSON-encoded list, or a plain string (one item).
+    """
+    if value is None:
+        return []
+    if isinstance(value, str):
+        value = value.strip()
+        if not value:
+            return []
+        try:
+            value = json.loads(value)
+        except ValueError:
+            return [value]
+        if not isinstance(value, list):
+            value = [value]
+    return [str(item).strip() for item in value if item is not None and str(item).strip()]
+
+
+class GrammarIssue(EmbeddedDocument):
+    """One grammar problem found in an answer"""
+    
+    error = StringField()  # Text as written
+    correction = StringField()
+    explanation = StringField()
+    
+    def __repr__(self):
+        return f'<GrammarIssue {self.error!r} -> {self.correction!r}>'
+
+
+def grammar_issue_list(value):
+    """
+    Grammar issues as GrammarIssue documents
+
+    Accepts GrammarIssue documents, dicts, strings, or a legacy JSON-encoded
+    list of either.
+    """
+    if isinstance(value, str):
+        value = value.strip()
+        if not value:
+            return []
+        try:
+            value = json.loads(value)
+        except ValueError:
+            value = [value]
+    if isinstance(value, (dict, str)):
+        value = [value]
+
+    issues = []
+    for item in value or []:
+        if isinstance(item, GrammarIssue):
+            issues.append(item)
+        elif isinstance(item, dict):
+            issues.append(GrammarIssue(
+                error=str(item.get('error') or item.get('issue') or item.get('original') or item.get('text') or ''),
+                correction=str(item.get('correction') or item.get('suggestion') or item.get('corrected') or ''),
+                explanation=str(item.get('explanation') or item.get('reason') or item.get('rule') or ''),
+            ))
+        elif item is not None and str(item).strip():
+            issues.append(GrammarIssue(error=str(item).strip()))
+    return issues
 
 
 class Grade(Document):
@@ -234,17 +433,132 @@ class Grade(Document):
     final_score = FloatField(default=0.0)
     
     detailed_feedback = StringField()
-    strengths = StringField()  # JSON string
-    improvements = StringField()  # JSON string
-    grammar_issues = StringField()  # JSON string
+    strengths = ListField(StringField())
+    improvements = ListField(StringField())
+    grammar_issues = ListField(EmbeddedDocumentField(GrammarIssue))
     
     graded_at = DateTimeField(default=datetime.utcnow)
     
     meta = {
         'collection': 'grades',
-        'indexes': ['submission', 'question'],
+        'indexes': [('submission', 'question'), 'question'],
         'ordering': ['graded_at']
     }
     
     def __repr__(self):
-        return f'<Grade {self.final_score} - {self.submission.student_name}>'
+        return f'<Grade {self.final_score} - {_ref_label(self, "submission", "student_name")}>'
+
+
+class OCRDocument(Document):
+    """Structured OCR output of a submission: pages -> lines with box, text and confidence"""
+    
+    submission = ReferenceField(Submission, required=True, unique=True, reverse_delete_rule=2)  # CASCADE
+    pages = ListField(DictField())  # Page records, see utils.ocr_document
+    reocr_pages = ListField(IntField())  # Pages to OCR again on the next processing run
+    created_at = DateTimeField(default=datetime.utcnow)
+    updated_at = DateTimeField(default=datetime.utcnow)
+    
+    meta = {
+        'collection': 'ocr_documents'
+    }
+    
+    def __repr__(self):
+        return f'<OCRDocument {_ref_label(self, "submission", "student_name")} ({len(self.pages)} pages)>'
+
+
+class OCRCacheEntry(Document):
+    """Cached OCR result keyed by file content hash + OCR settings"""
+    
+    key = StringField(required=True, unique=True, max_length=64)
+    content_hash = StringField(max_length=64)  # SHA-256 of the uploaded file
+    settings = DictField()  # OCR settings that produced the text
+    text = StringField()
+    pages = ListField(DictField())  # Page records, see utils.ocr_document
+    size_bytes = IntField(default=0)
+    created_at = DateTimeField(default=datetime.utcnow)
+    last_accessed = DateTimeField(default=datetime.utcnow)
+    
+    meta = {
+        'collection': 'ocr_cache',
+        'indexes': ['content_hash', 'last_accessed']
+    }
+    
+    def __repr__(self):
+        return f'<OCRCacheEntry {self.content_hash[:12] if self.content_hash else self.key[:12]}>'
+
+
+class GradingCacheEntry(Document):
+    """Cached grading result keyed by question, answer key, normalized answer and grader version"""
+    
+    key = StringField(required=True, unique=True, max_length=64)
+    grader = StringField(max_length=100)  # Model and prompt version that produced the result
+    result = DictField()
+    created_at = DateTimeField(default=datetime.utcnow)
+    last_accessed = DateTimeField(default=datetime.utcnow)
+    
+    meta = {
+        'collection': 'grading_cache',
+        'indexes': [
+            {'fields': ['created_at'], 'expireAfterSeconds': int(GRADING_CACHE_TTL_HOURS * 3600)},
+            'last_accessed',
+        ]
+    }
+    
+    def __repr__(self):
+        return f'<GradingCacheEntry {self.key[:12]} ({self.grader})>'
+
+
+class ProcessingJob(Document):
+    """Queued OCR + segmentation + grading work for one submission"""
+    
+    submission = ReferenceField(Submission, required=True, reverse_delete_rule=2)  # CASCADE
+    exam = ReferenceField(Exam, required=True, reverse_delete_rule=2)  # CASCADE
+    kind = StringField(default='process', choices=('process', 'resegment'))  # resegment: no OCR
+    status = StringField(default='queued', choices=('queued', 'running', 'done', 'failed'))
+    active = BooleanField()  # True while queued or running; at most one active job per submission
+    attempts = IntField(default=0)
+    worker = StringField(max_length=100)  # Worker holding the lease
+    error = StringField()
+    enqueued_at = DateTimeField(default=datetime.utcnow)
+    started_at = DateTimeField()
+    lease_expires_at = DateTimeField()
+    finished_at = DateTimeField()
+    
+    meta = {
+        'collection': 'processing_jobs',
+        'indexes': [
+            ('status', 'enqueued_at'),
+            'exam',
+            'submission',
+            {
+                'fields': ['submission', 'active'],
+                'name': 'active_job_per_submission',
+                'unique': True,
+                'partialFilterExpression': {'active': True},
+            },
+        ]
+    }
+    
+    def __repr__(self):
+        return f'<ProcessingJob {self.id} - {self.status}>'
+
+
+class ExamStats(Document):
+    """Materialized per-exam statistics, maintained incrementally as submissions are graded"""
+    
+    exam = ReferenceField(Exam, required=True, unique=True, reverse_delete_rule=2)  # CASCADE
+    graded_count = IntField(default=0)
+    score_sum = FloatField(default=0.0)
+    score_sq_sum = FloatField(default=0.0)  # For the standard deviation
+    max_possible_sum = FloatField(default=0.0)
+    histogram = DictField()  # Percentage bucket ("0".."9") -> number of submissions
+    questions = DictField()  # Question id -> {"score_sum": float, "count": int}
+    version = IntField(default=0)  # Bumped by every update; rebuilds only replace the version they read
+    updated_at = DateTimeField(default=datetime.utcnow)
+    
+    meta = {
+        'collection': 'exam_stats'
+    }
+    
+    def __repr__(self):
+        return f'<ExamStats {_ref_label(self, "exam", "title")} - {self.graded_count} graded>'
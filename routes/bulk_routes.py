@@ -0,0 +1,43 @@
+import logging
+from flask import Blueprint, jsonify, request, current_app
+from flask_login import login_required, current_user
+from models import Exam
+from forms import BulkSubmissionForm
+from utils.bulk_upload import iter_uploaded_files, load_student_mapping, ingest_submissions
+
+bulk_bp = Blueprint('bulk', __name__)
+
+
+@bulk_bp.route('/exam/<exam_id>/bulk-upload', methods=['POST'])
+@login_required
+def bulk_upload(exam_id):
+    """Create and queue submissions for a whole class from a ZIP or multi-file upload"""
+    try:
+        exam = Exam.objects(id=exam_id, faculty=current_user.id).first()
+    except Exception:
+        exam = None
+    if exam is None:
+        return jsonify({'error': 'Exam not found'}), 404
+
+    # A class worth of papers is larger than the single-upload limit
+    request.max_content_length = current_app.config["BULK_MAX_CONTENT_LENGTH"]
+
+    form = BulkSubmissionForm()
+    if not form.validate_on_submit():
+        return jsonify({'error': 'Invalid upload', 'details': form.errors}), 400
+
+    mapping = load_student_mapping(form.student_mapping.data)
+    result = ingest_submissions(
+        exam,
+        iter_uploaded_files(form.archive.data, form.answer_files.data),
+        mapping
+    )
+
+    logging.debug(f"Bulk upload by {current_user.username}: {len(result['submissions'])} submissions")
+    return jsonify({
+        'exam_id': str(exam.id),
+        'created': len(result['submissions']),
+        'submission_ids': [str(s.id) for s in result['submissions']],
+        'skipped': result['skipped'],
+        'progress_url': f"/exam/{exam.id}/progress",
+    }), 202
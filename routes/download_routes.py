@@ -0,0 +1,34 @@
+from bson import ObjectId
+from flask import Blueprint, jsonify, request
+from flask_login import login_required, current_user
+from models import Exam, Submission
+from utils.gridfs_streaming import send_gridfs_file
+
+download_bp = Blueprint('download', __name__)
+
+
+def _owned_submission(submission_id):
+    """Return the submission if its exam belongs to the current user, else None"""
+    if not ObjectId.is_valid(submission_id):
+        return None
+    # The exam reference is checked by id, without loading the exam and its faculty
+    submission = Submission.objects(id=submission_id).no_dereference().first()
+    if submission is None or not Exam.objects(id=submission.exam.id, faculty=current_user.id).count():
+        return None
+    return submission
+
+
+@download_bp.route('/submission/<submission_id>/file')
+@login_required
+def submission_file(submission_id):
+    """Stream a submission's answer paper from GridFS (supports Range and conditional GET)"""
+    submission = _owned_submission(submission_id)
+    if submission is None:
+        return jsonify({'error': 'Submission not found'}), 404
+
+    grid_out = submission.open_file()
+    if grid_out is None:
+        return jsonify({'error': 'Submission has no file'}), 404
+
+    as_attachment = request.args.get('download') == '1'
+    return send_gridfs_file(grid_out, download_name=submission.get_file_name(), as_attachment=as_attachment)
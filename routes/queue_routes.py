@@ -0,0 +1,102 @@
+import logging
+from flask import Blueprint, jsonify
+from flask_login import login_required, current_user
+from models import Exam, Submission
+from utils.job_queue import get_job_queue, enqueue_submission
+from utils.answer_scoring import score_exam
+
+queue_bp = Blueprint('queue', __name__)
+
+
+def _owned_exam(exam_id):
+    """Return the exam if it belongs to the current user, else None"""
+    try:
+        return Exam.objects(id=exam_id, faculty=current_user.id).first()
+    except Exception:
+        return None
+
+
+@queue_bp.route('/exam/<exam_id>/progress')
+@login_required
+def exam_progress(exam_id):
+    """JSON processing progress for all submissions of an exam"""
+    exam = _owned_exam(exam_id)
+    if exam is None:
+        return jsonify({'error': 'Exam not found'}), 404
+
+    total = Submission.objects(exam=exam).count()
+    processed = Submission.objects(exam=exam, processed=True).count()
+    jobs = get_job_queue().progress(exam.id)
+
+    return jsonify({
+        'exam_id': str(exam.id),
+        'total_submissions': total,
+        'processed_submissions': processed,
+        'percent_complete': round(100.0 * processed / total, 1) if total else 100.0,
+        'jobs': jobs,
+    })
+
+
+@queue_bp.route('/submission/<submission_id>/process', methods=['POST'])
+@login_required
+def queue_submission(submission_id):
+    """Queue (or re-queue) a submission for background processing"""
+    submission = Submission.objects(id=submission_id).first()
+    if submission is None or _owned_exam(submission.exam.id) is None:
+        return jsonify({'error': 'Submission not found'}), 404
+
+    enqueue_submission(submission)
+    logging.debug(f"Submission {submission_id} queued by {current_user.username}")
+    return jsonify({'submission_id': str(submission.id), 'status': 'queued'}), 202
+
+
+@queue_bp.route('/submission/<submission_id>/resegment', methods=['POST'])
+@login_required
+def resegment_submission_route(submission_id):
+    """Queue a processed submission for re-segmentation from its stored OCR document (no OCR)"""
+    submission = Submission.objects(id=submission_id).first()
+    if submission is None or _owned_exam(submission.exam.id) is None:
+        return jsonify({'error': 'Submission not found'}), 404
+    if not submission.processed:
+        return jsonify({'error': 'Submission has not been processed yet'}), 409
+
+    # Grading may call the model for every changed answer, so it runs in a worker
+    enqueue_submission(submission, kind='resegment')
+    return jsonify({'submission_id': str(submission.id), 'status': 'queued'}), 202
+
+
+@queue_bp.route('/submission/<submission_id>/pages/<int:page_number>/reocr', methods=['POST'])
+@login_required
+def reocr_submission_page(submission_id, page_number):
+    """Queue one page of a submission for re-OCR; the rest of the OCR document is kept"""
+    from utils.submission_processor import request_page_reocr
+    submission = Submission.objects(id=submission_id).first()
+    if submission is None or _owned_exam(submission.exam.id) is None:
+        return jsonify({'error': 'Submission not found'}), 404
+    if page_number < 1:
+        return jsonify({'error': 'Invalid page number'}), 400
+
+    # Without a stored OCR document the whole file has to be processed anyway
+    partial = request_page_reocr(submission, [page_number])
+    enqueue_submission(submission)
+    return jsonify({
+        'submission_id': str(submission.id),
+        'page': page_number if partial else None,
+        'status': 'queued',
+    }), 202
+
+
+@queue_bp.route('/exam/<exam_id>/rescore', methods=['POST'])
+@login_required
+def rescore_exam(exam_id):
+    """Recompute similarity scores for every processed answer of an exam in one batch"""
+    exam = _owned_exam(exam_id)
+    if exam is None:
+        return jsonify({'error': 'Exam not found'}), 404
+
+    try:
+        result = score_exam(exam)
+    except ValueError as e:
+        # Model-graded answers are not rescored locally
+        return jsonify({'error': str(e)}), 409
+    return jsonify({'exam_id': str(exam.id), **result})
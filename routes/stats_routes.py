@@ -0,0 +1,35 @@
+from flask import Blueprint, jsonify
+from flask_login import login_required, current_user
+from models import Exam
+from utils.exam_stats import get_exam_stats, rebuild_exam_stats
+
+stats_bp = Blueprint('stats', __name__)
+
+
+@stats_bp.route('/exam/<exam_id>/stats')
+@login_required
+def exam_stats(exam_id):
+    """JSON summary statistics for an exam, read from its materialized ExamStats document"""
+    try:
+        exam = Exam.objects(id=exam_id, faculty=current_user.id).first()
+    except Exception:
+        exam = None
+    if exam is None:
+        return jsonify({'error': 'Exam not found'}), 404
+
+    return jsonify({'exam_id': str(exam.id), **get_exam_stats(exam)})
+
+
+@stats_bp.route('/exam/<exam_id>/stats/rebuild', methods=['POST'])
+@login_required
+def rebuild_stats(exam_id):
+    """Recompute an exam's statistics from its graded submissions"""
+    try:
+        exam = Exam.objects(id=exam_id, faculty=current_user.id).first()
+    except Exception:
+        exam = None
+    if exam is None:
+        return jsonify({'error': 'Exam not found'}), 404
+
+    rebuild_exam_stats(exam)
+    return jsonify({'exam_id': str(exam.id), **get_exam_stats(exam)})
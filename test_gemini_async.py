@@ -0,0 +1,169 @@
+"""
+Test the concurrent Gemini client against a local stub server
+
+The stub speaks the generateContent API, answers every request after a fixed
+latency, rejects every FAILURE_EVERY-th request with 429 / 503, rejects any request
+containing BAD_PAGE with a 400, and reports how many requests were in flight
+at once. Failures and page contents are deterministic, so every run sends the
+same requests and sees the same number of rejections. No API key or network
+access is needed.
+"""
+
+import re
+import json
+import base64
+import time
+import random
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+PAGES = 40
+LATENCY = 0.5  # Seconds per stub response
+FAILURE_EVERY = 7  # Every 7th request is answered with 429, then 503, alternately
+SEED = 1234  # Seed of the generated page contents
+BAD_PAGE = b"not an image"  # Rejected with a non-retryable 400, like a corrupt upload
+BAD_DATA = base64.b64encode(BAD_PAGE).decode("ascii")
+
+
+class StubState:
+    lock = threading.Lock()
+    in_flight = 0
+    max_in_flight = 0
+    requests = 0
+    rejected = 0
+    images = 0
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        body = json.loads(self.rfile.read(length))
+        parts = body["contents"][0]["parts"]
+        images = [part for part in parts if "inline_data" in part]
+
+        with StubState.lock:
+            StubState.requests += 1
+            request_number = StubState.requests
+            StubState.in_flight += 1
+            StubState.max_in_flight = max(StubState.max_in_flight, StubState.in_flight)
+        try:
+            time.sleep(LATENCY)
+            if any(part["inline_data"]["data"] == BAD_DATA for part in images):
+                self.send_response(400)
+                self.end_headers()
+                return
+            if request_number % FAILURE_EVERY == 0:
+                with StubState.lock:
+                    StubState.rejected += 1
+                status = 429 if request_number % (2 * FAILURE_EVERY) else 503
+                self.send_response(status)
+                self.send_header('Retry-After', '0.2')
+                self.end_headers()
+                return
+
+            with StubState.lock:
+                StubState.images += len(images)
+            if len(images) == 1:
+                text = f"Q1 stub answer for a page of {len(images[0]['inline_data']['data'])} bytes"
+            else:
+                text = "\n".join(f"=== PAGE {i} ===\nQ{i} stub answer" for i in range(1, len(images) + 1))
+            payload = json.dumps({"candidates": [{"content": {"parts": [{"text": text}]}}]}).encode()
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+        finally:
+            with StubState.lock:
+                StubState.in_flight -= 1
+
+
+def make_pages(count, rng, min_size=1000, max_size=5000):
+    """Random page bytes from a seeded generator"""
+    return [(rng.randbytes(rng.randint(min_size, max_size)), "image/png") for _ in range(count)]
+
+
+def start_stub():
+    """Stub server on a free port and a GeminiService pointed at it"""
+    from utils.gemini_client import AsyncGeminiClient, GeminiService
+
+    with StubState.lock:
+        StubState.requests = StubState.rejected = StubState.images = StubState.max_in_flight = 0
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StubHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f"http://127.0.0.1:{server.server_address[1]}"
+    print(f"Stub server listening on {base_url}")
+
+    client = AsyncGeminiClient(
+        api_key="stub",
+        base_url=base_url,
+        max_concurrency=8,
+        requests_per_minute=600,
+        images_per_request=4,
+    )
+    return server, client, GeminiService(client)
+
+
+def test_concurrent_extraction():
+    """Extract a class's worth of pages through the stub and report throughput"""
+
+    server, client, service = start_stub()
+    pages = make_pages(PAGES, random.Random(SEED))
+
+    print(f"Extracting {PAGES} pages...")
+    print('='*70)
+    started = time.perf_counter()
+    texts = service.extract_many(pages)
+    elapsed = time.perf_counter() - started
+    service.stop()
+    server.shutdown()
+
+    failed = [i for i, text in enumerate(texts) if not re.search(r"stub answer", text)]
+    serial = PAGES * LATENCY
+
+    print(f"Pages extracted:       {len(texts) - len(failed)}/{PAGES}")
+    print(f"Elapsed:               {elapsed:.2f}s (one page per round trip: {serial:.1f}s)")
+    print(f"Stub requests:         {StubState.requests} ({StubState.rejected} rejected with 429/503)")
+    print(f"Images per request:    {StubState.images / max(1, StubState.requests - StubState.rejected):.1f}")
+    print(f"Max requests in flight: {StubState.max_in_flight} (limit {client.max_concurrency})")
+    print(f"Client stats:          {client.stats()}")
+    print('='*70)
+
+    assert not failed, f"{len(failed)} pages came back without text: {failed}"
+    assert StubState.max_in_flight <= client.max_concurrency, \
+        f"{StubState.max_in_flight} requests in flight, limit {client.max_concurrency}"
+    assert StubState.images / max(1, StubState.requests - StubState.rejected) > 1, "pages were not packed"
+    print("OK")
+
+
+def test_bad_page_fails_alone():
+    """A page the API rejects fails only itself, not the pages packed into the same request"""
+
+    from utils.gemini_client import GeminiError
+
+    server, client, service = start_stub()
+    pages = make_pages(3, random.Random(SEED), 2000, 2000)
+    pages.insert(1, (BAD_PAGE, "image/png"))
+
+    futures = [service.submit(page) for page in pages]
+    outcomes = []
+    for future in futures:
+        try:
+            outcomes.append(future.result())
+        except GeminiError as e:
+            outcomes.append(e)
+    service.stop()
+    server.shutdown()
+
+    assert isinstance(outcomes[1], GeminiError), f"bad page returned {outcomes[1]!r}"
+    good = [outcome for i, outcome in enumerate(outcomes) if i != 1]
+    assert all(isinstance(text, str) and "stub answer" in text for text in good), good
+    print("OK: only the bad page failed")
+
+
+if __name__ == "__main__":
+    test_concurrent_extraction()
+    test_bad_page_fails_alone()
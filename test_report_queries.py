@@ -0,0 +1,106 @@
+"""
+Test that an exam report loads in a fixed number of MongoDB queries
+
+Creates a throwaway faculty, exam, questions, submissions, answers and
+grades in the configured database, loads the report under
+assert_max_queries(6) with and without detail, touches every reference a
+report page renders, and removes the data again. Needs the MongoDB
+configured in app.py; without it (or without the app's dependencies) the
+test is skipped.
+"""
+import uuid
+
+try:
+    from app import app, MONGODB_URI
+    from models import User, Exam, Question, Submission, SubmissionAnswer, Grade
+    from utils.data_access import load_exam_report
+    from utils.query_counter import assert_max_queries
+    IMPORT_ERROR = None
+except ImportError as e:
+    app = None
+    IMPORT_ERROR = e
+
+PING_TIMEOUT_MS = 3000
+SUBMISSIONS = 12
+# Inserted out of position, so ObjectId order differs from question order
+QUESTION_LABELS = ["10", "2", "2b", "1"]
+
+
+def unavailable_reason():
+    """Why the test cannot run here, or None"""
+    if IMPORT_ERROR is not None:
+        return f"app could not be imported: {IMPORT_ERROR}"
+    from pymongo import MongoClient
+    try:
+        client = MongoClient(MONGODB_URI, serverSelectionTimeoutMS=PING_TIMEOUT_MS)
+        try:
+            client.admin.command('ping')
+        finally:
+            client.close()
+    except Exception as e:
+        return f"MongoDB not reachable: {e}"
+    return None
+
+
+def create_exam():
+    """Exam with QUESTION_LABELS questions and SUBMISSIONS graded submissions"""
+    tag = uuid.uuid4().hex[:8]
+    faculty = User(username=f"report-test-{tag}", email=f"report-test-{tag}@example.com", password="x").save()
+    exam = Exam(title=f"Report query test {tag}", faculty=faculty).save()
+    questions = [
+        Question(exam=exam, text=f"Question {label}", answer_key="Answer", max_score=5.0, order=label).save()
+        for label in QUESTION_LABELS
+    ]
+    for number in range(SUBMISSIONS):
+        submission = Submission(exam=exam, student_name=f"Student {number}", student_id=str(number),
+                                processed=True).save()
+        SubmissionAnswer.objects.insert([
+            SubmissionAnswer(submission=submission, question=question, sort_order=question.sort_order,
+                             extracted_text="Answer", score=3.0)
+            for question in questions
+        ], load_bulk=False)
+        Grade.objects.insert([
+            Grade(submission=submission, question=question, final_score=3.0, strengths=["Clear"])
+            for question in questions
+        ], load_bulk=False)
+    return faculty, exam
+
+
+def check_report(exam, detail):
+    with assert_max_queries(6) as counter:
+        report = load_exam_report(exam.id, detail=detail)
+        # Everything a report page renders must already be loaded
+        assert report.exam.faculty.username
+        for entry in report.submissions:
+            assert entry.submission.exam.title == exam.title
+            labels = [answer.question.order for answer in entry.answers]
+            assert labels == ["1", "2", "2b", "10"], labels
+            assert all(answer.submission.student_name for answer in entry.answers)
+            assert len(entry.grades) == len(QUESTION_LABELS)
+            assert all(grade.question.text for grade in entry.grades)
+    assert len(report.submissions) == SUBMISSIONS
+    print(f"✓ Report (detail={detail}) loaded in {counter.count} queries: {', '.join(counter.commands)}")
+
+
+def test_exam_report_query_count():
+    reason = unavailable_reason()
+    if reason:
+        import pytest
+        pytest.skip(reason)
+    with app.app_context():
+        faculty, exam = create_exam()
+        try:
+            check_report(exam, detail=True)
+            check_report(exam, detail=False)
+        finally:
+            # Questions, submissions, answers and grades cascade from the exam
+            exam.delete()
+            faculty.delete()
+
+
+if __name__ == "__main__":
+    reason = unavailable_reason()
+    if reason:
+        print(f"⚠ Skipped: {reason}")
+    else:
+        test_exam_report_query_count()
@@ -0,0 +1,179 @@
+"""
+Precomputed answer-key index per Question
+
+Tokenizing the answer key, deriving its keyword set and weighting it as a
+TF-IDF vector do not depend on the student answers, so they are done once per
+question and stored in the question_index collection together with a hash of
+the inputs. The IDF is fitted over the answer keys of the whole exam (terms
+every key shares weigh less than terms specific to one question) and stored
+with each index, so any answer can be weighted the same way without fitting
+a vectorizer.
+
+Indexes are built lazily: load_exam_index fetches every question's index for
+an exam in one query and rebuilds only entries whose content hash (question
+fields plus the exam's key vocabulary) is stale, so editing a question costs
+no extra queries.
+"""
+import re
+import math
+import hashlib
+import logging
+from collections import Counter
+from datetime import datetime
+
+from sklearn.feature_extraction.text import ENGLISH_STOP_WORDS
+
+logger = logging.getLogger(__name__)
+
+# Same token definition as TfidfVectorizer's default token_pattern
+TOKEN_PATTERN = re.compile(r"(?u)\b\w\w+\b")
+
+# Tokens shorter than this are not treated as key terms
+MIN_KEYWORD_LENGTH = 4
+
+
+def normalize_tokens(text):
+    """Lowercase word tokens with English stop words removed"""
+    return [token for token in TOKEN_PATTERN.findall((text or "").lower()) if token not in ENGLISH_STOP_WORDS]
+
+
+def exam_idf(key_tokens):
+    """
+    Smoothed IDF over a set of answer keys, as TfidfVectorizer computes it
+
+    Args:
+        key_tokens: One token list per answer key
+
+    Returns:
+        Tuple of (dict token -> idf, idf of a token that no key contains)
+    """
+    documents = len(key_tokens)
+    frequencies = Counter(token for tokens in key_tokens for token in set(tokens))
+    idf = {token: math.log((1 + documents) / (1 + frequency)) + 1 for token, frequency in frequencies.items()}
+    return idf, math.log(1 + documents) + 1
+
+
+def tfidf_vector(tokens, idf, default_idf):
+    """L2-normalized TF-IDF weights of a token list, as a dict token -> weight"""
+    weights = {token: count * idf.get(token, default_idf) for token, count in Counter(tokens).items()}
+    norm = math.sqrt(sum(weight * weight for weight in weights.values()))
+    return {token: weight / norm for token, weight in weights.items()} if norm else {}
+
+
+def vocabulary_hash(idf):
+    """Hash of an exam's IDF table; indexes built with another table are stale"""
+    payload = "\0".join(f"{token}:{weight:.6f}" for token, weight in sorted(idf.items()))
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def question_hash(question, vocabulary=""):
+    """Hash of everything the index is derived from"""
+    payload = "\0".join([
+        question.text or "",
+        question.answer_key or "",
+        str(question.max_score),
+        str(question.min_word_count),
+        vocabulary,
+    ])
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def index_fields(question, tokens, idf, default_idf):
+    """Field values of a QuestionIndex for a question, given the exam's IDF"""
+    return {
+        'tokens': tokens,
+        'keywords': sorted({token for token in tokens if len(token) >= MIN_KEYWORD_LENGTH}),
+        'key_vector': tfidf_vector(tokens, idf, default_idf),
+        'idf': idf,
+        'default_idf': default_idf,
+        'max_score': question.max_score,
+        'min_word_count': question.min_word_count,
+    }
+
+
+def transient_index(question):
+    """Unsaved QuestionIndex for a question scored on its own, with the IDF of its key alone"""
+    from models import QuestionIndex
+
+    tokens = normalize_tokens(question.answer_key)
+    idf, default_idf = exam_idf([tokens])
+    return QuestionIndex(**index_fields(question, tokens, idf, default_idf))
+
+
+def build_question_index(question, tokens, idf, default_idf, content_hash):
+    """
+    Build (or rebuild) the stored index for a question
+
+    Args:
+        question: Question document
+        tokens: Normalized answer-key tokens
+        idf, default_idf: The exam's IDF table (see exam_idf)
+        content_hash: question_hash of the question and the exam vocabulary
+
+    Returns:
+        The saved QuestionIndex
+    """
+    from models import QuestionIndex
+
+    updates = {f'set__{name}': value for name, value in index_fields(question, tokens, idf, default_idf).items()}
+    index = QuestionIndex.objects(question=question).modify(
+        upsert=True,
+        new=True,
+        set__exam=question.exam,
+        set__content_hash=content_hash,
+        set__built_at=datetime.utcnow(),
+        **updates
+    )
+    logger.debug(f"Rebuilt answer-key index for question {question.id}")
+    return index
+
+
+def load_exam_index(exam, questions):
+    """
+    Load the answer-key index for every question of an exam in one query
+
+    Missing and stale indexes are rebuilt here, so questions edited (or
+    added, which changes the exam's IDF) since the last load are picked up.
+
+    Args:
+        exam: Exam document
+        questions: All Question documents of the exam
+
+    Returns:
+        Dict of question id -> QuestionIndex
+    """
+    from models import QuestionIndex
+
+    key_tokens = {question.id: normalize_tokens(question.answer_key) for question in questions}
+    idf, default_idf = exam_idf(list(key_tokens.values()))
+    vocabulary = vocabulary_hash(idf)
+
+    indexes = {index.question.id: index for index in QuestionIndex.objects(exam=exam).no_dereference()}
+    for question in questions:
+        content_hash = question_hash(question, vocabulary)
+        index = indexes.get(question.id)
+        if index is None or index.content_hash != content_hash:
+            indexes[question.id] = build_question_index(question, key_tokens[question.id], idf, default_idf,
+                                                        content_hash)
+    return indexes
+
+
+def key_similarity(index, tokens):
+    """
+    Cosine similarity of answer tokens to the stored answer-key vector
+
+    The answer is weighted with the same IDF as the key, so an answer gets the
+    same similarity whether it is scored alone or with the rest of its exam.
+    """
+    if index is None or not index.key_vector:
+        return 0.0
+    vector = tfidf_vector(tokens, index.idf or {}, index.default_idf or 1.0)
+    return min(1.0, float(sum(weight * index.key_vector.get(token, 0.0) for token, weight in vector.items())))
+
+
+def keyword_coverage(index, tokens):
+    """Fraction of the answer key's keywords that appear in the answer tokens"""
+    if index is None or not index.keywords:
+        return None
+    present = set(tokens)
+    return sum(1 for keyword in index.keywords if keyword in present) / len(index.keywords)
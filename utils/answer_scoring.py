@@ -0,0 +1,184 @@
+"""
+Local answer scoring based on TF-IDF similarity to the answer key
+
+score_answer handles a single answer as it is processed; score_exam rescores
+every answer of an exam at once. Both compare answers with the answer-key
+vector and exam IDF stored by utils.answer_index, so an answer gets the same
+similarity whichever path scores it and no vectorizer is fitted per answer.
+"""
+import logging
+import re
+from collections import defaultdict
+
+import numpy as np
+from pymongo import UpdateOne
+
+from utils.answer_index import normalize_tokens, keyword_coverage, key_similarity, load_exam_index, transient_index
+
+logger = logging.getLogger(__name__)
+
+WORD_PATTERN = re.compile(r"[A-Za-z0-9']+")
+
+
+def similarity_score(key_index, student_answer):
+    """
+    Cosine similarity between the TF-IDF vectors of the answer key and a student answer
+
+    Args:
+        key_index: QuestionIndex with the answer-key vector and exam IDF
+        student_answer: Student answer text
+
+    Returns:
+        Float between 0 and 1
+    """
+    return key_similarity(key_index, normalize_tokens(student_answer))
+
+
+def score_from_similarity(similarity, word_count, max_score, min_word_count):
+    """Turn a similarity into a score, scaled down for answers shorter than the minimum word count"""
+    score = similarity * max_score
+    if min_word_count and word_count < min_word_count:
+        score *= word_count / min_word_count
+    return round(score, 2)
+
+
+def build_feedback(similarity, word_count, min_word_count, coverage=None):
+    """Short explanation of a locally computed score"""
+    feedback = f"Similarity to answer key: {similarity:.0%}."
+    if coverage is not None:
+        feedback += f" Key terms covered: {coverage:.0%}."
+    if min_word_count and word_count < min_word_count:
+        feedback += f" Answer has {int(word_count)} words; at least {min_word_count} expected."
+    return feedback
+
+
+def score_answer(question, answer_text, key_index=None):
+    """
+    Score one answer against its question
+
+    Args:
+        question: Question document
+        answer_text: Extracted answer text
+        key_index: QuestionIndex from load_exam_index; without it the key is
+            weighted on its own, which can differ from score_exam
+
+    Returns:
+        Dict with score, similarity_score and feedback
+    """
+    if key_index is None:
+        key_index = transient_index(question)
+    tokens = normalize_tokens(answer_text)
+    similarity = key_similarity(key_index, tokens)
+    word_count = len(WORD_PATTERN.findall(answer_text or ""))
+    score = score_from_similarity(similarity, word_count, question.max_score, question.min_word_count)
+    coverage = keyword_coverage(key_index, tokens)
+
+    return {
+        "score": score,
+        "similarity_score": similarity,
+        "feedback": build_feedback(similarity, word_count, question.min_word_count, coverage),
+    }
+
+
+def batch_similarity(key_index, answer_tokens):
+    """
+    Cosine similarity of many answers to one answer key
+
+    Args:
+        key_index: QuestionIndex with the answer-key vector and exam IDF
+        answer_tokens: List of normalized token lists, one per answer
+
+    Returns:
+        NumPy array of similarities, one per answer
+    """
+    return np.array([key_similarity(key_index, tokens) for tokens in answer_tokens], dtype=float)
+
+
+def batch_scores(similarities, word_counts, max_score, min_word_count):
+    """Vectorized score_from_similarity"""
+    scores = similarities * max_score
+    if min_word_count:
+        scores = scores * np.minimum(1.0, word_counts / float(min_word_count))
+    return np.round(scores, 2)
+
+
+def score_exam(exam):
+    """
+    Rescore every SubmissionAnswer of an exam in one pass
+
+    Only answers graded by the local backend can be rescored: model-graded
+    scores would be overwritten by TF-IDF ones, so this refuses to run when
+    GRADING_BACKEND is not "local".
+
+    Args:
+        exam: Exam document
+
+    Returns:
+        Dict with the number of answers and submissions updated
+
+    Raises:
+        ValueError: If the configured grading backend is not local
+    """
+    from models import Question, Submission, SubmissionAnswer
+    from utils.gemini_grading import GRADING_BACKEND
+
+    if GRADING_BACKEND != "local":
+        raise ValueError(f"Rescoring needs the local grading backend, not {GRADING_BACKEND}")
+
+    questions = {question.id: question for question in Question.objects(exam=exam)}
+    submission_ids = list(Submission.objects(exam=exam).scalar('id'))
+    if not questions or not submission_ids:
+        return {"answers": 0, "submissions": 0}
+    key_indexes = load_exam_index(exam, questions.values())
+
+    by_question = defaultdict(list)
+    answers = SubmissionAnswer.objects(submission__in=submission_ids).no_dereference().only(
+        'id', 'submission', 'question', 'extracted_text'
+    )
+    for answer in answers:
+        by_question[answer.question.id].append(answer)
+
+    answer_ops = []
+    totals = defaultdict(float)
+    max_totals = defaultdict(float)
+    for question_id, question_answers in by_question.items():
+        question = questions.get(question_id)
+        if question is None:
+            continue
+        key_index = key_indexes.get(question_id)
+        texts = [answer.extracted_text or "" for answer in question_answers]
+        tokens = [normalize_tokens(text) for text in texts]
+        similarities = batch_similarity(key_index, tokens)
+        word_counts = np.array([len(WORD_PATTERN.findall(text)) for text in texts], dtype=float)
+        scores = batch_scores(similarities, word_counts, question.max_score, question.min_word_count)
+
+        for answer, answer_tokens, similarity, word_count, score in zip(
+                question_answers, tokens, similarities, word_counts, scores):
+            coverage = keyword_coverage(key_index, answer_tokens)
+            feedback = build_feedback(similarity, word_count, question.min_word_count, coverage)
+            answer_ops.append(UpdateOne(
+                {"_id": answer.id},
+                {"$set": {"similarity_score": float(similarity), "score": float(score), "feedback": feedback}}
+            ))
+            totals[answer.submission.id] += float(score)
+            max_totals[answer.submission.id] += question.max_score
+
+    if answer_ops:
+        SubmissionAnswer._get_collection().bulk_write(answer_ops, ordered=False)
+
+    submission_ops = [
+        UpdateOne(
+            {"_id": submission_id},
+            {"$set": {"total_score": round(totals[submission_id], 2),
+                      "max_possible_score": max_totals[submission_id]}}
+        )
+        for submission_id in totals
+    ]
+    if submission_ops:
+        Submission._get_collection().bulk_write(submission_ops, ordered=False)
+        # Every total may have moved, so rebuild the statistics once rather than per row
+        from utils.exam_stats import rebuild_exam_stats
+        rebuild_exam_stats(exam)
+
+    logger.info(f"Rescored {len(answer_ops)} answers across {len(submission_ops)} submissions")
+    return {"answers": len(answer_ops), "submissions": len(submission_ops)}
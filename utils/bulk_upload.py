@@ -0,0 +1,212 @@
+"""
+Bulk ingestion of a whole class of answer papers
+
+Files come from a ZIP archive or a multi-file POST. Each file is streamed
+straight into GridFS (ZIP members are decompressed chunk by chunk, never held
+in memory as a whole), all Submission documents are created with a single
+insert, and processing is queued in one batch for the worker pool.
+
+Files over MAX_FILE_SIZE and files whose names collide (the student is
+derived from the file name, so two papers named alike cannot be told apart)
+are skipped and reported instead of ingested.
+"""
+import os
+import csv
+import io
+import logging
+import zipfile
+import mimetypes
+from collections import Counter
+from contextlib import nullcontext
+
+from bson import ObjectId
+from mongoengine.queryset.visitor import Q
+from werkzeug.utils import secure_filename
+
+from models import Submission, StudentDetail
+from utils.job_queue import get_job_queue
+
+logger = logging.getLogger(__name__)
+
+ALLOWED_EXTENSIONS = {'.pdf', '.jpg', '.jpeg', '.png'}
+MAX_FILE_SIZE = int(os.environ.get("BULK_MAX_FILE_SIZE", str(16 * 1024 * 1024)))
+
+
+def _is_answer_file(filename):
+    base = os.path.basename(filename)
+    if not base or base.startswith('.') or filename.startswith('__MACOSX/'):
+        return False
+    return os.path.splitext(base)[1].lower() in ALLOWED_EXTENSIONS
+
+
+def _content_type(filename):
+    return mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+
+
+def _stream_size(uploaded):
+    """Size of an uploaded file, from its (seekable) stream when possible"""
+    stream = uploaded.stream
+    try:
+        position = stream.tell()
+        stream.seek(0, os.SEEK_END)
+        size = stream.tell()
+        stream.seek(position)
+        return size
+    except (AttributeError, OSError, ValueError):
+        return uploaded.content_length or 0
+
+
+def iter_uploaded_files(archive=None, files=None):
+    """
+    Yield (filename, stream, reason) for every answer paper in the upload
+
+    Args:
+        archive: Uploaded ZIP (werkzeug FileStorage) or None
+        files: List of uploaded FileStorage objects or None
+
+    Yields:
+        Tuples of (filename, readable binary stream, None) for papers to
+        ingest, and (path, None, reason) for papers that must be skipped. A
+        stream is only valid until the next item is requested.
+    """
+    zf = None
+    # (path in the upload, size in bytes, opener of a binary stream)
+    candidates = []
+    if archive is not None and archive.filename:
+        zf = zipfile.ZipFile(archive.stream)
+        for member in zf.infolist():
+            if member.is_dir() or not _is_answer_file(member.filename):
+                continue
+            candidates.append((member.filename, member.file_size, lambda member=member: zf.open(member)))
+
+    for uploaded in files or []:
+        if uploaded and uploaded.filename and _is_answer_file(uploaded.filename):
+            candidates.append((uploaded.filename, _stream_size(uploaded),
+                               lambda uploaded=uploaded: nullcontext(uploaded.stream)))
+
+    # Folders inside the ZIP are dropped, so "a/1.pdf" and "b/1.pdf" would map to the same student
+    name_counts = Counter(os.path.basename(path) for path, _, _ in candidates)
+    try:
+        for path, size, open_stream in candidates:
+            filename = os.path.basename(path)
+            if name_counts[filename] > 1:
+                logger.warning(f"Skipping {path}: {name_counts[filename]} files are named {filename}")
+                yield path, None, f"{name_counts[filename]} uploaded files are named {filename}"
+            elif size > MAX_FILE_SIZE:
+                logger.warning(f"Skipping {path}: {size} bytes exceeds limit")
+                yield path, None, f"{size} bytes exceeds the {MAX_FILE_SIZE} byte limit"
+            else:
+                with open_stream() as stream:
+                    yield filename, stream, None
+    finally:
+        if zf is not None:
+            zf.close()
+
+
+def load_student_mapping(csv_file):
+    """
+    Read a CSV mapping answer file names to student USNs
+
+    Accepted headers: filename/file and usn/student_id (case-insensitive).
+
+    Returns:
+        Dict of filename -> USN
+    """
+    if csv_file is None or not csv_file.filename:
+        return {}
+
+    mapping = {}
+    reader = csv.DictReader(io.TextIOWrapper(csv_file.stream, encoding='utf-8-sig'))
+    for row in reader:
+        row = {(k or '').strip().lower(): (v or '').strip() for k, v in row.items()}
+        filename = row.get('filename') or row.get('file')
+        usn = row.get('usn') or row.get('student_id')
+        if filename and usn:
+            mapping[os.path.basename(filename)] = usn
+    return mapping
+
+
+def resolve_students(keys):
+    """Look up StudentDetail records for a set of USNs / student ids in one query"""
+    keys = list(set(keys))
+    if not keys:
+        return {}
+    students = {}
+    for student in StudentDetail.objects(Q(usn__in=keys) | Q(student_id__in=keys)):
+        for key in (student.usn, student.student_id):
+            if key:
+                students[key] = student
+    return students
+
+
+def _discard_submissions(submissions):
+    """Remove the stored files (and any inserted documents) of a batch that could not be queued"""
+    logger.error(f"Bulk upload failed; removing {len(submissions)} stored files")
+    try:
+        Submission.objects(id__in=[submission.id for submission in submissions]).delete()
+    except Exception as e:
+        logger.error(f"Failed to remove submissions of the failed upload: {e}")
+    for submission in submissions:
+        try:
+            submission.original_file.delete()
+        except Exception as e:
+            logger.error(f"Failed to remove the stored file of {submission.student_id}: {e}")
+
+
+def ingest_submissions(exam, uploaded_files, mapping=None):
+    """
+    Create one Submission per uploaded file and queue them all for processing
+
+    Args:
+        exam: Exam the papers belong to
+        uploaded_files: Iterable of (filename, stream, reason), e.g. from
+                        iter_uploaded_files; items with a reason are skipped
+        mapping: Optional dict of filename -> USN; otherwise the file name
+                 (without extension) is taken as the USN
+
+    Returns:
+        Dict with the created submissions and the files that were skipped
+    """
+    mapping = mapping or {}
+    pending = []
+    skipped = []
+
+    for filename, stream, reason in uploaded_files:
+        if reason is not None:
+            skipped.append({'filename': filename, 'reason': reason})
+            continue
+        usn = mapping.get(filename) or os.path.splitext(filename)[0]
+        # Ids are assigned up front so a partly failed insert can still be cleaned up
+        submission = Submission(id=ObjectId(), exam=exam, student_name=usn, student_id=usn)
+        try:
+            # GridFS reads the stream in chunks, so large papers never sit in memory
+            submission.original_file.put(
+                stream,
+                filename=secure_filename(filename),
+                content_type=_content_type(filename)
+            )
+        except Exception as e:
+            logger.error(f"Failed to store {filename}: {e}")
+            skipped.append({'filename': filename, 'reason': str(e)})
+            continue
+        pending.append(submission)
+
+    students = resolve_students(s.student_id for s in pending)
+    for submission in pending:
+        student = students.get(submission.student_id)
+        if student is not None:
+            submission.student_detail = student
+            submission.student_name = student.display_name or submission.student_name
+            submission.student_id = student.display_id or submission.student_id
+
+    if pending:
+        try:
+            # One insert_many for the whole batch; ids are assigned back onto the documents
+            Submission.objects.insert(pending, load_bulk=False)
+            get_job_queue().enqueue_many(pending)
+        except Exception:
+            _discard_submissions(pending)
+            raise
+
+    logger.info(f"Bulk upload for exam {exam.id}: {len(pending)} created, {len(skipped)} skipped")
+    return {'submissions': pending, 'skipped': skipped}
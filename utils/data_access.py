@@ -0,0 +1,157 @@
+"""
+Bulk loaders that avoid N+1 ReferenceField dereferencing
+
+Iterating exam.submissions and touching submission.answers, answer.question
+or grade.submission issues one query per row. These loaders fetch each
+collection once with an id-set ($in) query and attach the already-loaded
+documents to the references in memory, so an exam report costs a constant
+number of queries however many submissions it has.
+"""
+import logging
+from collections import defaultdict
+
+from models import User, Exam, Question, Submission, SubmissionAnswer, Grade
+
+logger = logging.getLogger(__name__)
+
+# What a class summary table renders; feedback text, answer text and grade lists are left out
+ANSWER_SUMMARY_FIELDS = ('id', 'submission', 'question', 'score', 'similarity_score')
+GRADE_SUMMARY_FIELDS = ('id', 'submission', 'question', 'relevance_score', 'accuracy_score', 'grammar_score',
+                        'completeness_score', 'word_count_score', 'final_score', 'graded_at')
+
+
+def _attach(document, field_name, value):
+    """Point a reference at an already-loaded document without marking it changed"""
+    document._data[field_name] = value
+
+
+class SubmissionReport:
+    """A submission with its answers and grades, each already linked to its Question"""
+
+    def __init__(self, submission):
+        self.submission = submission
+        self.answers = []
+        self.grades = []
+
+    def __repr__(self):
+        return f'<SubmissionReport {self.submission.student_name} - {len(self.answers)} answers>'
+
+
+class ExamReport:
+    """Everything an exam report page renders, loaded in a fixed number of queries"""
+
+    def __init__(self, exam, questions, submissions):
+        self.exam = exam
+        self.questions = questions
+        self.submissions = submissions
+
+    def __repr__(self):
+        return f'<ExamReport {self.exam.title} - {len(self.submissions)} submissions>'
+
+
+def load_exam_report(exam_id, include_grades=True, detail=True):
+    """
+    Load an exam with its questions, submissions, answers and grades
+
+    Issues six queries (exam, faculty, questions, submissions, answers,
+    grades) regardless of class size. Reference fields on the returned
+    documents point at the preloaded objects, so templates can use
+    answer.question.order or submission.exam.title freely.
+
+    Args:
+        exam_id: Exam id
+        include_grades: Also load Grade documents
+        detail: Load answer texts, feedback and grade lists; False projects
+                answers and grades down to their scores for summary tables
+
+    Returns:
+        ExamReport, or None if the exam does not exist
+    """
+    exam = Exam.objects(id=exam_id).no_dereference().first()
+    if exam is None:
+        return None
+    faculty = User.objects(id=exam.faculty.id).first()
+    _attach(exam, 'faculty', faculty)
+
+    questions = list(Question.objects(exam=exam.id).no_dereference())
+    question_map = {question.id: question for question in questions}
+    for question in questions:
+        _attach(question, 'exam', exam)
+
+    # The GridFS file is not needed for reporting
+    submissions = list(Submission.objects(exam=exam.id).no_dereference().exclude('original_file', 'file_path'))
+    reports = {}
+    for submission in submissions:
+        _attach(submission, 'exam', exam)
+        reports[submission.id] = SubmissionReport(submission)
+
+    submission_ids = list(reports)
+    if submission_ids:
+        # Default ordering (submission, sort_order) already yields each submission's answers in question order
+        answers = SubmissionAnswer.objects(submission__in=submission_ids).no_dereference()
+        answers = answers.exclude('spans') if detail else answers.only(*ANSWER_SUMMARY_FIELDS)
+        for answer in answers:
+            report = reports.get(answer.submission.id)
+            if report is None:
+                continue
+            _attach(answer, 'submission', report.submission)
+            question = question_map.get(answer.question.id)
+            if question is not None:
+                _attach(answer, 'question', question)
+            report.answers.append(answer)
+
+        if include_grades:
+            # Sorted on the (submission, question) index rather than by graded_at
+            grades = Grade.objects(submission__in=submission_ids).order_by(
+                'submission', 'question').no_dereference()
+            if not detail:
+                grades = grades.only(*GRADE_SUMMARY_FIELDS)
+            for grade in grades:
+                report = reports.get(grade.submission.id)
+                if report is None:
+                    continue
+                _attach(grade, 'submission', report.submission)
+                question = question_map.get(grade.question.id)
+                if question is not None:
+                    _attach(grade, 'question', question)
+                report.grades.append(grade)
+
+    return ExamReport(exam, questions, [reports[submission.id] for submission in submissions])
+
+
+def exam_overview(exams=None):
+    """
+    Question and submission counts plus faculty for many exams
+
+    Uses two aggregations and one faculty lookup instead of two counts and a
+    dereference per exam.
+
+    Args:
+        exams: Iterable of Exam documents (defaults to all exams)
+
+    Returns:
+        List of dicts with exam, faculty, question_count and submission_count
+    """
+    exams = list(exams if exams is not None else Exam.objects.no_dereference())
+    exam_ids = [exam.id for exam in exams]
+
+    counts = defaultdict(lambda: {'questions': 0, 'submissions': 0})
+    for model, key in ((Question, 'questions'), (Submission, 'submissions')):
+        for row in model.objects(exam__in=exam_ids).aggregate([
+            {"$group": {"_id": "$exam", "count": {"$sum": 1}}}
+        ]):
+            counts[row["_id"]][key] = row["count"]
+
+    faculty_ids = {exam._data['faculty'].id for exam in exams if exam._data.get('faculty') is not None}
+    faculty = {user.id: user for user in User.objects(id__in=list(faculty_ids))}
+
+    overview = []
+    for exam in exams:
+        ref = exam._data.get('faculty')
+        overview.append({
+            'exam': exam,
+            'faculty': faculty.get(getattr(ref, 'id', ref)),
+            'question_count': counts[exam.id]['questions'],
+            'submission_count': counts[exam.id]['submissions'],
+        })
+    return overview
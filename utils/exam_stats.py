@@ -0,0 +1,204 @@
+"""
+Incrementally maintained exam statistics
+
+Every time a submission is graded or re-graded, record_result applies the
+difference between its old and new result to the exam's ExamStats document
+with a single atomic $inc, so report pages read one document instead of
+aggregating over every answer row.
+
+An exam without a statistics document (graded before statistics existed,
+or never graded) gets one rebuilt from all its graded submissions on its
+first result, instead of having differences applied to an empty document.
+Every write bumps a version field; a rebuild only replaces the document if
+the version it started from is unchanged, and otherwise starts over, so
+results recorded while it was scanning are not lost.
+"""
+import math
+import logging
+from collections import Counter
+from datetime import datetime
+
+from bson import ObjectId
+from pymongo.errors import DuplicateKeyError
+
+logger = logging.getLogger(__name__)
+
+HISTOGRAM_BUCKETS = 10
+
+# Rebuilds that lost the race to a concurrent result are retried this often
+REBUILD_ATTEMPTS = 5
+
+
+class SubmissionResult:
+    """The part of a graded submission that feeds the exam statistics"""
+
+    def __init__(self, total_score, max_possible_score, question_scores):
+        self.total_score = total_score
+        self.max_possible_score = max_possible_score
+        self.question_scores = question_scores  # question id -> score
+
+    def __repr__(self):
+        return f'<SubmissionResult {self.total_score}/{self.max_possible_score}>'
+
+
+def histogram_bucket(score, max_score):
+    """Percentage bucket "0".."9" for a score (100% falls in the top bucket)"""
+    if not max_score:
+        return "0"
+    fraction = min(max(score / max_score, 0.0), 1.0)
+    return str(min(int(fraction * HISTOGRAM_BUCKETS), HISTOGRAM_BUCKETS - 1))
+
+
+def _increments(result, sign):
+    """$inc terms contributed by one submission result"""
+    terms = Counter()
+    if result is None:
+        return terms
+    terms['graded_count'] += sign
+    terms['score_sum'] += sign * result.total_score
+    terms['score_sq_sum'] += sign * result.total_score ** 2
+    terms['max_possible_sum'] += sign * result.max_possible_score
+    terms[f'histogram.{histogram_bucket(result.total_score, result.max_possible_score)}'] += sign
+    for question_id, score in result.question_scores.items():
+        terms[f'questions.{question_id}.score_sum'] += sign * score
+        terms[f'questions.{question_id}.count'] += sign
+    return terms
+
+
+def record_result(exam_id, old_result, new_result):
+    """
+    Apply a grading change to the exam statistics in one atomic update
+
+    Args:
+        exam_id: Exam id
+        old_result: SubmissionResult before re-grading, or None for a first grade
+        new_result: SubmissionResult after grading, or None if the result was removed
+    """
+    from models import ExamStats
+
+    exam_id = ObjectId(str(exam_id))
+    terms = _increments(new_result, 1)
+    terms.update(_increments(old_result, -1))
+    inc = {key: value for key, value in terms.items() if value}
+    inc['version'] = 1
+    update = {'$set': {'updated_at': datetime.utcnow()}, '$inc': inc}
+    if ExamStats._get_collection().update_one({'exam': exam_id}, update).matched_count:
+        return
+
+    # No statistics yet: earlier submissions were never counted, so build them from
+    # every graded submission (the result being recorded is already saved)
+    logger.info(f"Building statistics for exam {exam_id} from its graded submissions")
+    _rebuild(exam_id)
+
+
+def _stats_document(exam_id):
+    """Statistics document computed from the graded submissions of an exam"""
+    from models import Submission, SubmissionAnswer
+
+    terms = Counter()
+    submissions = list(Submission.objects(exam=exam_id, processed=True).only('id', 'total_score', 'max_possible_score'))
+    question_scores = {submission.id: {} for submission in submissions}
+    if submissions:
+        answers = SubmissionAnswer.objects(submission__in=list(question_scores)).no_dereference().only(
+            'submission', 'question', 'score'
+        )
+        for answer in answers:
+            question_scores[answer.submission.id][str(answer.question.id)] = answer.score
+    for submission in submissions:
+        result = SubmissionResult(submission.total_score, submission.max_possible_score,
+                                  question_scores[submission.id])
+        terms.update(_increments(result, 1))
+
+    document = {
+        'exam': exam_id,
+        'graded_count': 0,
+        'score_sum': 0.0,
+        'score_sq_sum': 0.0,
+        'max_possible_sum': 0.0,
+        'histogram': {},
+        'questions': {},
+        'updated_at': datetime.utcnow(),
+    }
+    for key, value in terms.items():
+        parts = key.split('.')
+        target = document
+        for part in parts[:-1]:
+            target = target.setdefault(part, {})
+        target[parts[-1]] = value
+    return document
+
+
+def _rebuild(exam_id):
+    """Replace an exam's statistics, unless a result is recorded while they are computed"""
+    from models import ExamStats
+
+    collection = ExamStats._get_collection()
+    for attempt in range(REBUILD_ATTEMPTS):
+        current = collection.find_one({'exam': exam_id}, {'version': 1})
+        document = _stats_document(exam_id)
+        if current is None:
+            document['version'] = 1
+            try:
+                collection.insert_one(document)
+                return True
+            except DuplicateKeyError:
+                continue
+        # A missing version (documents from before versioning) matches None
+        version = current.get('version')
+        document['version'] = (version or 0) + 1
+        if collection.replace_one({'exam': exam_id, 'version': version}, document).matched_count:
+            return True
+        logger.debug(f"Statistics of exam {exam_id} changed during rebuild (attempt {attempt + 1})")
+    logger.warning(f"Could not rebuild statistics of exam {exam_id}: results kept arriving during "
+                   f"{REBUILD_ATTEMPTS} attempts")
+    return False
+
+
+def rebuild_exam_stats(exam):
+    """
+    Recompute an exam's statistics from scratch (after batch rescoring or for backfill)
+
+    Returns:
+        The rebuilt ExamStats
+    """
+    from models import ExamStats
+
+    _rebuild(exam.id)
+    return ExamStats.objects(exam=exam).first()
+
+
+def get_exam_stats(exam):
+    """
+    Summary statistics for an exam report, read from one document
+
+    Returns:
+        Dict with counts, mean, standard deviation, histogram and per-question means
+    """
+    from models import ExamStats
+
+    stats = ExamStats.objects(exam=exam).no_dereference().first()
+    if stats is None or stats.graded_count <= 0:
+        return {
+            'graded_count': 0,
+            'mean_score': 0.0,
+            'std_score': 0.0,
+            'mean_percent': 0.0,
+            'histogram': [0] * HISTOGRAM_BUCKETS,
+            'question_means': {},
+        }
+
+    count = stats.graded_count
+    mean = stats.score_sum / count
+    variance = max(stats.score_sq_sum / count - mean ** 2, 0.0)
+    return {
+        'graded_count': count,
+        'mean_score': round(mean, 2),
+        'std_score': round(math.sqrt(variance), 2),
+        'mean_percent': round(100.0 * stats.score_sum / stats.max_possible_sum, 1) if stats.max_possible_sum else 0.0,
+        'histogram': [int(stats.histogram.get(str(bucket), 0)) for bucket in range(HISTOGRAM_BUCKETS)],
+        'question_means': {
+            question_id: round(values['score_sum'] / values['count'], 2)
+            for question_id, values in stats.questions.items()
+            if values.get('count')
+        },
+    }
@@ -0,0 +1,407 @@
+"""
+Concurrent, rate-limited Gemini client for page text extraction
+
+All Gemini traffic of a process goes through one asyncio event loop running
+in a background thread:
+
+- a semaphore bounds the requests in flight (GEMINI_MAX_CONCURRENCY)
+- a token bucket keeps the request rate at the quota (GEMINI_REQUESTS_PER_MINUTE)
+- 429 and 5xx responses and transport errors are retried with full-jitter
+  exponential backoff, honouring Retry-After when the server sends it
+- pages submitted close together are packed into one multi-image request
+  (up to GEMINI_IMAGES_PER_REQUEST), and the model is asked to label each
+  page's text so the reply can be split again; a reply that cannot be split
+  is retried page by page
+
+Callers in threads (the OCR escalation pool, the router) use submit() or
+extract_many() and get plain results back; async code can await
+extract_images() directly.
+
+Settings (environment variables):
+    GEMINI_API_KEY             - API key (required)
+    GEMINI_MODEL               - model name (default: gemini-2.0-flash)
+    GEMINI_BASE_URL            - API root, e.g. a local stub server (default: https://generativelanguage.googleapis.com)
+    GEMINI_MAX_CONCURRENCY     - requests in flight at most (default: 8)
+    GEMINI_REQUESTS_PER_MINUTE - request quota (default: 60)
+    GEMINI_BURST               - requests the bucket may release at once (default: GEMINI_MAX_CONCURRENCY)
+    GEMINI_MAX_RETRIES         - retries per request on 429/5xx/transport errors (default: 5)
+    GEMINI_TIMEOUT             - seconds per HTTP request (default: 60)
+    GEMINI_IMAGES_PER_REQUEST  - most page images packed into one request, 1 disables packing (default: 4)
+    GEMINI_BATCH_WAIT_MS       - longest a page waits for others to share its request (default: 50)
+"""
+import os
+import re
+import time
+import atexit
+import base64
+import random
+import asyncio
+import logging
+import threading
+import mimetypes
+
+logger = logging.getLogger(__name__)
+
+GEMINI_MODEL = os.environ.get("GEMINI_MODEL", "gemini-2.0-flash")
+GEMINI_BASE_URL = os.environ.get("GEMINI_BASE_URL", "https://generativelanguage.googleapis.com")
+GEMINI_MAX_CONCURRENCY = int(os.environ.get("GEMINI_MAX_CONCURRENCY", "8"))
+GEMINI_REQUESTS_PER_MINUTE = float(os.environ.get("GEMINI_REQUESTS_PER_MINUTE", "60"))
+GEMINI_BURST = int(os.environ.get("GEMINI_BURST", "0")) or GEMINI_MAX_CONCURRENCY
+GEMINI_MAX_RETRIES = int(os.environ.get("GEMINI_MAX_RETRIES", "5"))
+GEMINI_TIMEOUT = float(os.environ.get("GEMINI_TIMEOUT", "60"))
+GEMINI_IMAGES_PER_REQUEST = int(os.environ.get("GEMINI_IMAGES_PER_REQUEST", "4"))
+GEMINI_BATCH_WAIT_MS = int(os.environ.get("GEMINI_BATCH_WAIT_MS", "50"))
+
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+BACKOFF_BASE = 1.0
+BACKOFF_CAP = 30.0
+
+EXTRACTION_PROMPT = (
+    "Transcribe all text in this image of a student's exam answer sheet exactly as written, "
+    "including handwriting. Keep question numbers and line breaks. "
+    "Output only the transcribed text."
+)
+PACKED_PROMPT = (
+    "You are given {count} images, each one page of a student's exam answer sheet. "
+    "Transcribe all text on every page exactly as written, including handwriting, keeping "
+    "question numbers and line breaks. For each image, in order, first output a line "
+    "'=== PAGE k ===' (k = 1..{count}) and then that page's text only."
+)
+PAGE_LABEL = re.compile(r"^[ \t]*=== PAGE (\d+) ===[ \t]*$\n?", re.MULTILINE)
+
+
+class GeminiError(Exception):
+    """A Gemini request failed after all retries"""
+
+    def __init__(self, message, status=None):
+        super().__init__(message)
+        self.status = status
+
+
+class TokenBucket:
+    """Async token bucket: rate tokens per second, at most capacity at once"""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = max(1, capacity)
+        self._tokens = float(self.capacity)
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self):
+        # Holding the lock while sleeping keeps waiters first come, first served
+        async with self._lock:
+            self._refill()
+            if self._tokens < 1:
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+                self._refill()
+            self._tokens -= 1
+
+
+def _retry_after(response):
+    """Seconds from a Retry-After header, or None"""
+    value = response.headers.get("retry-after")
+    try:
+        return max(0.0, float(value)) if value else None
+    except ValueError:
+        return None
+
+
+def _image_part(image):
+    """inline_data part for (bytes, mime type)"""
+    data, mime_type = image
+    return {"inline_data": {"mime_type": mime_type, "data": base64.b64encode(data).decode("ascii")}}
+
+
+def read_image(path):
+    """(bytes, mime type) of an image file"""
+    with open(path, "rb") as image_file:
+        data = image_file.read()
+    return data, mimetypes.guess_type(path)[0] or "image/png"
+
+
+def split_packed_text(text, count):
+    """
+    Split a packed reply into per-page texts
+
+    Returns:
+        List of count texts, or None when the page labels are missing or out of order
+    """
+    labels = list(PAGE_LABEL.finditer(text))
+    if [int(label.group(1)) for label in labels] != list(range(1, count + 1)):
+        return None
+    ends = [label.start() for label in labels[1:]] + [len(text)]
+    return [text[label.end():end].strip() for label, end in zip(labels, ends)]
+
+
+class AsyncGeminiClient:
+    """generateContent over HTTP with bounded concurrency, a token bucket and retries"""
+
+    def __init__(self, api_key=None, model=None, base_url=None, max_concurrency=None,
+                 requests_per_minute=None, burst=None, max_retries=None, timeout=None,
+                 images_per_request=None):
+        self.api_key = api_key or os.environ.get("GEMINI_API_KEY")
+        self.model = model or GEMINI_MODEL
+        self.base_url = (base_url or GEMINI_BASE_URL).rstrip("/")
+        self.max_concurrency = max_concurrency or GEMINI_MAX_CONCURRENCY
+        self.requests_per_minute = requests_per_minute or GEMINI_REQUESTS_PER_MINUTE
+        self.burst = burst or GEMINI_BURST
+        self.max_retries = GEMINI_MAX_RETRIES if max_retries is None else max_retries
+        self.timeout = timeout or GEMINI_TIMEOUT
+        self.images_per_request = max(1, images_per_request or GEMINI_IMAGES_PER_REQUEST)
+
+        self._http = None
+        self._semaphore = None
+        self._bucket = None
+        self._stats = {"requests": 0, "retries": 0, "failures": 0, "images": 0, "unpacked": 0}
+
+    def _ensure_started(self):
+        # Created lazily so they bind to the loop the client is used from
+        if self._http is None:
+            import httpx
+            self._http = httpx.AsyncClient(
+                timeout=self.timeout,
+                limits=httpx.Limits(max_connections=self.max_concurrency),
+            )
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+            self._bucket = TokenBucket(self.requests_per_minute / 60.0, self.burst)
+
+    async def generate(self, parts, generation_config=None):
+        """
+        One generateContent request, retried on 429/5xx and transport errors
+
+        Args:
+            parts: Gemini content parts (text and inline_data dicts)
+            generation_config: Extra generationConfig fields, e.g. responseMimeType
+
+        Returns:
+            Text of the first candidate
+        """
+        import httpx
+        self._ensure_started()
+        url = f"{self.base_url}/v1beta/models/{self.model}:generateContent"
+        body = {"contents": [{"role": "user", "parts": parts}],
+                "generationConfig": dict({"temperature": 0}, **(generation_config or {}))}
+        headers = {"x-goog-api-key": self.api_key or ""}
+
+        for attempt in range(self.max_retries + 1):
+            await self._bucket.acquire()
+            delay = None
+            async with self._semaphore:
+                self._stats["requests"] += 1
+                try:
+                    response = await self._http.post(url, json=body, headers=headers)
+                except httpx.TransportError as e:
+                    error = GeminiError(f"Gemini request failed: {e}")
+                else:
+                    if response.status_code == 200:
+                        return self._response_text(response.json())
+                    error = GeminiError(f"Gemini returned HTTP {response.status_code}: {response.text[:200]}",
+                                        response.status_code)
+                    if response.status_code not in RETRY_STATUSES:
+                        self._stats["failures"] += 1
+                        raise error
+                    delay = _retry_after(response)
+
+            if attempt == self.max_retries:
+                break
+            # Full jitter: spreads retries of requests that failed together
+            if delay is None:
+                delay = random.uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * 2 ** attempt))
+            self._stats["retries"] += 1
+            logger.warning(f"{error}; retrying in {delay:.1f}s ({attempt + 1}/{self.max_retries})")
+            await asyncio.sleep(delay)
+
+        self._stats["failures"] += 1
+        raise error
+
+    @staticmethod
+    def _response_text(payload):
+        candidates = payload.get("candidates") or []
+        if not candidates:
+            reason = (payload.get("promptFeedback") or {}).get("blockReason")
+            raise GeminiError(f"Gemini returned no candidates{f' ({reason})' if reason else ''}")
+        parts = (candidates[0].get("content") or {}).get("parts") or []
+        return "".join(part.get("text", "") for part in parts).strip()
+
+    async def _extract_one(self, image):
+        return await self.generate([{"text": EXTRACTION_PROMPT}, _image_part(image)])
+
+    async def extract_image(self, image):
+        """Text of one page image given as (bytes, mime type)"""
+        self._stats["images"] += 1
+        return await self._extract_one(image)
+
+    async def extract_packed(self, images):
+        """
+        Text of several page images, in one request when the reply can be split
+
+        Returns:
+            One text per image, in order
+        """
+        if len(images) == 1:
+            return [await self.extract_image(images[0])]
+
+        parts = [{"text": PACKED_PROMPT.format(count=len(images))}]
+        parts.extend(_image_part(image) for image in images)
+        self._stats["images"] += len(images)
+        texts = split_packed_text(await self.generate(parts), len(images))
+        if texts is not None:
+            return texts
+
+        logger.warning(f"Could not split a reply for {len(images)} packed pages, extracting them one by one")
+        self._stats["unpacked"] += 1
+        return list(await asyncio.gather(*(self._extract_one(image) for image in images)))
+
+    async def extract_images(self, images):
+        """
+        Text of many page images, packed and run concurrently at the quota ceiling
+
+        Args:
+            images: List of (bytes, mime type)
+
+        Returns:
+            One text per image, in order; a failed group raises GeminiError
+        """
+        groups = [images[i:i + self.images_per_request] for i in range(0, len(images), self.images_per_request)]
+        results = await asyncio.gather(*(self.extract_packed(group) for group in groups))
+        return [text for group in results for text in group]
+
+    def stats(self):
+        return dict(self._stats)
+
+    async def aclose(self):
+        if self._http is not None:
+            await self._http.aclose()
+            self._http = None
+
+
+class GeminiService:
+    """
+    Runs an AsyncGeminiClient on a background event loop for synchronous callers
+
+    Pages submitted from any thread within GEMINI_BATCH_WAIT_MS of each other
+    are packed into shared requests.
+    """
+
+    def __init__(self, client=None, batch_wait_ms=None):
+        self.client = client or AsyncGeminiClient()
+        self.batch_wait = (GEMINI_BATCH_WAIT_MS if batch_wait_ms is None else batch_wait_ms) / 1000.0
+        self._loop = None
+        self._thread = None
+        self._queue = None
+        self._lock = threading.Lock()
+
+    def _start(self):
+        with self._lock:
+            if self._thread is not None:
+                return
+            ready = threading.Event()
+
+            def run():
+                self._loop = asyncio.new_event_loop()
+                asyncio.set_event_loop(self._loop)
+                self._queue = asyncio.Queue()
+                self._loop.create_task(self._dispatch())
+                ready.set()
+                self._loop.run_forever()
+
+            self._thread = threading.Thread(target=run, name="gemini-client", daemon=True)
+            self._thread.start()
+            ready.wait()
+
+    async def _dispatch(self):
+        """Group queued pages into packed requests"""
+        while True:
+            batch = [await self._queue.get()]
+            deadline = self._loop.time() + self.batch_wait
+            while len(batch) < self.client.images_per_request:
+                timeout = deadline - self._loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            self._loop.create_task(self._run(batch))
+
+    async def _run(self, batch):
+        try:
+            texts = await self.client.extract_packed([image for image, _ in batch])
+        except Exception as e:
+            if len(batch) == 1:
+                if not batch[0][1].done():
+                    batch[0][1].set_exception(e)
+                return
+            # One bad page (e.g. an image the API rejects) must not fail the pages packed with it
+            logger.warning(f"Packed request for {len(batch)} pages failed, extracting them one by one: {e}")
+            texts = await asyncio.gather(*(self.client._extract_one(image) for image, _ in batch),
+                                         return_exceptions=True)
+        for (_, future), text in zip(batch, texts):
+            if future.done():
+                continue
+            if isinstance(text, BaseException):
+                future.set_exception(text)
+            else:
+                future.set_result(text)
+
+    async def _submit(self, image):
+        future = self._loop.create_future()
+        await self._queue.put((image, future))
+        return await future
+
+    def submit(self, image):
+        """
+        Queue one page image, given as (bytes, mime type) or a path
+
+        Returns:
+            concurrent.futures.Future resolving to the page text
+        """
+        self._start()
+        if isinstance(image, (str, os.PathLike)):
+            image = read_image(image)
+        return asyncio.run_coroutine_threadsafe(self._submit(image), self._loop)
+
+    def generate(self, parts, generation_config=None):
+        """One unbatched generateContent request on the shared loop and rate limit (blocks)"""
+        self._start()
+        return asyncio.run_coroutine_threadsafe(
+            self.client.generate(parts, generation_config), self._loop
+        ).result()
+
+    def extract(self, image):
+        """Text of one page image (blocks)"""
+        return self.submit(image).result()
+
+    def extract_many(self, images):
+        """Texts of many page images, extracted concurrently (blocks)"""
+        futures = [self.submit(image) for image in images]
+        return [future.result() for future in futures]
+
+    def stop(self):
+        with self._lock:
+            if self._thread is None:
+                return
+            asyncio.run_coroutine_threadsafe(self.client.aclose(), self._loop).result(timeout=5)
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join(timeout=5)
+            self._thread = None
+
+
+_service = None
+_service_lock = threading.Lock()
+
+
+def get_gemini_service():
+    """Return the process-wide Gemini service"""
+    global _service
+    with _service_lock:
+        if _service is None:
+            _service = GeminiService()
+            atexit.register(_service.stop)
+        return _service
@@ -0,0 +1,186 @@
+"""
+Rubric grading of answers with Gemini
+
+grade_answer asks the model for relevance, accuracy, grammar and
+completeness ratings plus written feedback, and combines them with a word
+count score into the final mark. Results have the fields of the Grade model
+and also the score / similarity_score / feedback keys every grader returns,
+so it can be passed to utils.submission_processor as the grader. Without an
+API key, or when the call fails, the local TF-IDF grader is used instead.
+
+get_grader wraps the configured grader in utils.grading_cache, so repeated
+and duplicate answers cost no model call, blank answers are never sent and
+answers of only a word or two are scored locally against the answer key.
+
+Settings (environment variables):
+    GRADING_BACKEND - "local" (default) for TF-IDF scoring, "gemini" for model grading
+    GRADING_MODEL   - model used for grading (default: GEMINI_MODEL)
+"""
+import os
+import json
+import logging
+
+from utils.answer_scoring import score_answer, WORD_PATTERN
+from utils.gemini_client import GEMINI_MODEL
+from utils.grading_cache import cached_grader
+
+logger = logging.getLogger(__name__)
+
+GRADING_BACKEND = os.environ.get("GRADING_BACKEND", "local").lower()
+GRADING_MODEL = os.environ.get("GRADING_MODEL", GEMINI_MODEL)
+
+# Bump whenever GRADING_PROMPT or the weights change, so cached grades are not reused
+GRADING_PROMPT_VERSION = 2
+
+# Share of the final mark per criterion
+WEIGHTS = {
+    "relevance_score": 0.25,
+    "accuracy_score": 0.35,
+    "completeness_score": 0.2,
+    "grammar_score": 0.1,
+    "word_count_score": 0.1,
+}
+
+GRADING_PROMPT = """You are grading a student's answer to an exam question.
+
+Question:
+{question}
+
+Model answer:
+{answer_key}
+
+Student answer:
+{answer}
+
+Rate the student answer and reply with JSON only, using exactly these keys:
+{{"relevance": 0-1, "accuracy": 0-1, "grammar": 0-1, "completeness": 0-1,
+ "detailed_feedback": "two or three sentences",
+ "strengths": ["..."], "improvements": ["..."],
+ "grammar_issues": [{{"error": "text as written", "correction": "...", "explanation": "..."}}]}}"""
+
+
+def grader_version():
+    """Identifies the model and prompt behind a cached grade"""
+    return f"gemini:{GRADING_MODEL}:{GRADING_PROMPT_VERSION}"
+
+
+def _rating(payload, name):
+    try:
+        return min(1.0, max(0.0, float(payload.get(name, 0.0))))
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def _string_list(value):
+    if isinstance(value, str):
+        return [value] if value.strip() else []
+    return [str(item) for item in value or [] if str(item).strip()]
+
+
+def _issue_list(value):
+    """Grammar issues as dicts (see models.GrammarIssue); plain strings become the error text"""
+    if isinstance(value, (str, dict)):
+        value = [value]
+    issues = []
+    for item in value or []:
+        if isinstance(item, dict):
+            issues.append({key: str(item.get(key) or "") for key in ("error", "correction", "explanation")})
+        elif str(item).strip():
+            issues.append({"error": str(item), "correction": "", "explanation": ""})
+    return issues
+
+
+def word_count_score(answer_text, min_word_count):
+    word_count = len(WORD_PATTERN.findall(answer_text or ""))
+    return min(1.0, word_count / min_word_count) if min_word_count else 1.0
+
+
+def combine(ratings, question, similarity, feedback, strengths, improvements, grammar_issues):
+    """Result dict with the Grade fields, the weighted final score and the common grader keys"""
+    final_score = round(sum(ratings[name] * weight for name, weight in WEIGHTS.items()) * question.max_score, 2)
+    result = dict(ratings)
+    result.update({
+        "final_score": final_score,
+        "detailed_feedback": feedback,
+        "strengths": strengths,
+        "improvements": improvements,
+        "grammar_issues": grammar_issues,
+        "score": final_score,
+        "similarity_score": similarity,
+        "feedback": feedback,
+    })
+    return result
+
+
+def local_grade(question, answer_text, key_index=None):
+    """Grade fields derived from the local TF-IDF score"""
+    local = score_answer(question, answer_text, key_index)
+    similarity = local["similarity_score"]
+    result = dict(local)
+    result.update({
+        "relevance_score": similarity,
+        "accuracy_score": similarity,
+        "grammar_score": 0.0,
+        "completeness_score": similarity,
+        "word_count_score": word_count_score(answer_text, question.min_word_count),
+        "final_score": local["score"],
+        "detailed_feedback": local["feedback"],
+        "strengths": [],
+        "improvements": [],
+        "grammar_issues": [],
+        "fallback": True,
+    })
+    return result
+
+
+def grade_answer(question, answer_text, key_index=None):
+    """
+    Grade one answer with Gemini
+
+    Args:
+        question: Question document
+        answer_text: Extracted answer text
+        key_index: Optional QuestionIndex, used for the similarity score
+
+    Returns:
+        Dict with the Grade fields plus score, similarity_score and feedback
+    """
+    if not os.environ.get("GEMINI_API_KEY"):
+        return local_grade(question, answer_text, key_index)
+
+    from utils.gemini_client import get_gemini_service
+    prompt = GRADING_PROMPT.format(question=question.text, answer_key=question.answer_key, answer=answer_text)
+    try:
+        reply = get_gemini_service().generate(
+            [{"text": prompt}],
+            {"responseMimeType": "application/json"}
+        )
+        payload = json.loads(reply)
+    except Exception as e:
+        logger.error(f"Gemini grading failed, using the local grader: {e}")
+        return local_grade(question, answer_text, key_index)
+
+    ratings = {
+        "relevance_score": _rating(payload, "relevance"),
+        "accuracy_score": _rating(payload, "accuracy"),
+        "grammar_score": _rating(payload, "grammar"),
+        "completeness_score": _rating(payload, "completeness"),
+        "word_count_score": word_count_score(answer_text, question.min_word_count),
+    }
+    similarity = score_answer(question, answer_text, key_index)["similarity_score"]
+    return combine(
+        ratings,
+        question,
+        similarity,
+        str(payload.get("detailed_feedback", "")),
+        _string_list(payload.get("strengths")),
+        _string_list(payload.get("improvements")),
+        _issue_list(payload.get("grammar_issues")),
+    )
+
+
+def get_grader():
+    """The grader selected by GRADING_BACKEND, behind the grading cache"""
+    if GRADING_BACKEND == "gemini":
+        return cached_grader(grade_answer, grader_version(), short_grader=local_grade)
+    return score_answer
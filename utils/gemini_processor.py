@@ -0,0 +1,64 @@
+"""
+Gemini vision text extraction for handwritten answer sheets
+
+GeminiTextExtractor is the synchronous entry point used by the OCR router
+and the test_gemini_* scripts. Requests go through the shared
+utils.gemini_client service, so extractions from many threads run
+concurrently, share one rate limit and are packed into multi-image requests.
+"""
+import logging
+
+from utils.gemini_client import GEMINI_MODEL, get_gemini_service
+
+logger = logging.getLogger(__name__)
+
+
+class GeminiTextExtractor:
+    """Extract text from page images with Gemini"""
+
+    def __init__(self, service=None):
+        self.service = service or get_gemini_service()
+        # None when no API key is configured, mirroring an unavailable model
+        self.model = self.service.client.model if self.service.client.api_key else None
+        if self.model is None:
+            logger.warning("GEMINI_API_KEY is not set, Gemini extraction is unavailable")
+
+    def extract_text_from_image(self, image_path):
+        """
+        Extract the text of one image
+
+        Args:
+            image_path: Path to the image file
+
+        Returns:
+            Extracted text, or "" on failure
+        """
+        if self.model is None:
+            return ""
+        try:
+            return self.service.extract(image_path)
+        except Exception as e:
+            logger.error(f"Gemini extraction failed for {image_path}: {e}")
+            return ""
+
+    def extract_text_from_images(self, image_paths):
+        """
+        Extract the text of many images concurrently, at the configured quota
+
+        Args:
+            image_paths: Paths to the image files
+
+        Returns:
+            One text per image, in order ("" for images that failed)
+        """
+        if self.model is None:
+            return [""] * len(image_paths)
+        futures = [self.service.submit(path) for path in image_paths]
+        texts = []
+        for path, future in zip(image_paths, futures):
+            try:
+                texts.append(future.result())
+            except Exception as e:
+                logger.error(f"Gemini extraction failed for {path}: {e}")
+                texts.append("")
+        return texts
@@ -0,0 +1,280 @@
+"""
+Cache for model-graded answers
+
+A grading call is keyed by a hash of everything that determines its result:
+question text, answer key, marks, the normalized student answer and the
+grader's model and prompt version. Copied answers, re-grades and re-runs
+after a re-segmentation are then answered from the cache instead of the
+model. Answers that are blank or nothing but OCR / segmentation filler
+("(continued)", error notes) score zero without a call; answers shorter
+than GRADING_MIN_WORDS go to the grader's local short-answer scorer, which
+compares them against the answer key instead of assuming they are wrong.
+
+Normalization only folds Unicode forms and whitespace, so answers that
+differ in spelling, case or punctuation (which the grammar score depends
+on) are graded separately.
+
+Settings (environment variables):
+    GRADING_CACHE_BACKEND     - "mongo" (default), "memory" or "none"
+    GRADING_CACHE_TTL_HOURS   - age after which an entry is graded again (default: 720)
+    GRADING_CACHE_MAX_ENTRIES - entries kept before least-recently-used ones are evicted (default: 50000)
+    GRADING_MIN_WORDS         - answers with fewer words are scored locally, not by the model (default: 3)
+"""
+import os
+import re
+import json
+import hashlib
+import logging
+import threading
+import unicodedata
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+logger = logging.getLogger(__name__)
+
+GRADING_CACHE_BACKEND = os.environ.get("GRADING_CACHE_BACKEND", "mongo").lower()
+GRADING_CACHE_TTL_HOURS = float(os.environ.get("GRADING_CACHE_TTL_HOURS", "720"))
+GRADING_CACHE_MAX_ENTRIES = int(os.environ.get("GRADING_CACHE_MAX_ENTRIES", "50000"))
+GRADING_MIN_WORDS = int(os.environ.get("GRADING_MIN_WORDS", "3"))
+
+# Bump when the shape of cached results changes
+GRADING_CACHE_VERSION = 1
+
+# The Mongo backend checks its size bound every this many stores
+EVICT_EVERY = 100
+
+WORD_PATTERN = re.compile(r"[^\W_]+")
+# Text that carries no answer: segmentation filler and OCR error notes
+FILLER_PATTERN = re.compile(
+    r"\(\s*continued\s*\)|\[[^\]]*(?:error|extracted raw text)[^\]]*\]|--- Page \d+ ---"
+    r"|\b(?:no answer|not answered|n/a|error segmenting text)\b",
+    re.IGNORECASE
+)
+
+
+def normalize_answer(text):
+    """Answer text as it is hashed: NFKC, whitespace runs collapsed, trimmed"""
+    return " ".join(unicodedata.normalize("NFKC", text or "").split())
+
+
+def grading_key(question, answer_text, grader_version):
+    """
+    Hash of everything that determines a grading result
+
+    Args:
+        question: Question document
+        answer_text: Student answer text
+        grader_version: Model name and prompt version of the grader, e.g. "gemini-2.0-flash:1"
+
+    Returns:
+        Hex digest
+    """
+    material = json.dumps([
+        GRADING_CACHE_VERSION,
+        grader_version,
+        normalize_answer(question.text),
+        normalize_answer(question.answer_key),
+        question.max_score,
+        question.min_word_count,
+        normalize_answer(answer_text),
+    ])
+    return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+
+def answer_word_count(answer_text):
+    """Words of an answer once segmentation filler and OCR error notes are removed"""
+    return len(WORD_PATTERN.findall(FILLER_PATTERN.sub(" ", normalize_answer(answer_text))))
+
+
+def is_blank(answer_text):
+    """Whether an answer is empty or consists only of filler"""
+    return answer_word_count(answer_text) == 0
+
+
+def is_short(answer_text):
+    """Whether an answer has too few words to be worth a model call (it may still be right)"""
+    return answer_word_count(answer_text) < GRADING_MIN_WORDS
+
+
+def blank_result(question, answer_text):
+    """Zero-score result for an answer with no content"""
+    feedback = "No answer found for this question."
+    return {
+        "score": 0.0,
+        "similarity_score": 0.0,
+        "feedback": feedback,
+        "relevance_score": 0.0,
+        "accuracy_score": 0.0,
+        "grammar_score": 0.0,
+        "completeness_score": 0.0,
+        "word_count_score": 0.0,
+        "final_score": 0.0,
+        "detailed_feedback": feedback,
+        "strengths": [],
+        "improvements": ["Write a complete answer to the question."],
+        "grammar_issues": [],
+    }
+
+
+class MemoryGradingCache:
+    """Grading cache in this process, evicted by age and least-recent use"""
+
+    def __init__(self, ttl_hours=None, max_entries=None):
+        self.ttl = timedelta(hours=GRADING_CACHE_TTL_HOURS if ttl_hours is None else ttl_hours)
+        self.max_entries = max_entries or GRADING_CACHE_MAX_ENTRIES
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            stored_at, result = entry
+            if datetime.utcnow() - stored_at > self.ttl:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return result
+
+    def put(self, key, result, grader_version):
+        with self._lock:
+            self._entries[key] = (datetime.utcnow(), result)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+class MongoGradingCache:
+    """Grading cache in the grading_cache collection, shared by all workers"""
+
+    def __init__(self, ttl_hours=None, max_entries=None):
+        self.ttl = timedelta(hours=GRADING_CACHE_TTL_HOURS if ttl_hours is None else ttl_hours)
+        self.max_entries = max_entries or GRADING_CACHE_MAX_ENTRIES
+        self._puts = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        from models import GradingCacheEntry
+        now = datetime.utcnow()
+        # Expired entries are skipped here; the TTL index removes them in the background
+        entry = GradingCacheEntry.objects(key=key, created_at__gt=now - self.ttl).modify(set__last_accessed=now)
+        return entry.result if entry is not None else None
+
+    def put(self, key, result, grader_version):
+        from models import GradingCacheEntry
+        now = datetime.utcnow()
+        GradingCacheEntry.objects(key=key).update_one(
+            upsert=True,
+            set__result=result,
+            set__grader=grader_version,
+            set__created_at=now,
+            set__last_accessed=now,
+        )
+        with self._lock:
+            self._puts += 1
+            check = self._puts % EVICT_EVERY == 0
+        if check:
+            self.evict()
+
+    def evict(self):
+        """Remove least-recently-used entries beyond the size bound"""
+        from models import GradingCacheEntry
+        excess = GradingCacheEntry.objects.count() - self.max_entries
+        if excess <= 0:
+            return
+        stale_ids = list(GradingCacheEntry.objects.order_by('last_accessed').limit(excess).scalar('id'))
+        GradingCacheEntry.objects(id__in=stale_ids).delete()
+        logger.info(f"Grading cache evicted {len(stale_ids)} entries")
+
+
+class GradingCache:
+    """Front end used by cached_grader"""
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.hits = 0
+        self.misses = 0
+        self.skipped = 0
+        self.short = 0
+
+    def grade(self, grader, grader_version, question, answer_text, key_index=None, short_grader=None):
+        """
+        Grade an answer, answering from the cache or without a call when possible
+
+        Args:
+            grader: Callable(question, answer_text, key_index) returning a result dict
+            grader_version: Model name and prompt version of the grader
+            question: Question document
+            answer_text: Student answer text
+            key_index: Optional QuestionIndex passed on to the grader
+            short_grader: Optional local grader with the same signature for answers
+                          below GRADING_MIN_WORDS (they go to grader without one)
+
+        Returns:
+            Result dict of the grader
+        """
+        if is_blank(answer_text):
+            self.skipped += 1
+            return blank_result(question, answer_text)
+        if short_grader is not None and is_short(answer_text):
+            self.short += 1
+            return short_grader(question, answer_text, key_index)
+        if self.backend is None:
+            return grader(question, answer_text, key_index)
+
+        try:
+            key = grading_key(question, answer_text, grader_version)
+            cached = self.backend.get(key)
+            if cached is not None:
+                self.hits += 1
+                return dict(cached)
+        except Exception as e:
+            # The cache is an optimization - never fail grading because of it
+            logger.warning(f"Grading cache lookup failed: {e}")
+            return grader(question, answer_text, key_index)
+
+        self.misses += 1
+        result = grader(question, answer_text, key_index)
+        # Fallback results (model unavailable) are not worth keeping
+        if not result.get("fallback"):
+            try:
+                self.backend.put(key, result, grader_version)
+            except Exception as e:
+                logger.warning(f"Grading cache store failed: {e}")
+        return result
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "skipped": self.skipped, "short": self.short}
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_grading_cache():
+    """Return the process-wide grading cache for the configured backend"""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            if GRADING_CACHE_BACKEND == "mongo":
+                backend = MongoGradingCache()
+            elif GRADING_CACHE_BACKEND == "memory":
+                backend = MemoryGradingCache()
+            else:
+                backend = None
+            _cache = GradingCache(backend)
+        return _cache
+
+
+def cached_grader(grader, grader_version, short_grader=None):
+    """
+    Wrap a grader so its results are cached and blank (or, with short_grader, short) answers skip it
+
+    Returns:
+        Callable(question, answer_text, key_index=None) with the grader's signature
+    """
+    def grade(question, answer_text, key_index=None):
+        return get_grading_cache().grade(grader, grader_version, question, answer_text, key_index, short_grader)
+    grade.__name__ = getattr(grader, "__name__", "grade")
+    return grade
@@ -0,0 +1,64 @@
+"""
+Serve GridFS files as streamed HTTP responses
+
+Supports Range requests (206 / 416), strong ETags and conditional GET
+(If-None-Match / If-Modified-Since -> 304). The file is read from GridFS in
+fixed-size chunks, so memory per request stays flat regardless of file size.
+"""
+import logging
+
+from flask import Response, request
+from werkzeug.exceptions import RequestedRangeNotSatisfiable
+from werkzeug.wsgi import wrap_file
+
+from models import FILE_CHUNK_SIZE
+
+logger = logging.getLogger(__name__)
+
+
+def send_gridfs_file(grid_out, download_name=None, as_attachment=False, max_age=3600):
+    """
+    Build a streaming response for an open GridFS file
+
+    Args:
+        grid_out: Open GridOut (e.g. from Submission.open_file())
+        download_name: Filename for Content-Disposition (defaults to the stored filename)
+        as_attachment: Send as a download rather than inline
+        max_age: Cache-Control max-age in seconds
+
+    Returns:
+        Flask Response (200, 206, 304 or 416)
+    """
+    download_name = download_name or grid_out.filename or 'file'
+    content_type = grid_out.content_type or 'application/octet-stream'
+
+    # wrap_file exposes seek() to werkzeug, so a Range request starts reading
+    # at the requested offset instead of skipping through the file
+    response = Response(
+        wrap_file(request.environ, grid_out, buffer_size=FILE_CHUNK_SIZE),
+        mimetype=content_type,
+        direct_passthrough=True
+    )
+    response.content_length = grid_out.length
+    response.last_modified = grid_out.upload_date
+    # GridFS files are immutable, so the file id is a strong validator
+    response.set_etag(str(grid_out._id))
+    response.cache_control.private = True
+    response.cache_control.max_age = max_age
+
+    disposition = 'attachment' if as_attachment else 'inline'
+    response.headers.set('Content-Disposition', disposition, filename=download_name)
+
+    # Handles If-None-Match / If-Modified-Since and Range / If-Range
+    try:
+        response = response.make_conditional(request, accept_ranges=True, complete_length=grid_out.length)
+    except RequestedRangeNotSatisfiable:
+        # Werkzeug raises for a range past the end of the file instead of returning a 416
+        grid_out.close()
+        response = Response(status=416)
+        response.headers['Content-Range'] = f'bytes */{grid_out.length}'
+        response.headers['Accept-Ranges'] = 'bytes'
+        return response
+    if response.status_code in (304, 416):
+        grid_out.close()
+    return response
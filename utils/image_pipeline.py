@@ -0,0 +1,127 @@
+"""
+Lazy, memoized image preprocessing for OCR
+
+A PagePreprocessor decodes a page once into a shared grayscale NumPy buffer
+and computes each preprocessing variant (adaptive threshold for handwriting,
+Otsu for print) only when it is first asked for. Trying the printed-text
+fallback after the handwritten pass therefore costs one extra threshold, not
+a second decode and color conversion. Variants are plain uint8 arrays that
+can be handed straight to pytesseract.
+"""
+import logging
+from functools import cached_property
+
+import cv2
+import numpy as np
+from PIL import Image
+
+logger = logging.getLogger(__name__)
+
+# Kernel shared by the morphological clean-up of handwritten pages
+MORPH_KERNEL = np.ones((2, 2), np.uint8)
+
+
+class PagePreprocessor:
+    """One decoded page with lazily computed OCR variants"""
+
+    def __init__(self, image, max_side=None, source_path=None):
+        """
+        Args:
+            image: PIL Image or NumPy array (grayscale, RGB or RGBA)
+            max_side: Optional longest-side limit; larger pages are downscaled once
+            source_path: File the page was decoded from, for engines that need a file
+        """
+        self._source = image
+        self.max_side = max_side
+        self.source_path = source_path
+
+    @classmethod
+    def from_path(cls, image_path, max_side=None):
+        """Decode an image file once, straight to grayscale"""
+        with Image.open(image_path) as image:
+            # Decoding directly to 'L' avoids materializing an RGB copy
+            gray = np.asarray(image.convert('L'))
+        return cls(gray, max_side=max_side, source_path=image_path)
+
+    @cached_property
+    def gray(self):
+        """Grayscale uint8 buffer shared by every variant"""
+        source = self._source
+        if isinstance(source, Image.Image):
+            if source.mode not in ('L', 'RGB', 'RGBA'):
+                source = source.convert('RGB')
+            source = np.asarray(source)
+
+        if source.ndim == 2:
+            gray = source
+        elif source.shape[2] == 1:
+            gray = source[:, :, 0]
+        elif source.shape[2] == 4:
+            gray = cv2.cvtColor(source, cv2.COLOR_RGBA2GRAY)
+        else:
+            gray = cv2.cvtColor(source, cv2.COLOR_RGB2GRAY)
+
+        # The source is no longer needed once the shared buffer exists
+        self._source = None
+
+        if self.max_side:
+            height, width = gray.shape[:2]
+            longest = max(height, width)
+            if longest > self.max_side:
+                scale = self.max_side / float(longest)
+                new_size = (max(1, int(width * scale)), max(1, int(height * scale)))
+                logger.info(f"Resizing image from {width}x{height} to {new_size[0]}x{new_size[1]} to save memory")
+                gray = cv2.resize(gray, new_size, interpolation=cv2.INTER_AREA)
+
+        return np.ascontiguousarray(gray, dtype=np.uint8)
+
+    @property
+    def shape(self):
+        return self.gray.shape
+
+    @cached_property
+    def blurred(self):
+        """Gaussian blur to reduce noise before adaptive thresholding"""
+        return cv2.GaussianBlur(self.gray, (5, 5), 0)
+
+    @cached_property
+    def adaptive_threshold(self):
+        """Inverted adaptive threshold - copes with varying ink intensity in handwriting"""
+        return cv2.adaptiveThreshold(
+            self.blurred,
+            255,
+            cv2.ADAPTIVE_THRESH_GAUSSIAN_C,
+            cv2.THRESH_BINARY_INV,
+            11,  # Block size
+            2    # Constant subtracted from mean
+        )
+
+    @cached_property
+    def handwritten(self):
+        """Adaptive threshold + closing/opening, black text on white"""
+        cleaned = cv2.morphologyEx(self.adaptive_threshold, cv2.MORPH_CLOSE, MORPH_KERNEL)
+        # Opening and inversion reuse the same buffer instead of allocating new ones
+        cv2.morphologyEx(cleaned, cv2.MORPH_OPEN, MORPH_KERNEL, dst=cleaned)
+        cv2.bitwise_not(cleaned, dst=cleaned)
+        return cleaned
+
+    @cached_property
+    def printed(self):
+        """Otsu threshold for printed text (the old 1x1 dilation was a no-op and is skipped)"""
+        _, thresh = cv2.threshold(self.gray, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+        return thresh
+
+    @cached_property
+    def layout(self):
+        """Columns, lines and answer regions, found on the cleaned handwritten binarization"""
+        from utils.layout import analyze_layout
+        return analyze_layout(self.handwritten)
+
+    def variant(self, is_handwritten):
+        """The preprocessed array for the requested mode"""
+        return self.handwritten if is_handwritten else self.printed
+
+    def release(self, *names):
+        """Drop memoized variants (all of them if no names are given) to free memory early"""
+        for name in names or ('blurred', 'adaptive_threshold', 'handwritten', 'printed', 'gray', 'layout'):
+            self.__dict__.pop(name, None)
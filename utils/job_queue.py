@@ -0,0 +1,389 @@
+"""
+Durable queue of submission processing jobs
+
+Uploads only enqueue a job; worker.py processes jobs in separate worker
+processes. Two interchangeable backends:
+
+    MongoJobQueue - the processing_jobs collection (production)
+    LocalJobQueue - a SQLite file under instance/ (local development)
+
+A claimed job holds a lease that its worker renews while it runs (see
+LeaseHeartbeat); if the worker dies the lease expires and the job is handed
+out again, up to JOB_MAX_ATTEMPTS times, after which it is marked failed.
+Only the worker holding the lease can complete or fail a job, so a worker
+whose lease was taken over cannot overwrite the new holder's result.
+
+Jobs are of one of JOB_KINDS: "process" runs OCR, segmentation and grading,
+"resegment" segments and grades again from the stored OCR document. A
+submission has at most one active job; asking for full processing while a
+re-segmentation is still queued turns it into a processing job.
+
+Settings (environment variables):
+    JOB_QUEUE_BACKEND      - "mongo" (default) or "local"
+    JOB_QUEUE_DB           - SQLite path for the local backend (default: instance/jobs.db)
+    JOB_LEASE_SECONDS      - how long a worker may hold a job (default: 600)
+    JOB_MAX_ATTEMPTS       - attempts before a job is marked failed (default: 3)
+"""
+import os
+import logging
+import sqlite3
+import threading
+from datetime import datetime, timedelta
+
+from pymongo.errors import BulkWriteError
+
+logger = logging.getLogger(__name__)
+
+JOB_QUEUE_BACKEND = os.environ.get("JOB_QUEUE_BACKEND", "mongo").lower()
+JOB_QUEUE_DB = os.environ.get("JOB_QUEUE_DB", os.path.join("instance", "jobs.db"))
+JOB_LEASE_SECONDS = int(os.environ.get("JOB_LEASE_SECONDS", "600"))
+JOB_MAX_ATTEMPTS = int(os.environ.get("JOB_MAX_ATTEMPTS", "3"))
+
+JOB_STATUSES = ('queued', 'running', 'done', 'failed')
+JOB_KINDS = ('process', 'resegment')
+
+
+class Job:
+    """Backend-independent view of a claimed job"""
+
+    def __init__(self, job_id, submission_id, exam_id, attempts, worker=None, kind='process'):
+        self.id = str(job_id)
+        self.submission_id = str(submission_id)
+        self.exam_id = str(exam_id)
+        self.attempts = attempts
+        self.worker = worker  # Lease holder that claimed the job
+        self.kind = kind or 'process'
+
+    def __repr__(self):
+        return f'<Job {self.id} - {self.kind} submission {self.submission_id}>'
+
+
+def claimable_jobs(now=None):
+    """
+    ProcessingJob queryset of the jobs a worker may claim, oldest first
+
+    Queued jobs, and running jobs whose lease expired with attempts left.
+    MongoJobQueue.claim takes the first of these; index_audit explains the
+    same query so the audited plan is the one workers run.
+    """
+    from mongoengine.queryset.visitor import Q
+    from models import ProcessingJob
+    now = now or datetime.utcnow()
+    runnable = Q(status='queued') | Q(status='running', lease_expires_at__lt=now, attempts__lt=JOB_MAX_ATTEMPTS)
+    return ProcessingJob.objects(runnable).order_by('enqueued_at')
+
+
+class MongoJobQueue:
+    """Job queue stored in the processing_jobs collection"""
+
+    def enqueue(self, submission, kind='process'):
+        """Queue a submission for processing (no-op if it is already queued or running)"""
+        from mongoengine.errors import NotUniqueError
+        from models import ProcessingJob
+        if kind == 'process':
+            ProcessingJob.objects(submission=submission, status='queued', kind='resegment').update_one(
+                set__kind='process'
+            )
+        try:
+            ProcessingJob.objects(submission=submission, status__in=['queued', 'running']).update_one(
+                upsert=True,
+                set_on_insert__exam=submission.exam,
+                set_on_insert__kind=kind,
+                set_on_insert__status='queued',
+                set_on_insert__active=True,
+                set_on_insert__attempts=0,
+                set_on_insert__enqueued_at=datetime.utcnow(),
+            )
+        except NotUniqueError:
+            # A concurrent enqueue inserted the active job first (unique index on active jobs)
+            logger.debug(f"Submission {submission.id} is already queued")
+
+    def enqueue_many(self, submissions):
+        """Queue several submissions with a single insert, skipping ones that already have an active job"""
+        from models import ProcessingJob
+        documents = [ProcessingJob(submission=s, exam=s.exam, active=True).to_mongo() for s in submissions]
+        if not documents:
+            return 0
+        try:
+            return len(ProcessingJob._get_collection().insert_many(documents, ordered=False).inserted_ids)
+        except BulkWriteError as e:
+            duplicates = [error for error in e.details.get('writeErrors', []) if error.get('code') == 11000]
+            if len(duplicates) != len(e.details.get('writeErrors', [])):
+                raise
+            return e.details.get('nInserted', 0)
+
+    def claim(self, worker_id):
+        """Atomically take the oldest runnable job, or return None"""
+        from models import ProcessingJob
+        now = datetime.utcnow()
+
+        # Jobs whose worker died on their last attempt are not handed out again
+        expired = ProcessingJob.objects(status='running', lease_expires_at__lt=now, attempts__gte=JOB_MAX_ATTEMPTS)
+        if expired.update(set__status='failed', set__finished_at=now, unset__active=True,
+                          set__error=f"Lease expired on attempt {JOB_MAX_ATTEMPTS} of {JOB_MAX_ATTEMPTS}"):
+            logger.warning("Marked jobs whose workers stopped responding on their last attempt as failed")
+
+        job = claimable_jobs(now).no_dereference().modify(
+            new=True,
+            set__status='running',
+            set__worker=worker_id,
+            set__started_at=now,
+            set__lease_expires_at=now + timedelta(seconds=JOB_LEASE_SECONDS),
+            inc__attempts=1,
+        )
+        if job is None:
+            return None
+        return Job(job.id, job.submission.id, job.exam.id, job.attempts, worker_id, job.kind)
+
+    def renew(self, job):
+        """Extend the lease of a running job; False if this worker no longer holds it"""
+        from models import ProcessingJob
+        return bool(ProcessingJob.objects(id=job.id, status='running', worker=job.worker).update_one(
+            set__lease_expires_at=datetime.utcnow() + timedelta(seconds=JOB_LEASE_SECONDS)
+        ))
+
+    def complete(self, job):
+        from models import ProcessingJob
+        if not ProcessingJob.objects(id=job.id, status='running', worker=job.worker).update_one(
+            set__status='done', set__finished_at=datetime.utcnow(), unset__error=True, unset__active=True
+        ):
+            logger.warning(f"{job} finished after its lease was taken over, result not recorded")
+
+    def fail(self, job, error):
+        """Record a failure; the job is retried until it runs out of attempts"""
+        from models import ProcessingJob
+        updates = {'set__error': str(error), 'set__finished_at': datetime.utcnow()}
+        if job.attempts >= JOB_MAX_ATTEMPTS:
+            updates.update(set__status='failed', unset__active=True)
+        else:
+            updates.update(set__status='queued')
+        if not ProcessingJob.objects(id=job.id, status='running', worker=job.worker).update_one(**updates):
+            logger.warning(f"{job} failed after its lease was taken over, failure not recorded")
+
+    def progress(self, exam_id):
+        """Count jobs per status for an exam"""
+        from bson import ObjectId
+        from models import ProcessingJob
+        counts = {status: 0 for status in JOB_STATUSES}
+        for row in ProcessingJob.objects.aggregate([
+            {"$match": {"exam": ObjectId(str(exam_id))}},
+            {"$group": {"_id": "$status", "count": {"$sum": 1}}},
+        ]):
+            counts[row["_id"]] = row["count"]
+        return counts
+
+
+class LocalJobQueue:
+    """Job queue stored in a local SQLite file, shared by all processes on this machine"""
+
+    def __init__(self, db_path=None):
+        self.db_path = db_path or JOB_QUEUE_DB
+        self._local = threading.local()
+        os.makedirs(os.path.dirname(self.db_path) or '.', exist_ok=True)
+        with self._connect() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    submission_id TEXT NOT NULL,
+                    exam_id TEXT NOT NULL,
+                    kind TEXT NOT NULL DEFAULT 'process',
+                    status TEXT NOT NULL DEFAULT 'queued',
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    worker TEXT,
+                    error TEXT,
+                    enqueued_at TEXT NOT NULL,
+                    started_at TEXT,
+                    lease_expires_at TEXT,
+                    finished_at TEXT
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs (status, enqueued_at)")
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(jobs)")}
+            if 'kind' not in columns:
+                # Queue files created before job kinds existed
+                conn.execute("ALTER TABLE jobs ADD COLUMN kind TEXT NOT NULL DEFAULT 'process'")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_exam ON jobs (exam_id)")
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+        return conn
+
+    def enqueue(self, submission, kind='process'):
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            if kind == 'process':
+                conn.execute(
+                    "UPDATE jobs SET kind = 'process' WHERE submission_id = ? AND status = 'queued'",
+                    (str(submission.id),)
+                )
+            active = conn.execute(
+                "SELECT 1 FROM jobs WHERE submission_id = ? AND status IN ('queued', 'running')",
+                (str(submission.id),)
+            ).fetchone()
+            if not active:
+                conn.execute(
+                    "INSERT INTO jobs (submission_id, exam_id, kind, enqueued_at) VALUES (?, ?, ?, ?)",
+                    (str(submission.id), str(submission.exam.id), kind, datetime.utcnow().isoformat())
+                )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def enqueue_many(self, submissions):
+        """Queue several submissions in one transaction, skipping ones that already have an active job"""
+        now = datetime.utcnow().isoformat()
+        rows = [(str(s.id), str(s.exam.id), now, str(s.id)) for s in submissions]
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            before = conn.total_changes
+            conn.executemany(
+                """INSERT INTO jobs (submission_id, exam_id, enqueued_at)
+                   SELECT ?, ?, ? WHERE NOT EXISTS (
+                       SELECT 1 FROM jobs WHERE submission_id = ? AND status IN ('queued', 'running'))""",
+                rows
+            )
+            inserted = conn.total_changes - before
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return inserted
+
+    def claim(self, worker_id):
+        now = datetime.utcnow()
+        conn = self._connect()
+        # BEGIN IMMEDIATE takes the write lock up front so two workers cannot claim the same row
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute(
+                """UPDATE jobs SET status = 'failed', finished_at = ?, error = ?
+                   WHERE status = 'running' AND lease_expires_at < ? AND attempts >= ?""",
+                (now.isoformat(), f"Lease expired on attempt {JOB_MAX_ATTEMPTS} of {JOB_MAX_ATTEMPTS}",
+                 now.isoformat(), JOB_MAX_ATTEMPTS)
+            )
+            row = conn.execute(
+                """SELECT id, submission_id, exam_id, attempts, kind FROM jobs
+                   WHERE status = 'queued' OR (status = 'running' AND lease_expires_at < ? AND attempts < ?)
+                   ORDER BY enqueued_at LIMIT 1""",
+                (now.isoformat(), JOB_MAX_ATTEMPTS)
+            ).fetchone()
+            if row is None:
+                conn.execute("COMMIT")
+                return None
+            job_id, submission_id, exam_id, attempts, kind = row
+            conn.execute(
+                """UPDATE jobs SET status = 'running', worker = ?, started_at = ?,
+                   lease_expires_at = ?, attempts = attempts + 1 WHERE id = ?""",
+                (worker_id, now.isoformat(),
+                 (now + timedelta(seconds=JOB_LEASE_SECONDS)).isoformat(), job_id)
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return Job(job_id, submission_id, exam_id, attempts + 1, worker_id, kind)
+
+    def renew(self, job):
+        cursor = self._connect().execute(
+            "UPDATE jobs SET lease_expires_at = ? WHERE id = ? AND status = 'running' AND worker = ?",
+            ((datetime.utcnow() + timedelta(seconds=JOB_LEASE_SECONDS)).isoformat(), job.id, job.worker)
+        )
+        return cursor.rowcount > 0
+
+    def complete(self, job):
+        cursor = self._connect().execute(
+            """UPDATE jobs SET status = 'done', error = NULL, finished_at = ?
+               WHERE id = ? AND status = 'running' AND worker = ?""",
+            (datetime.utcnow().isoformat(), job.id, job.worker)
+        )
+        if not cursor.rowcount:
+            logger.warning(f"{job} finished after its lease was taken over, result not recorded")
+
+    def fail(self, job, error):
+        status = 'failed' if job.attempts >= JOB_MAX_ATTEMPTS else 'queued'
+        cursor = self._connect().execute(
+            """UPDATE jobs SET status = ?, error = ?, finished_at = ?
+               WHERE id = ? AND status = 'running' AND worker = ?""",
+            (status, str(error), datetime.utcnow().isoformat(), job.id, job.worker)
+        )
+        if not cursor.rowcount:
+            logger.warning(f"{job} failed after its lease was taken over, failure not recorded")
+
+    def progress(self, exam_id):
+        counts = {status: 0 for status in JOB_STATUSES}
+        for status, count in self._connect().execute(
+            "SELECT status, COUNT(*) FROM jobs WHERE exam_id = ? GROUP BY status", (str(exam_id),)
+        ):
+            counts[status] = count
+        return counts
+
+
+class LeaseHeartbeat:
+    """
+    Renews the lease of a job from a background thread while it is processed
+
+    Usage:
+        with LeaseHeartbeat(queue, job):
+            process_submission(job.submission_id)
+    """
+
+    def __init__(self, queue, job, interval=None):
+        self.queue = queue
+        self.job = job
+        self.interval = interval or max(1.0, JOB_LEASE_SECONDS / 3)
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _beat(self):
+        while not self._stop.wait(self.interval):
+            try:
+                if not self.queue.renew(self.job):
+                    logger.warning(f"Lost the lease on {self.job}")
+                    return
+            except Exception as e:
+                logger.warning(f"Could not renew the lease on {self.job}: {e}")
+
+    def __enter__(self):
+        self._thread = threading.Thread(target=self._beat, name=f"lease-{self.job.id}", daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        self._thread.join()
+        return False
+
+
+_queue = None
+_queue_lock = threading.Lock()
+
+
+def get_job_queue():
+    """Return the job queue for the configured backend"""
+    global _queue
+    with _queue_lock:
+        if _queue is None:
+            _queue = LocalJobQueue() if JOB_QUEUE_BACKEND == "local" else MongoJobQueue()
+        return _queue
+
+
+def enqueue_submission(submission, kind='process'):
+    """
+    Queue a saved Submission for background work
+
+    Args:
+        submission: Saved Submission
+        kind: "process" for OCR, segmentation and grading, "resegment" to segment
+              and grade again from the stored OCR document
+    """
+    if kind not in JOB_KINDS:
+        raise ValueError(f"Unknown job kind: {kind}")
+    get_job_queue().enqueue(submission, kind)
+    logger.info(f"Queued submission {submission.id} ({kind})")
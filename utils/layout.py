@@ -0,0 +1,302 @@
+"""
+Layout analysis ahead of OCR: columns, text lines and answer regions
+
+Works on the binarized page from the preprocessing pipeline with projection
+profiles: a vertical profile finds empty gutters between columns, a
+horizontal profile inside each column finds text lines, and large vertical
+gaps between lines split a column into answer regions. Blank pages and
+blank strips are dropped before any OCR runs.
+
+Each line is recognized on its own (Tesseract --psm 7, single text line),
+so lines can run in parallel and identical lines (printed headers repeated
+on every sheet) are served from a small in-process cache.
+
+Settings (environment variables):
+    OCR_LAYOUT            - "0" to OCR whole pages instead of lines (default: "1")
+    OCR_LINE_THREADS      - lines recognized concurrently per page (default: 4)
+    OCR_LINE_CACHE_SIZE   - recognized lines kept in memory (default: 4096)
+"""
+import os
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pytesseract
+
+logger = logging.getLogger(__name__)
+
+OCR_LAYOUT = os.environ.get("OCR_LAYOUT", "1") != "0"
+OCR_LINE_THREADS = int(os.environ.get("OCR_LINE_THREADS", "4"))
+OCR_LINE_CACHE_SIZE = int(os.environ.get("OCR_LINE_CACHE_SIZE", "4096"))
+
+# A row/column counts as ink when this share of its pixels is dark
+MIN_INK_RATIO = 0.002
+# Pages with less ink than this overall are treated as blank
+BLANK_PAGE_RATIO = 0.0005
+# Text rows separated by at most this many empty rows belong to one line
+LINE_GAP_PX = 3
+MIN_LINE_HEIGHT = 8
+MIN_LINE_WIDTH = 12
+# Empty vertical strips at least this wide (as a share of page width) separate columns
+MIN_GUTTER_RATIO = 0.04
+MIN_COLUMN_RATIO = 0.08
+# A gap of more than this many median line heights starts a new answer region
+REGION_GAP_FACTOR = 2.5
+LINE_PADDING = 4
+
+LINE_TESSERACT_CONFIG = r'--oem 1 --psm 7'
+TESSERACT_TIMEOUT = 30
+
+
+class LineBox:
+    """Bounding box of one text line; region and column are indexes in the page layout"""
+
+    def __init__(self, x, y, width, height, column=0, region=0):
+        self.x = x
+        self.y = y
+        self.width = width
+        self.height = height
+        self.column = column
+        self.region = region
+
+    @property
+    def bbox(self):
+        return self.x, self.y, self.width, self.height
+
+    def crop(self, image):
+        """View of this line in an image with the page's dimensions (no copy)"""
+        return image[self.y:self.y + self.height, self.x:self.x + self.width]
+
+    def __repr__(self):
+        return f'<LineBox {self.bbox} column={self.column} region={self.region}>'
+
+
+class LineResult:
+    """Recognized text of one line with its confidence (0-1)"""
+
+    def __init__(self, box, text, confidence):
+        self.box = box
+        self.text = text
+        self.confidence = confidence
+
+
+class PageLayout:
+    """Lines of a page in reading order (column by column, top to bottom)"""
+
+    def __init__(self, width, height, lines, regions):
+        self.width = width
+        self.height = height
+        self.lines = lines
+        self.regions = regions
+
+    @property
+    def blank(self):
+        return not self.lines
+
+    def __repr__(self):
+        return f'<PageLayout {self.width}x{self.height} {len(self.lines)} lines {len(self.regions)} regions>'
+
+
+def _runs(active, max_gap, min_length):
+    """(start, end) spans of True values, bridging gaps of up to max_gap and dropping short spans"""
+    indexes = np.flatnonzero(active)
+    if indexes.size == 0:
+        return []
+    breaks = np.flatnonzero(np.diff(indexes) > max_gap + 1)
+    starts = np.concatenate(([indexes[0]], indexes[breaks + 1]))
+    ends = np.concatenate((indexes[breaks], [indexes[-1]])) + 1
+    return [(int(start), int(end)) for start, end in zip(starts, ends) if end - start >= min_length]
+
+
+def detect_columns(ink):
+    """Column spans separated by empty vertical gutters"""
+    height, width = ink.shape
+    profile = ink.sum(axis=0) > max(1, MIN_INK_RATIO * height)
+    gutter = max(1, int(MIN_GUTTER_RATIO * width))
+    columns = _runs(profile, gutter - 1, max(1, int(MIN_COLUMN_RATIO * width)))
+    return columns or [(0, width)]
+
+
+def detect_lines(ink, x0, x1):
+    """Text line boxes inside one column, trimmed to their ink horizontally"""
+    strip = ink[:, x0:x1]
+    profile = strip.sum(axis=1) > max(1, MIN_INK_RATIO * (x1 - x0))
+    height, width = ink.shape
+
+    boxes = []
+    for top, bottom in _runs(profile, LINE_GAP_PX, MIN_LINE_HEIGHT):
+        columns = np.flatnonzero(strip[top:bottom].any(axis=0))
+        if columns.size == 0 or columns[-1] - columns[0] + 1 < MIN_LINE_WIDTH:
+            continue
+        left = max(0, x0 + int(columns[0]) - LINE_PADDING)
+        right = min(width, x0 + int(columns[-1]) + 1 + LINE_PADDING)
+        y = max(0, top - LINE_PADDING)
+        boxes.append(LineBox(left, y, right - left, min(height, bottom + LINE_PADDING) - y))
+    return boxes
+
+
+def analyze_layout(binary):
+    """
+    Find the columns, lines and answer regions of a page
+
+    Args:
+        binary: Preprocessed page (black text on white, uint8), e.g. PagePreprocessor.handwritten
+
+    Returns:
+        PageLayout; its lines are empty for a blank page
+    """
+    height, width = binary.shape[:2]
+    ink = binary < 128
+    if ink.mean() < BLANK_PAGE_RATIO:
+        return PageLayout(width, height, [], [])
+
+    lines = []
+    regions = []
+    for column_index, (x0, x1) in enumerate(detect_columns(ink)):
+        column_lines = detect_lines(ink, x0, x1)
+        if not column_lines:
+            continue
+
+        median_height = float(np.median([line.height for line in column_lines]))
+        region = [column_lines[0]]
+        for previous, line in zip(column_lines, column_lines[1:]):
+            if line.y - (previous.y + previous.height) > REGION_GAP_FACTOR * median_height:
+                regions.append(region)
+                region = []
+            region.append(line)
+        regions.append(region)
+
+        for line in column_lines:
+            line.column = column_index
+        lines.extend(column_lines)
+
+    for region_index, region in enumerate(regions):
+        for line in region:
+            line.region = region_index
+
+    region_boxes = []
+    for region in regions:
+        left = min(line.x for line in region)
+        top = min(line.y for line in region)
+        right = max(line.x + line.width for line in region)
+        bottom = max(line.y + line.height for line in region)
+        region_boxes.append((left, top, right - left, bottom - top))
+    return PageLayout(width, height, lines, region_boxes)
+
+
+class LineCache:
+    """Small thread-safe LRU of recognized lines, keyed by crop content and engine settings"""
+
+    def __init__(self, max_size=None):
+        self.max_size = OCR_LINE_CACHE_SIZE if max_size is None else max_size
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(crop, settings):
+        digest = hashlib.blake2b(digest_size=16)
+        digest.update(settings.encode())
+        digest.update(str(crop.shape).encode())
+        digest.update(np.ascontiguousarray(crop).data)
+        return digest.hexdigest()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def put(self, key, entry):
+        if not self.max_size:
+            return
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+
+line_cache = LineCache()
+
+
+def recognize_line_tesseract(crop):
+    """Tesseract on a single line crop; returns (text, confidence 0-1)"""
+    key = LineCache.key(crop, LINE_TESSERACT_CONFIG)
+    cached = line_cache.get(key)
+    if cached is not None:
+        return cached
+
+    data = pytesseract.image_to_data(
+        crop,
+        config=LINE_TESSERACT_CONFIG,
+        lang='eng',
+        timeout=TESSERACT_TIMEOUT,
+        output_type=pytesseract.Output.DICT
+    )
+    words = []
+    confidences = []
+    for word, conf in zip(data['text'], data['conf']):
+        conf = float(conf)
+        if conf >= 0 and word.strip():
+            words.append(word)
+            confidences.append(conf)
+
+    result = (" ".join(words), sum(confidences) / len(confidences) / 100.0 if confidences else 0.0)
+    line_cache.put(key, result)
+    return result
+
+
+def ocr_lines(image, layout, recognizer=recognize_line_tesseract, threads=None):
+    """
+    Recognize every line of a page
+
+    Args:
+        image: Page image the layout was computed on (variant used for recognition)
+        layout: PageLayout from analyze_layout
+        recognizer: Callable(crop) returning (text, confidence)
+        threads: Lines recognized concurrently (defaults to OCR_LINE_THREADS)
+
+    Returns:
+        List of LineResult in reading order
+    """
+    if layout.blank:
+        return []
+
+    crops = [line.crop(image) for line in layout.lines]
+    threads = min(threads or OCR_LINE_THREADS, len(crops))
+    if threads > 1:
+        # pytesseract runs a subprocess per call, so threads give real parallelism
+        with ThreadPoolExecutor(max_workers=threads) as pool:
+            recognized = list(pool.map(recognizer, crops))
+    else:
+        recognized = [recognizer(crop) for crop in crops]
+
+    return [LineResult(line, text, confidence)
+            for line, (text, confidence) in zip(layout.lines, recognized)]
+
+
+def join_lines(results):
+    """Page text from line results, with a blank line between answer regions"""
+    parts = []
+    previous_region = None
+    for result in results:
+        if not result.text.strip():
+            continue
+        if previous_region is not None and result.box.region != previous_region:
+            parts.append("")
+        parts.append(result.text)
+        previous_region = result.box.region
+    return "\n".join(parts)
+
+
+def mean_confidence(results):
+    """Confidence of a page: line confidences weighted by text length"""
+    weights = [len(result.text.strip()) for result in results]
+    total = sum(weights)
+    if not total:
+        return 0.0
+    return sum(result.confidence * weight for result, weight in zip(results, weights)) / total
@@ -0,0 +1,118 @@
+"""
+Resident-memory measurement for the OCR pipeline
+
+RSS is read from /proc (current value, works for child processes too) and
+falls back to resource.getrusage (peak value of this process) elsewhere.
+
+Budgets count the growth of RSS above a baseline, not the total: models a
+worker preloads (TrOCR alone is several hundred MB) are recorded with
+set_baseline() once they are warm and are not charged to any page.
+
+Settings (environment variables):
+    OCR_PROCESS_MEMORY_MB - RSS growth one OCR process may use while working on a page (default: 512)
+"""
+import os
+import gc
+import logging
+
+logger = logging.getLogger(__name__)
+
+OCR_PROCESS_MEMORY_MB = int(os.environ.get("OCR_PROCESS_MEMORY_MB", "512"))
+
+# Page-sized buffers alive at once while a page is preprocessed
+# (gray, blurred, adaptive threshold, cleaned variant, Otsu variant, ink mask)
+PAGE_BUFFER_COPIES = 6
+
+_PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+# RSS (MB) of this process that budgets do not charge, see set_baseline()
+_baseline_mb = 0.0
+
+
+class MemoryBudgetExceeded(MemoryError):
+    """Raised when a page cannot be processed within the configured RSS budget"""
+
+
+def rss_mb(pid=None):
+    """
+    Resident set size of a process in MB
+
+    Args:
+        pid: Process id (defaults to this process)
+
+    Returns:
+        RSS in MB, or 0.0 if it cannot be measured
+    """
+    try:
+        with open(f"/proc/{pid or 'self'}/statm") as statm:
+            return int(statm.read().split()[1]) * _PAGE_SIZE / (1024 * 1024)
+    except (OSError, ValueError, IndexError):
+        pass
+
+    if pid is None or pid == os.getpid():
+        try:
+            import resource
+            # Peak, not current, and KB on Linux - an upper bound is fine for budgeting
+            return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+        except (ImportError, OSError):
+            pass
+    return 0.0
+
+
+def tree_rss_mb(pids):
+    """Combined RSS of this process and the given child processes"""
+    return rss_mb() + sum(rss_mb(pid) for pid in pids)
+
+
+def set_baseline(mb=None):
+    """
+    Record the RSS this process needs before any page is processed
+
+    Call it once preloaded models are warm; budgets created afterwards only
+    count memory allocated on top of it.
+
+    Args:
+        mb: Baseline in MB (defaults to the current RSS)
+
+    Returns:
+        The baseline in MB
+    """
+    global _baseline_mb
+    _baseline_mb = rss_mb() if mb is None else float(mb)
+    logger.info(f"OCR memory baseline {_baseline_mb:.0f}MB, budget {OCR_PROCESS_MEMORY_MB}MB on top")
+    return _baseline_mb
+
+
+def get_baseline():
+    return _baseline_mb
+
+
+class MemoryBudget:
+    """RSS growth limit for the current process, above a baseline"""
+
+    def __init__(self, limit_mb=None, baseline_mb=None):
+        self.limit_mb = limit_mb or OCR_PROCESS_MEMORY_MB
+        self.baseline_mb = _baseline_mb if baseline_mb is None else baseline_mb
+
+    def used_mb(self):
+        return max(0.0, rss_mb() - self.baseline_mb)
+
+    def available_mb(self):
+        return max(0.0, self.limit_mb - self.used_mb())
+
+    def fits(self, needed_mb):
+        """Whether needed_mb more would stay in budget, collecting garbage once before saying no"""
+        if needed_mb <= self.available_mb():
+            return True
+        gc.collect()
+        return needed_mb <= self.available_mb()
+
+    def enforce(self, what="OCR"):
+        """Raise MemoryBudgetExceeded if the process is already over its budget"""
+        if self.available_mb() > 0:
+            return
+        gc.collect()
+        used = self.used_mb()
+        if used > self.limit_mb:
+            raise MemoryBudgetExceeded(f"{what} needs more memory than the {self.limit_mb}MB budget "
+                                       f"({used:.0f}MB above the {self.baseline_mb:.0f}MB baseline)")
@@ -0,0 +1,394 @@
+"""
+Content-addressed cache for OCR results
+
+Entries are keyed by the SHA-256 of the uploaded file plus a fingerprint of
+the OCR settings that produced them (engine, Tesseract psm/oem, preprocessing
+mode, DPI), so re-grading or a duplicate upload of the same script never runs
+OCR again, while changing any OCR setting naturally misses the cache.
+get_or_compute_pages stores the structured page records (utils.ocr_document)
+under their own keys; results with error pages are not cached.
+
+Settings (environment variables):
+    OCR_CACHE_BACKEND  - "disk" (default), "mongo" or "none"
+    OCR_CACHE_DIR      - directory for the disk backend (default: instance/ocr_cache)
+    OCR_CACHE_MAX_MB   - size bound before least-recently-used entries are evicted (default: 512)
+"""
+import os
+import re
+import json
+import hashlib
+import logging
+import tempfile
+import threading
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+OCR_CACHE_BACKEND = os.environ.get("OCR_CACHE_BACKEND", "disk").lower()
+OCR_CACHE_DIR = os.environ.get("OCR_CACHE_DIR", os.path.join("instance", "ocr_cache"))
+OCR_CACHE_MAX_MB = int(os.environ.get("OCR_CACHE_MAX_MB", "512"))
+
+# Bump when the OCR pipeline changes in a way that invalidates old results
+OCR_CACHE_VERSION = 2
+
+HASH_CHUNK_SIZE = 1024 * 1024
+
+# The disk cache tracks its size per process; rescan the directory after this
+# many writes so entries written by other workers are counted too
+DISK_RESCAN_WRITES = 200
+# Eviction frees space down to this share of the bound, so a full cache is not rescanned on every write
+DISK_EVICT_TO = 0.9
+
+# Results that describe a failure rather than the document are never cached
+UNCACHEABLE_PREFIXES = (
+    "[Error",
+    "[OCR processing error",
+    "[Image size",
+    "[TEXT EXTRACTION FROM",
+)
+
+PAGE_MARKER = re.compile(r'\n--- Page (\d+) ---\n')
+
+
+def file_sha256(source):
+    """
+    SHA-256 of a file's contents
+
+    Args:
+        source: Path, bytes, or a readable binary file object
+
+    Returns:
+        Hex digest
+    """
+    digest = hashlib.sha256()
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        digest.update(source)
+    elif hasattr(source, 'read'):
+        for chunk in iter(lambda: source.read(HASH_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    else:
+        with open(source, 'rb') as f:
+            for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+                digest.update(chunk)
+    return digest.hexdigest()
+
+
+def cache_key(content_hash, settings):
+    """Combine a content hash and an OCR settings dict into a cache key"""
+    fingerprint = json.dumps(dict(settings, version=OCR_CACHE_VERSION), sort_keys=True)
+    return hashlib.sha256(f"{content_hash}:{fingerprint}".encode('utf-8')).hexdigest()
+
+
+def split_pages(text):
+    """Split "--- Page N ---" marked OCR output into per-page results"""
+    parts = PAGE_MARKER.split(text)
+    if len(parts) == 1:
+        return [{"page": 1, "text": text}]
+    return [{"page": int(parts[i]), "text": parts[i + 1]} for i in range(1, len(parts) - 1, 2)]
+
+
+def is_cacheable(text):
+    """Only cache real extraction results"""
+    return bool(text and text.strip()) and not text.lstrip().startswith(UNCACHEABLE_PREFIXES)
+
+
+class DiskOCRCache:
+    """
+    OCR cache stored as JSON files on local disk, evicted by least-recent access
+
+    Writes keep a running total of the cache size, so the directory is only
+    walked when the total crosses the bound, on the first write, or every
+    DISK_RESCAN_WRITES writes.
+    """
+
+    def __init__(self, directory=None, max_mb=None):
+        self.directory = directory or OCR_CACHE_DIR
+        self.max_bytes = (max_mb or OCR_CACHE_MAX_MB) * 1024 * 1024
+        self._lock = threading.Lock()
+        self._size = None  # Bytes on disk as of the last scan plus later writes; None until scanned
+        self._writes = 0
+        os.makedirs(self.directory, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], f"{key}.json")
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                entry = json.load(f)
+            # Touch the file so eviction sees it as recently used
+            os.utime(path, None)
+            return entry
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logger.warning(f"Discarding unreadable OCR cache entry {key}: {e}")
+            self.delete(key)
+            return None
+
+    def _file_size(self, path):
+        try:
+            return os.path.getsize(path)
+        except FileNotFoundError:
+            return 0
+
+    def _account(self, delta):
+        """Add a write's size change to the running total; returns whether a scan is due"""
+        with self._lock:
+            if self._size is None:
+                return True
+            self._size += delta
+            self._writes += 1
+            return self._size > self.max_bytes or self._writes >= DISK_RESCAN_WRITES
+
+    def put(self, key, entry):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        replaced = self._file_size(path)
+        # Write to a temp file and rename so readers never see a partial entry
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump(entry, f)
+            os.replace(tmp_path, path)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        if self._account(self._file_size(path) - replaced):
+            self.evict()
+
+    def delete(self, key):
+        path = self._path(key)
+        size = self._file_size(path)
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            return
+        with self._lock:
+            if self._size is not None:
+                self._size -= size
+
+    def evict(self):
+        """Scan the directory and remove least-recently-used entries until the cache fits its size bound"""
+        with self._lock:
+            self._writes = 0
+            entries = []
+            total = 0
+            for root, _dirs, files in os.walk(self.directory):
+                for name in files:
+                    if not name.endswith('.json'):
+                        continue
+                    path = os.path.join(root, name)
+                    try:
+                        stat = os.stat(path)
+                    except FileNotFoundError:
+                        continue
+                    entries.append((stat.st_mtime, stat.st_size, path))
+                    total += stat.st_size
+
+            if total <= self.max_bytes:
+                self._size = total
+                return
+
+            entries.sort()
+            target = self.max_bytes * DISK_EVICT_TO
+            for _mtime, size, path in entries:
+                if total <= target:
+                    break
+                try:
+                    os.remove(path)
+                    total -= size
+                except FileNotFoundError:
+                    pass
+            self._size = total
+            logger.info(f"OCR cache evicted down to {total // 1024} KB")
+
+
+class MongoOCRCache:
+    """OCR cache stored in the ocr_cache collection, evicted by least-recent access"""
+
+    def __init__(self, max_mb=None):
+        self.max_bytes = (max_mb or OCR_CACHE_MAX_MB) * 1024 * 1024
+
+    def get(self, key):
+        from models import OCRCacheEntry
+        entry = OCRCacheEntry.objects(key=key).modify(set__last_accessed=datetime.utcnow())
+        if entry is None:
+            return None
+        return {"text": entry.text, "pages": entry.pages, "settings": entry.settings}
+
+    def put(self, key, entry):
+        from models import OCRCacheEntry
+        OCRCacheEntry.objects(key=key).update_one(
+            upsert=True,
+            set__content_hash=entry.get("content_hash", ""),
+            set__settings=entry.get("settings", {}),
+            set__text=entry["text"],
+            set__pages=entry.get("pages", []),
+            # Pages and settings are stored too, so count the whole entry, not just the text
+            set__size_bytes=len(json.dumps(entry).encode('utf-8')),
+            set__last_accessed=datetime.utcnow(),
+        )
+        self.evict()
+
+    def delete(self, key):
+        from models import OCRCacheEntry
+        OCRCacheEntry.objects(key=key).delete()
+
+    def evict(self):
+        """Remove least-recently-used entries until the collection fits its size bound"""
+        from models import OCRCacheEntry
+        totals = list(OCRCacheEntry.objects.aggregate([
+            {"$group": {"_id": None, "total": {"$sum": "$size_bytes"}}}
+        ]))
+        total = totals[0]["total"] if totals else 0
+        if total <= self.max_bytes:
+            return
+
+        stale_ids = []
+        for entry in OCRCacheEntry.objects.order_by('last_accessed').only('id', 'size_bytes'):
+            if total <= self.max_bytes:
+                break
+            stale_ids.append(entry.id)
+            total -= entry.size_bytes or 0
+        OCRCacheEntry.objects(id__in=stale_ids).delete()
+        logger.info(f"OCR cache evicted {len(stale_ids)} entries")
+
+
+class OCRCache:
+    """Front end shared by the OCR entry points"""
+
+    def __init__(self, backend):
+        self.backend = backend
+
+    def get_or_compute(self, source, settings, compute):
+        """
+        Return cached OCR text for a file, computing and storing it on a miss
+
+        Args:
+            source: Path, bytes or binary file object for the uploaded file
+            settings: Dict describing the OCR configuration used by compute
+            compute: Zero-argument callable that runs OCR and returns the text
+
+        Returns:
+            Extracted text
+        """
+        if self.backend is None:
+            return compute()
+
+        try:
+            content_hash = file_sha256(source)
+            key = cache_key(content_hash, settings)
+            entry = self.backend.get(key)
+            if entry is not None:
+                logger.info(f"OCR cache hit for {content_hash[:12]}")
+                return entry["text"]
+        except Exception as e:
+            # The cache is an optimization - never fail OCR because of it
+            logger.warning(f"OCR cache lookup failed: {e}")
+            return compute()
+
+        text = compute()
+        if is_cacheable(text):
+            try:
+                self.backend.put(key, {
+                    "content_hash": content_hash,
+                    "settings": settings,
+                    "text": text,
+                    "pages": split_pages(text),
+                })
+            except Exception as e:
+                logger.warning(f"OCR cache store failed: {e}")
+        return text
+
+    def get_or_compute_pages(self, source, settings, compute):
+        """
+        Return cached page records for a file, computing and storing them on a miss
+
+        Args:
+            source: Path, bytes or binary file object for the uploaded file
+            settings: Dict describing the OCR configuration used by compute
+            compute: Zero-argument callable that runs OCR and returns page records
+
+        Returns:
+            List of page records (see utils.ocr_document)
+        """
+        if self.backend is None:
+            return compute()
+
+        try:
+            content_hash = file_sha256(source)
+            key = cache_key(content_hash, dict(settings, output="pages"))
+            entry = self.backend.get(key)
+            if entry is not None:
+                logger.info(f"OCR cache hit for {content_hash[:12]}")
+                return entry["pages"]
+        except Exception as e:
+            # The cache is an optimization - never fail OCR because of it
+            logger.warning(f"OCR cache lookup failed: {e}")
+            return compute()
+
+        pages = compute()
+        try:
+            self._put_pages(key, content_hash, settings, pages)
+        except Exception as e:
+            logger.warning(f"OCR cache store failed: {e}")
+        return pages
+
+    def store_pages(self, source, settings, pages):
+        """
+        Replace the cached page records of a file, e.g. after some of its pages were OCR'd again
+
+        Records that would not be cached (errors, no text) drop the old entry
+        instead, so stale pages are never served for the file.
+
+        Args:
+            source: Path, bytes or binary file object for the uploaded file
+            settings: Dict describing the OCR configuration, as for get_or_compute_pages
+            pages: Page records for the whole file
+        """
+        if self.backend is None:
+            return
+        try:
+            content_hash = file_sha256(source)
+            key = cache_key(content_hash, dict(settings, output="pages"))
+            if not self._put_pages(key, content_hash, settings, pages):
+                self.backend.delete(key)
+        except Exception as e:
+            logger.warning(f"OCR cache update failed: {e}")
+
+    def _put_pages(self, key, content_hash, settings, pages):
+        """Store page records if they are worth caching; returns whether they were stored"""
+        from utils.ocr_document import pages_to_text, has_errors
+
+        text = pages_to_text(pages)[0]
+        if not pages or has_errors(pages) or not is_cacheable(text):
+            return False
+        self.backend.put(key, {
+            "content_hash": content_hash,
+            "settings": settings,
+            "text": text,
+            "pages": pages,
+        })
+        return True
+
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+def get_ocr_cache():
+    """Return the process-wide OCR cache for the configured backend"""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            if OCR_CACHE_BACKEND == "mongo":
+                backend = MongoOCRCache()
+            elif OCR_CACHE_BACKEND == "disk":
+                backend = DiskOCRCache()
+            else:
+                backend = None
+            _cache = OCRCache(backend)
+        return _cache
@@ -0,0 +1,143 @@
+"""
+Structured OCR output: pages -> lines -> bounding box, text and confidence
+
+A page record is a plain dict so it can be cached as JSON and stored as-is
+in the ocr_documents collection:
+
+    {"page": 2, "source": "ocr", "engine": "tesseract-handwritten",
+     "score": 0.82, "dpi": 150,
+     "lines": [[x, y, width, height, "text", confidence, region], ...]}
+
+source is "ocr", "text_layer" (PDF text, bbox in points at dpi 72), "raw"
+(content-stream fallback, no boxes) or "error". Records without lines carry
+their text in "text".
+
+The flat text the rest of the pipeline works on is always rebuilt from the
+records by pages_to_text, which also returns where every line sits in that
+text, so answer segments can be mapped back to the pages and lines they
+came from.
+"""
+import bisect
+
+LINE_X, LINE_Y, LINE_WIDTH, LINE_HEIGHT, LINE_TEXT, LINE_CONFIDENCE, LINE_REGION = range(7)
+
+
+def line_record(line):
+    """Compact form of a layout.LineResult"""
+    box = line.box
+    return [int(box.x), int(box.y), int(box.width), int(box.height),
+            line.text, round(float(line.confidence), 3), int(box.region)]
+
+
+def page_record(number, result, dpi=None):
+    """Record for a page recognized by the OCR cascade (an ocr_router.EngineResult)"""
+    return {
+        "page": number,
+        "source": "ocr",
+        "engine": result.engine,
+        "score": round(float(result.score), 3),
+        "dpi": dpi,
+        "lines": [line_record(line) for line in result.lines if line.text.strip()],
+    }
+
+
+def text_record(number, text, source, engine=None):
+    """Record for text without line geometry (content-stream fallback, errors)"""
+    record = {"page": number, "source": source, "engine": engine, "score": None, "dpi": None,
+              "lines": [], "text": text}
+    if source == "error":
+        record["error"] = True
+    return record
+
+
+def page_text(record):
+    """Text of one page, with a blank line between answer regions"""
+    lines = record.get("lines")
+    if not lines:
+        return record.get("text", "")
+    parts = []
+    previous_region = None
+    for line in lines:
+        if previous_region is not None and line[LINE_REGION] != previous_region:
+            parts.append("")
+        parts.append(line[LINE_TEXT])
+        previous_region = line[LINE_REGION]
+    return "\n".join(parts)
+
+
+def pages_to_text(pages):
+    """
+    Flat OCR text with "--- Page N ---" markers, plus a line index into it
+
+    Returns:
+        (text, index) where index is a list of (start, end, page, line) in
+        text order; line is -1 for a record without line geometry
+    """
+    parts = []
+    index = []
+    position = 0
+
+    def add(fragment):
+        nonlocal position
+        parts.append(fragment)
+        position += len(fragment)
+
+    for record in pages:
+        add(f"\n--- Page {record['page']} ---\n")
+        lines = record.get("lines")
+        if not lines:
+            text = record.get("text", "")
+            index.append((position, position + len(text), record["page"], -1))
+            add(text)
+        else:
+            previous_region = None
+            for number, line in enumerate(lines):
+                if previous_region is not None:
+                    add("\n\n" if line[LINE_REGION] != previous_region else "\n")
+                index.append((position, position + len(line[LINE_TEXT]), record["page"], number))
+                add(line[LINE_TEXT])
+                previous_region = line[LINE_REGION]
+        add("\n")
+    return "".join(parts), index
+
+
+def answer_spans(spans, index):
+    """
+    Map character spans of the flat text to page / line ranges
+
+    Args:
+        spans: (start, end) per answer, e.g. Segmentation.spans
+        index: Line index from pages_to_text
+
+    Returns:
+        One list per answer of {"page", "first_line", "last_line"} dicts
+    """
+    starts = [entry[0] for entry in index]
+    result = []
+    for start, end in spans:
+        ranges = []
+        if end > start:
+            # First line that ends after the span starts, up to the last line starting before it ends
+            first = max(0, bisect.bisect_right(starts, start) - 1)
+            if first < len(index) and index[first][1] <= start:
+                first += 1
+            last = bisect.bisect_left(starts, end)
+            for _, _, page, line in index[first:last]:
+                if ranges and ranges[-1]["page"] == page:
+                    ranges[-1]["last_line"] = line
+                else:
+                    ranges.append({"page": page, "first_line": line, "last_line": line})
+        result.append(ranges)
+    return result
+
+
+def replace_pages(pages, new_pages):
+    """Pages with the records in new_pages swapped in by page number"""
+    by_number = {record["page"]: record for record in new_pages}
+    merged = [by_number.pop(record["page"], record) for record in pages]
+    merged.extend(by_number.values())
+    return sorted(merged, key=lambda record: record["page"])
+
+
+def has_errors(pages):
+    return any(record.get("error") for record in pages)
@@ -0,0 +1,315 @@
+import os
+import re
+import logging
+import pytesseract
+from PIL import Image
+import io
+import shutil
+import tempfile
+from werkzeug.utils import secure_filename
+import cv2
+import numpy as np
+import fitz  # PyMuPDF
+from utils.image_pipeline import PagePreprocessor
+from utils.tiled_ocr import load_gray, recognize_image
+from utils.memory_budget import MemoryBudget, get_baseline, rss_mb
+from utils.segmentation import segment_text
+from utils.ocr_document import page_record, text_record, page_text, pages_to_text, replace_pages
+
+# Setup logging
+logger = logging.getLogger(__name__)
+
+def preprocess_image(image, is_handwritten=False):
+    """
+    Preprocess image for better OCR results
+    
+    Kept for callers that want a PIL image; OCR paths use PagePreprocessor
+    directly so a page is only decoded and converted once.
+    
+    Args:
+        image: PIL Image object
+        is_handwritten: Boolean flag to indicate if the image contains handwritten text
+    
+    Returns:
+        Processed PIL Image
+    """
+    try:
+        return Image.fromarray(PagePreprocessor(image).variant(is_handwritten))
+    except Exception as e:
+        logger.error(f"Error preprocessing image: {e}")
+        # Return the original image if preprocessing fails
+        return image
+
+def ocr_settings(kind, is_handwritten=True):
+    """Describe the OCR configuration used for a file, for cache keying"""
+    from utils.parallel_ocr import TESSERACT_CONFIG, OCR_PDF_DPI
+    from utils.ocr_router import get_router
+    from utils.layout import OCR_LAYOUT
+    from utils.tiled_ocr import OCR_TILE_PIXELS
+    from utils.pdf_backend import PDF_TEXT_LAYER_MIN_CHARS
+    router = get_router()
+    return {
+        "engine": "+".join(router.engine_names),
+        "accept_threshold": router.threshold,
+        "layout": "lines" if OCR_LAYOUT else "page",
+        "tile_pixels": OCR_TILE_PIXELS,
+        "tesseract_config": TESSERACT_CONFIG,
+        "kind": kind,
+        "mode": "handwritten" if is_handwritten else "printed",
+        "dpi": OCR_PDF_DPI if kind == ".pdf" else None,
+        "pdf_text_layer": ("pymupdf", PDF_TEXT_LAYER_MIN_CHARS) if kind == ".pdf" else None,
+    }
+
+def extract_text_from_image(image_path):
+    """Extract text from an image file, reusing a cached result for identical content"""
+    from utils.ocr_cache import get_ocr_cache
+    return get_ocr_cache().get_or_compute(
+        image_path,
+        ocr_settings("image"),
+        lambda: _extract_text_from_image(image_path)
+    )
+
+def _extract_text_from_image(image_path):
+    """Extract text from an image file through the confidence-driven OCR cascade"""
+    return page_text(extract_image_pages(image_path)[0])
+
+def extract_image_pages(image_path, is_handwritten=True):
+    """
+    OCR an image file into a single page record
+    
+    Returns:
+        List with one page record (see utils.ocr_document)
+    """
+    try:
+        logger.info(f"Extracting text from image: {image_path}")
+        
+        # Decode once to a grayscale buffer, within the process memory budget
+        # (counted from here, so models already loaded are not charged to the page)
+        budget = MemoryBudget(baseline_mb=max(get_baseline(), rss_mb()))
+        try:
+            gray = load_gray(image_path, budget)
+        except Exception as img_err:
+            logger.error(f"Error loading image: {img_err}")
+            return [text_record(1, f"[Error loading image: {str(img_err)}]", "error")]
+        
+        # Run the engine cascade: cheapest engine first, stopping at the first
+        # result whose confidence clears the acceptance threshold. Large scans
+        # are processed in strips instead of being downscaled or refused.
+        try:
+            from utils.ocr_router import get_router
+            router = get_router()
+            result = recognize_image(gray, lambda page: router.recognize(page, is_handwritten),
+                                     source_path=image_path, budget=budget)
+            
+            logger.debug(f"Extracted text from image with {result.engine} (score {result.score:.2f}): {len(result.text)} characters")
+            return [page_record(1, result)]
+            
+        except Exception as ocr_err:
+            logger.error(f"OCR error: {ocr_err}")
+            return [text_record(1, f"[OCR processing error: {str(ocr_err)}]", "error")]
+            
+    except Exception as e:
+        logger.error(f"Error extracting text from image: {e}")
+        return [text_record(1, f"[Error processing image: {str(e)}]", "error")]
+
+def extract_text_from_pdf(pdf_path):
+    """Extract text from a PDF file: text layers directly, other pages OCR'd in parallel"""
+    return pages_to_text(extract_pdf_pages(pdf_path))[0]
+
+def extract_pdf_pages(pdf_path, is_handwritten=True, page_numbers=None):
+    """
+    Extract a PDF as page records: text layers directly, other pages OCR'd in parallel
+    
+    Args:
+        pdf_path: Path to the PDF
+        is_handwritten: Whether to use the handwritten preprocessing mode
+        page_numbers: Optional 1-based page numbers to extract; all pages by default
+    
+    Returns:
+        List of page records (see utils.ocr_document)
+    """
+    try:
+        logger.debug(f"Processing PDF: {pdf_path}")
+        
+        # One PyMuPDF parse decides per page between the embedded text layer
+        # and OCR; only pages without usable text are rasterized
+        from utils.parallel_ocr import get_engine
+        try:
+            pages = get_engine().extract_pages(pdf_path, is_handwritten=is_handwritten, page_numbers=page_numbers)
+        except Exception as engine_err:
+            # Damaged files PyMuPDF cannot open can still have readable content streams
+            logger.error(f"PDF extraction failed: {engine_err}")
+            pages = []
+
+        # Per-page error notes alone mean nothing was recovered
+        recovered = any(page_text(record).strip() for record in pages if not record.get("error"))
+        if not recovered and not page_numbers:
+            logger.warning("No text extracted from PDF, trying fallback method")
+            # Fallback: scan the content streams for the strings shown by text operators
+            from utils.pdf_raw_text import extract_raw_text
+            text_content = extract_raw_text(pdf_path)
+            if len(text_content) > 100:  # If we found some meaningful text
+                pages = [text_record(1, f"[Extracted raw text from PDF]\n{text_content}", "raw", "content-stream")]
+        
+        logger.debug(f"Extracted {len(pages)} pages from PDF")
+        return pages
+    except Exception as e:
+        logger.error(f"Error extracting text from PDF: {e}")
+        # Return a more explicit error message for troubleshooting
+        return [text_record(1, f"[Error processing PDF: {str(e)}]", "error")]
+
+def process_file(file_path, is_handwritten=True):
+    """
+    Process an uploaded file (PDF or image) to extract text
+    
+    Args:
+        file_path: Path to the file to process
+        is_handwritten: Boolean indicating if the document contains handwritten text
+                      Default is True to enable handwritten text optimizations
+    
+    Returns:
+        Extracted text from the file
+    """
+    return pages_to_text(process_file_pages(file_path, is_handwritten))[0]
+
+def process_file_pages(file_path, is_handwritten=True):
+    """
+    Process an uploaded file (PDF or image) into per-page, per-line OCR records
+    
+    Results are cached by file content and OCR settings, so re-processing
+    the same upload (re-grades, duplicate submissions) skips OCR entirely.
+    
+    Args:
+        file_path: Path to the file to process
+        is_handwritten: Boolean indicating if the document contains handwritten text
+    
+    Returns:
+        List of page records (see utils.ocr_document)
+    """
+    from utils.ocr_cache import get_ocr_cache
+    file_ext = os.path.splitext(file_path)[1].lower()
+    return get_ocr_cache().get_or_compute_pages(
+        file_path,
+        ocr_settings(file_ext, is_handwritten),
+        lambda: _process_file_pages(file_path, is_handwritten)
+    )
+
+def reocr_file_pages(file_path, page_numbers, is_handwritten=True, base_pages=None):
+    """
+    OCR selected pages of a file again, bypassing the cache
+    
+    When the file's current page records are given, the new pages are
+    merged into them and the merged records replace the file's cache entry,
+    so a later full run does not bring the old pages back.
+    
+    Args:
+        file_path: Path to the file
+        page_numbers: 1-based page numbers to re-OCR
+        is_handwritten: Boolean indicating if the document contains handwritten text
+        base_pages: Optional page records of the whole file to merge into
+    
+    Returns:
+        Page records for the requested pages, or the merged records with base_pages
+    """
+    new_pages = _process_file_pages(file_path, is_handwritten, page_numbers)
+    if base_pages is None:
+        return new_pages
+    
+    from utils.ocr_cache import get_ocr_cache
+    pages = replace_pages(base_pages, new_pages)
+    file_ext = os.path.splitext(file_path)[1].lower()
+    get_ocr_cache().store_pages(file_path, ocr_settings(file_ext, is_handwritten), pages)
+    return pages
+
+def _process_file_pages(file_path, is_handwritten=True, page_numbers=None):
+    """Uncached body of process_file_pages"""
+    file_ext = os.path.splitext(file_path)[1].lower()
+    
+    # Log the processing attempt
+    logger.info(f"Processing file: {file_path} (Handwritten: {is_handwritten})")
+    
+    if file_ext == '.pdf':
+        return extract_pdf_pages(file_path, is_handwritten, page_numbers)
+    elif file_ext in ['.jpg', '.jpeg', '.png', '.bmp', '.tiff']:
+        # Any size: pages beyond the tiling threshold or the memory budget are OCR'd in strips
+        return extract_image_pages(file_path, is_handwritten)
+    else:
+        logger.error(f"Unsupported file format: {file_ext}")
+        return []
+
+def process_stream(stream, filename, is_handwritten=True, chunk_size=256 * 1024):
+    """
+    Process a file-like object (e.g. an open GridFS file) without reading it into memory
+    
+    Args:
+        stream: Readable binary file object
+        filename: Original filename, used for the file type
+        is_handwritten: Boolean indicating if the document contains handwritten text
+    
+    Returns:
+        Extracted text from the file
+    """
+    return pages_to_text(process_stream_pages(stream, filename, is_handwritten, chunk_size))[0]
+
+def process_stream_pages(stream, filename, is_handwritten=True, chunk_size=256 * 1024, page_numbers=None,
+                         base_pages=None):
+    """
+    Page records for a file-like object, spooled to a temporary file chunk by chunk
+    
+    Tesseract and the PDF tools work on paths, so the stream is never read
+    into memory whole.
+    
+    Args:
+        stream: Readable binary file object
+        filename: Original filename, used for the file type
+        is_handwritten: Boolean indicating if the document contains handwritten text
+        page_numbers: Re-OCR only these pages, bypassing the cache
+        base_pages: With page_numbers, the file's current page records to merge
+                    the new pages into (see reocr_file_pages)
+    
+    Returns:
+        List of page records (see utils.ocr_document)
+    """
+    suffix = os.path.splitext(filename or '')[1].lower()
+    fd, spool_path = tempfile.mkstemp(prefix="ocr_", suffix=suffix)
+    try:
+        with os.fdopen(fd, 'wb') as spool:
+            shutil.copyfileobj(stream, spool, chunk_size)
+        if page_numbers:
+            return reocr_file_pages(spool_path, page_numbers, is_handwritten, base_pages)
+        return process_file_pages(spool_path, is_handwritten)
+    finally:
+        os.remove(spool_path)
+
+def save_uploaded_file(uploaded_file, upload_folder):
+    """Save an uploaded file and return the path"""
+    filename = secure_filename(uploaded_file.filename)
+    file_path = os.path.join(upload_folder, filename)
+    uploaded_file.save(file_path)
+    logger.debug(f"Saved uploaded file to {file_path}")
+    return file_path
+
+def extract_text_segments(text, num_questions):
+    """
+    Segment extracted text into one answer per question
+    
+    Uses the single-pass marker scan and ordered boundary selection in
+    utils.segmentation; page markers are removed from the segments.
+    
+    Args:
+        text: Extracted text, optionally with "--- Page N ---" markers
+        num_questions: Number of questions in the exam
+    
+    Returns:
+        List of exactly num_questions answer texts (empty for unanswered questions)
+    """
+    try:
+        result = segment_text(text, num_questions)
+        if result.method != "markers":
+            logger.warning(f"No reliable question markers found; segmented by {result.method}")
+        return result.segments
+        
+    except Exception as e:
+        logger.error(f"Error in text segmentation: {e}")
+        # Return basic segments if all else fails
+        return ["Error segmenting text"] * num_questions
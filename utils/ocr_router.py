@@ -0,0 +1,350 @@
+"""
+Confidence-driven OCR engine cascade
+
+Engines run cheapest first. Each result is scored (Tesseract word
+confidences, TrOCR sequence probability, and the share of tokens that look
+like real words) and the cascade stops at the first engine whose score
+clears its threshold. If no engine is confident, the best-scoring result is
+used. Per-engine latency and accept rates are recorded so the thresholds can
+be tuned from real traffic.
+
+Default order: Tesseract (handwritten preprocessing) -> Tesseract (printed
+preprocessing) -> TrOCR -> Gemini. TrOCR and Gemini join the cascade only
+when their dependencies / API key are available.
+
+Settings (environment variables):
+    OCR_ACCEPT_THRESHOLD  - default score an engine must reach (default: 0.6)
+    OCR_ENABLE_TROCR      - "0" to leave TrOCR out of the cascade (default: "1")
+    OCR_ENABLE_GEMINI     - "0" to leave Gemini out of the cascade (default: "1")
+"""
+import os
+import re
+import time
+import logging
+import tempfile
+import threading
+
+import pytesseract
+from PIL import Image
+
+from utils.layout import OCR_LAYOUT, LineBox, LineResult, ocr_lines, join_lines, mean_confidence
+
+logger = logging.getLogger(__name__)
+
+OCR_ACCEPT_THRESHOLD = float(os.environ.get("OCR_ACCEPT_THRESHOLD", "0.6"))
+OCR_ENABLE_TROCR = os.environ.get("OCR_ENABLE_TROCR", "1") != "0"
+OCR_ENABLE_GEMINI = os.environ.get("OCR_ENABLE_GEMINI", "1") != "0"
+
+TESSERACT_CONFIG = r'--oem 1 --psm 6'
+TESSERACT_TIMEOUT = 30
+
+WORD_PATTERN = re.compile(r"[A-Za-z]+")
+VOWELS = set("aeiouyAEIOUY")
+
+_vocabulary = None
+_vocabulary_lock = threading.Lock()
+
+
+def _load_vocabulary():
+    """English word list from nltk if it is installed with its corpus, else None"""
+    global _vocabulary
+    with _vocabulary_lock:
+        if _vocabulary is None:
+            try:
+                from nltk.corpus import words
+                _vocabulary = {word.lower() for word in words.words()}
+            except Exception:
+                logger.info("nltk words corpus not available, using a heuristic word check")
+                _vocabulary = set()
+        return _vocabulary
+
+
+def dictionary_hit_rate(text):
+    """
+    Share of tokens that look like real words
+
+    Uses the nltk word list when available; otherwise a token counts as a
+    word if it is alphabetic, at least two letters long and has a vowel.
+    """
+    tokens = WORD_PATTERN.findall(text or "")
+    if not tokens:
+        return 0.0
+    vocabulary = _load_vocabulary()
+    if vocabulary:
+        hits = sum(1 for token in tokens if token.lower() in vocabulary)
+    else:
+        hits = sum(1 for token in tokens if len(token) >= 2 and VOWELS.intersection(token))
+    return hits / len(tokens)
+
+
+class EngineResult:
+    """Text from one engine with its score"""
+
+    def __init__(self, engine, text, score, latency, accepted=False, lines=None):
+        self.engine = engine
+        self.text = text
+        self.score = score
+        self.latency = latency
+        self.accepted = accepted
+        self.lines = lines if lines is not None else []
+
+    def __repr__(self):
+        return f'<EngineResult {self.engine} score={self.score:.2f} {len(self.text)} chars>'
+
+
+class TesseractEngine:
+    """Tesseract on one preprocessing variant, scored by mean word confidence"""
+
+    heavy = False
+
+    def __init__(self, is_handwritten, threshold=None):
+        self.is_handwritten = is_handwritten
+        self.name = "tesseract-handwritten" if is_handwritten else "tesseract-printed"
+        self.threshold = threshold
+
+    def available(self):
+        return True
+
+    def recognize(self, page):
+        if OCR_LAYOUT:
+            if page.layout.blank:
+                # Nothing on the page - accept the empty result instead of escalating
+                return "", 1.0, []
+            results = ocr_lines(page.variant(self.is_handwritten), page.layout)
+            text = join_lines(results)
+            return text, 0.6 * mean_confidence(results) + 0.4 * dictionary_hit_rate(text), results
+
+        data = pytesseract.image_to_data(
+            page.variant(self.is_handwritten),
+            config=TESSERACT_CONFIG,
+            lang='eng',
+            timeout=TESSERACT_TIMEOUT,
+            output_type=pytesseract.Output.DICT
+        )
+        lines = {}
+        confidences = []
+        for i, word in enumerate(data['text']):
+            conf = float(data['conf'][i])
+            if conf < 0 or not word.strip():
+                continue
+            key = (data['block_num'][i], data['par_num'][i], data['line_num'][i])
+            box = (data['left'][i], data['top'][i],
+                   data['left'][i] + data['width'][i], data['top'][i] + data['height'][i])
+            lines.setdefault(key, []).append((word, conf, box))
+            confidences.append(conf)
+
+        results = []
+        for region, key in enumerate(sorted(lines)):
+            words = lines[key]
+            left = min(box[0] for _, _, box in words)
+            top = min(box[1] for _, _, box in words)
+            right = max(box[2] for _, _, box in words)
+            bottom = max(box[3] for _, _, box in words)
+            results.append(LineResult(
+                LineBox(left, top, right - left, bottom - top, region=key[0]),
+                " ".join(word for word, _, _ in words),
+                sum(conf for _, conf, _ in words) / len(words) / 100.0
+            ))
+
+        text = "\n".join(result.text for result in results)
+        if not confidences:
+            return text, 0.0, results
+        mean_conf = sum(confidences) / len(confidences) / 100.0
+        return text, 0.6 * mean_conf + 0.4 * dictionary_hit_rate(text), results
+
+
+class TrOCREngine:
+    """Microsoft TrOCR handwriting model, scored by its sequence probability"""
+
+    name = "trocr"
+    heavy = True
+
+    def __init__(self, threshold=None):
+        self.threshold = threshold
+
+    def available(self):
+        from utils.trocr_service import trocr_available
+        return trocr_available()
+
+    def recognize(self, page):
+        # Shared, warm model; lines (and concurrent pages) are micro-batched by the service
+        from utils.trocr_service import get_trocr_service
+        service = get_trocr_service()
+
+        if not OCR_LAYOUT:
+            text, sequence_prob = service.recognize(Image.fromarray(page.gray))
+            return text, 0.7 * sequence_prob + 0.3 * dictionary_hit_rate(text), None
+
+        if page.layout.blank:
+            return "", 1.0, []
+        # TrOCR is a line-level model: submit every line crop at once so they share batches
+        crops = [Image.fromarray(line.crop(page.gray)) for line in page.layout.lines]
+        results = [LineResult(line, text, prob)
+                   for line, (text, prob) in zip(page.layout.lines, service.recognize_many(crops))]
+        text = join_lines(results)
+        return text, 0.7 * mean_confidence(results) + 0.3 * dictionary_hit_rate(text), results
+
+
+class GeminiEngine:
+    """Gemini vision extraction; no native confidence, so scored by word plausibility"""
+
+    name = "gemini"
+    heavy = True
+
+    def __init__(self, threshold=None):
+        self.threshold = threshold
+        self._extractor = None
+
+    def available(self):
+        if not os.environ.get("GEMINI_API_KEY"):
+            return False
+        try:
+            from utils.gemini_processor import GeminiTextExtractor  # noqa: F401
+            return True
+        except ImportError:
+            return False
+
+    def recognize(self, page):
+        if self._extractor is None:
+            from utils.gemini_processor import GeminiTextExtractor
+            self._extractor = GeminiTextExtractor()
+
+        if page.source_path:
+            text = self._extractor.extract_text_from_image(page.source_path) or ""
+        else:
+            fd, path = tempfile.mkstemp(suffix='.png')
+            os.close(fd)
+            try:
+                Image.fromarray(page.gray).save(path)
+                text = self._extractor.extract_text_from_image(path) or ""
+            finally:
+                os.remove(path)
+        return text, dictionary_hit_rate(text), None
+
+
+class OCRRouter:
+    """Runs engines cheapest first and stops at the first confident result"""
+
+    def __init__(self, engines, threshold=None):
+        self.engines = [engine for engine in engines if engine.available()]
+        self.threshold = OCR_ACCEPT_THRESHOLD if threshold is None else threshold
+        self._stats = {engine.name: {"calls": 0, "accepted": 0, "errors": 0, "total_latency": 0.0}
+                       for engine in self.engines}
+        self._stats_lock = threading.Lock()
+
+    @property
+    def engine_names(self):
+        return [engine.name for engine in self.engines]
+
+    def _record(self, name, latency=0.0, accepted=False, error=False):
+        with self._stats_lock:
+            stats = self._stats[name]
+            stats["calls"] += 1
+            stats["total_latency"] += latency
+            stats["accepted"] += int(accepted)
+            stats["errors"] += int(error)
+
+    def _ordered(self, is_handwritten):
+        """Cheap engines, with the Tesseract pass matching the hint tried first"""
+        engines = [engine for engine in self.engines if not engine.heavy]
+        slots = [i for i, engine in enumerate(engines) if isinstance(engine, TesseractEngine)]
+        preferred = sorted((engines[i] for i in slots), key=lambda e: e.is_handwritten != is_handwritten)
+        for i, engine in zip(slots, preferred):
+            engines[i] = engine
+        return engines
+
+    @property
+    def has_heavy_engines(self):
+        return any(engine.heavy for engine in self.engines)
+
+    def _run(self, engines, page, best=None):
+        """Try engines in order; return the first accepted result, else the best seen"""
+        for engine in engines:
+            threshold = self.threshold if engine.threshold is None else engine.threshold
+            started = time.perf_counter()
+            try:
+                text, score, lines = engine.recognize(page)
+            except Exception as e:
+                logger.warning(f"OCR engine {engine.name} failed: {e}")
+                self._record(engine.name, time.perf_counter() - started, error=True)
+                continue
+
+            if lines is None:
+                # Engines without line output: the whole page is one line of provenance
+                height, width = page.shape[:2]
+                lines = [LineResult(LineBox(0, 0, width, height), text, score)] if text.strip() else []
+
+            accepted = score >= threshold
+            result = EngineResult(engine.name, text, score, time.perf_counter() - started, accepted, lines)
+            self._record(engine.name, result.latency, accepted=accepted)
+            logger.debug(f"{result} ({'accepted' if accepted else 'below'} threshold {threshold})")
+            if accepted:
+                return result
+            if best is None or result.score > best.score:
+                best = result
+        return best
+
+    def recognize(self, page, is_handwritten=True, escalate=True):
+        """
+        OCR a page through the cascade
+
+        Args:
+            page: PagePreprocessor for the page
+            is_handwritten: Which Tesseract preprocessing mode to try first
+            escalate: Whether to go on to the heavy engines (TrOCR, Gemini) when
+                      the cheap ones are not confident. Worker processes pass
+                      False and leave escalation to the parent, which holds
+                      the shared TrOCR model.
+
+        Returns:
+            The accepted EngineResult, or the best one if none was confident
+        """
+        best = self._run(self._ordered(is_handwritten), page)
+        if (best is None or not best.accepted) and escalate:
+            best = self.escalate(page, best)
+        if best is None:
+            raise RuntimeError("No OCR engine produced a result")
+        if not best.accepted:
+            logger.info(f"No OCR engine cleared the threshold; using {best.engine} (score {best.score:.2f})")
+        return best
+
+    def escalate(self, page, best=None):
+        """Run only the heavy engines, keeping best if none of them does better"""
+        return self._run([engine for engine in self.engines if engine.heavy], page, best)
+
+    def stats(self):
+        """Per-engine calls, accept rate, error count and mean latency"""
+        with self._stats_lock:
+            return {
+                name: {
+                    "calls": stats["calls"],
+                    "accept_rate": stats["accepted"] / stats["calls"] if stats["calls"] else 0.0,
+                    "errors": stats["errors"],
+                    "mean_latency": stats["total_latency"] / stats["calls"] if stats["calls"] else 0.0,
+                }
+                for name, stats in self._stats.items()
+            }
+
+
+def default_engines():
+    """The standard cascade, cheapest first"""
+    engines = [TesseractEngine(is_handwritten=True), TesseractEngine(is_handwritten=False)]
+    if OCR_ENABLE_TROCR:
+        engines.append(TrOCREngine())
+    if OCR_ENABLE_GEMINI:
+        engines.append(GeminiEngine())
+    return engines
+
+
+_router = None
+_router_lock = threading.Lock()
+
+
+def get_router():
+    """Return the process-wide OCR router"""
+    global _router
+    with _router_lock:
+        if _router is None:
+            _router = OCRRouter(default_engines())
+            logger.info(f"OCR cascade: {' -> '.join(_router.engine_names)}")
+        return _router
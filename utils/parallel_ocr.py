@@ -0,0 +1,320 @@
+"""
+Page-parallel OCR engine for multi-page PDFs
+
+The PDF is parsed once with PyMuPDF to find the pages that have a usable
+text layer; only the others are OCR'd. Those pages are fanned out to a
+bounded pool of worker processes, each rendering its page straight to a
+grayscale buffer (utils.pdf_backend) and running the cheap engines of the OCR cascade (utils.ocr_router) on one page. Pages that stay
+below the confidence threshold are escalated to TrOCR / Gemini from this
+process, where the TrOCR model is loaded once and batches across pages.
+Results are reassembled in page order. Pages of any size and count are
+processed; oversized pages are OCR'd in strips (utils.tiled_ocr).
+
+Settings (environment variables):
+    OCR_MAX_WORKERS       - upper bound on worker processes (default: CPU count)
+    OCR_MEMORY_BUDGET_MB  - RSS the OCR pool may use in total, measured while
+                            pages are handed out (default: 1024)
+    OCR_PDF_DPI           - rasterization DPI (default: 150)
+    OCR_MAX_PAGES         - optional page limit, 0 means no limit (default: 0)
+    OCR_ESCALATION_THREADS - pages sent to the heavy engines at once (default: 8)
+"""
+import os
+import atexit
+import logging
+import threading
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, wait, FIRST_COMPLETED
+from concurrent.futures.process import BrokenProcessPool
+
+from utils.memory_budget import (PAGE_BUFFER_COPIES, MemoryBudget, MemoryBudgetExceeded, rss_mb, set_baseline,
+                                 tree_rss_mb)
+from utils.pdf_backend import classify_pages, render_pdf_page
+from utils.ocr_document import page_record, text_record, pages_to_text
+from utils.tiled_ocr import recognize_image
+from utils.ocr_router import get_router, EngineResult, TESSERACT_CONFIG, TESSERACT_TIMEOUT  # noqa: F401
+
+logger = logging.getLogger(__name__)
+
+OCR_MAX_WORKERS = int(os.environ.get("OCR_MAX_WORKERS", "0")) or os.cpu_count() or 1
+OCR_MEMORY_BUDGET_MB = int(os.environ.get("OCR_MEMORY_BUDGET_MB", "1024"))
+OCR_PDF_DPI = int(os.environ.get("OCR_PDF_DPI", "150"))
+OCR_MAX_PAGES = int(os.environ.get("OCR_MAX_PAGES", "0"))
+OCR_ESCALATION_THREADS = int(os.environ.get("OCR_ESCALATION_THREADS", "8"))
+
+# Rough resident cost of one worker: the Python process itself, the Tesseract
+# subprocess and a handful of page-sized buffers during preprocessing
+WORKER_BASE_MB = 120
+
+
+def estimate_page_mb(dpi, width_in=8.27, height_in=11.69):
+    """Estimate the working memory (MB) for one grayscale page at the given DPI (A4 by default)"""
+    pixels = int(width_in * dpi) * int(height_in * dpi)
+    return pixels * PAGE_BUFFER_COPIES / (1024 * 1024)
+
+
+def workers_for_budget(num_pages, dpi, max_workers=None, memory_budget_mb=None):
+    """
+    Work out how many worker processes fit in the memory budget
+
+    Args:
+        num_pages: Number of pages that need OCR
+        dpi: Rasterization DPI
+        max_workers: Upper bound on workers (defaults to OCR_MAX_WORKERS)
+        memory_budget_mb: Total memory budget in MB (defaults to OCR_MEMORY_BUDGET_MB)
+
+    Returns:
+        Number of workers to use, at least 1
+    """
+    max_workers = max_workers or OCR_MAX_WORKERS
+    memory_budget_mb = memory_budget_mb or OCR_MEMORY_BUDGET_MB
+    per_worker_mb = WORKER_BASE_MB + estimate_page_mb(dpi)
+    by_memory = int(memory_budget_mb // per_worker_mb)
+    return max(1, min(max_workers, by_memory, num_pages))
+
+
+def _init_worker():
+    """Pages are already spread over processes, so each worker recognizes its lines serially"""
+    from utils import layout
+    layout.OCR_LINE_THREADS = 1
+    # A spawned worker's imports are not page memory
+    set_baseline()
+
+
+def ocr_pdf_page(page_num, pdf_path, dpi, is_handwritten=True):
+    """
+    Render and OCR one PDF page with the cheap engines. Runs inside a worker process.
+
+    Heavy engines are left to the parent process (see escalate_pages), so
+    workers never load the TrOCR model.
+
+    Args:
+        page_num: 1-based page number (returned unchanged so callers can reorder)
+        pdf_path: Path to the PDF; each worker keeps it open between pages
+        dpi: Rasterization DPI
+        is_handwritten: Whether to try the handwritten preprocessing mode first
+
+    Returns:
+        Tuple of (page_num, page record or None, error message or None, score, accepted)
+    """
+    try:
+        router = get_router()
+        raster = render_pdf_page(pdf_path, page_num, dpi)
+        result = recognize_image(raster.gray, lambda page: router.recognize(page, is_handwritten, escalate=False))
+        raster.release()
+        return page_num, page_record(page_num, result, dpi), None, result.score, result.accepted
+    except Exception as e:
+        return page_num, None, str(e), 0.0, False
+
+
+def escalate_pages(pdf_path, dpi, results):
+    """
+    Re-run pages the cheap engines were unsure about through the heavy engines
+
+    Pages are escalated from a thread pool in this process, so their TrOCR
+    requests share one warm model and are micro-batched together.
+
+    Args:
+        pdf_path: Path to the PDF
+        dpi: Rasterization DPI
+        results: Tuples from ocr_pdf_page
+
+    Returns:
+        Results with the escalated pages replaced
+    """
+    router = get_router()
+    pending = [result for result in results if not result[2] and not result[4]]
+    if not pending or not router.has_heavy_engines:
+        return results
+
+    # Load the TrOCR model before measuring, so the budget only covers what the pages add
+    if "trocr" in router.engine_names:
+        try:
+            from utils.trocr_service import get_trocr_service
+            get_trocr_service().warm()
+        except Exception as e:
+            logger.warning(f"Could not load the TrOCR model before escalation: {e}")
+    budget = MemoryBudget(baseline_mb=rss_mb())
+
+    def escalate(result):
+        page_num, _, _, score, _ = result
+        raster = render_pdf_page(pdf_path, page_num, dpi)
+        try:
+            best = recognize_image(
+                raster.gray,
+                lambda page: router.escalate(page) or EngineResult("none", "", 0.0, 0.0),
+                budget=budget
+            )
+        finally:
+            raster.release()
+        if best.score <= score:
+            return result
+        return page_num, page_record(page_num, best, dpi), None, best.score, best.accepted
+
+    def try_escalate(result):
+        try:
+            return escalate(result)
+        except MemoryBudgetExceeded:
+            # Pages escalated concurrently share the budget; retried alone below
+            return None
+        except Exception as e:
+            logger.warning(f"Escalation of page {result[0]} failed, keeping the Tesseract text: {e}")
+            return result
+
+    logger.info(f"Escalating {len(pending)} low-confidence page(s) to {', '.join(router.engine_names)}")
+    with ThreadPoolExecutor(max_workers=min(len(pending), OCR_ESCALATION_THREADS)) as pool:
+        outcomes = list(pool.map(try_escalate, pending))
+
+    escalated = {}
+    for result, outcome in zip(pending, outcomes):
+        if outcome is None:
+            logger.info(f"Escalating page {result[0]} on its own, it did not fit the memory budget alongside others")
+            try:
+                outcome = escalate(result)
+            except Exception as e:
+                logger.error(f"Escalation of page {result[0]} failed, keeping the Tesseract text: {e}")
+                outcome = result
+        escalated[result[0]] = outcome
+    return [escalated.get(result[0], result) for result in results]
+
+
+class ParallelOCREngine:
+    """Bounded process pool that OCRs the pages of a PDF in parallel"""
+
+    def __init__(self, max_workers=None, memory_budget_mb=None, dpi=None, max_pages=None):
+        self.max_workers = max_workers or OCR_MAX_WORKERS
+        self.memory_budget_mb = memory_budget_mb or OCR_MEMORY_BUDGET_MB
+        self.dpi = dpi or OCR_PDF_DPI
+        self.max_pages = OCR_MAX_PAGES if max_pages is None else max_pages
+        self._pool = None
+        self._pool_size = 0
+        self._lock = threading.Lock()
+
+    def _get_pool(self, workers):
+        """Return the shared pool, (re)creating it when it is missing, broken or too small"""
+        with self._lock:
+            if self._pool is None or self._pool_size < workers:
+                if self._pool is not None:
+                    self._pool.shutdown(wait=False)
+                self._pool = ProcessPoolExecutor(max_workers=workers, initializer=_init_worker)
+                self._pool_size = workers
+            return self._pool
+
+    def _reset_pool(self):
+        with self._lock:
+            if self._pool is not None:
+                self._pool.shutdown(wait=False)
+            self._pool = None
+            self._pool_size = 0
+
+    def shutdown(self):
+        """Stop the worker processes"""
+        self._reset_pool()
+
+    def extract_pages(self, pdf_path, is_handwritten=True, page_numbers=None):
+        """
+        Extract every page of a PDF as a structured page record
+
+        Pages with a usable text layer are read directly; the rest are
+        rasterized and OCR'd in parallel.
+
+        Args:
+            pdf_path: Path to the PDF
+            is_handwritten: Whether to use the handwritten preprocessing mode
+            page_numbers: Optional 1-based page numbers to extract (e.g. to
+                          re-OCR single pages); all pages by default
+
+        Returns:
+            List of page records (see utils.ocr_document), in page order
+        """
+        pages = classify_pages(pdf_path, self.max_pages)
+        if page_numbers:
+            wanted = set(page_numbers)
+            pages = [page for page in pages if page.number in wanted]
+        if not pages:
+            logger.warning(f"No pages found in {pdf_path}")
+            return []
+
+        ocr_pages = [page.number for page in pages if page.needs_ocr]
+        results = {}
+        if ocr_pages:
+            workers = workers_for_budget(len(ocr_pages), self.dpi, self.max_workers, self.memory_budget_mb)
+            logger.info(f"OCR of {len(ocr_pages)}/{len(pages)} pages using {workers} worker(s) at {self.dpi} DPI")
+
+            if workers == 1:
+                page_results = [ocr_pdf_page(num, pdf_path, self.dpi, is_handwritten) for num in ocr_pages]
+            else:
+                page_results = self._run_pool(pdf_path, ocr_pages, workers, is_handwritten)
+            results = {result[0]: result for result in escalate_pages(pdf_path, self.dpi, page_results)}
+        else:
+            logger.info(f"All {len(pages)} pages have a text layer, skipping OCR")
+
+        records = []
+        for page in pages:
+            if not page.needs_ocr:
+                records.append(page.record())
+                continue
+            _, record, error, _, _ = results[page.number]
+            if error:
+                logger.error(f"OCR error on page {page.number}: {error}")
+                records.append(text_record(page.number, "[OCR processing error]", "error"))
+            else:
+                records.append(record)
+        return records
+
+    def extract_text(self, pdf_path, is_handwritten=True):
+        """
+        Extract the text of every page of a PDF
+
+        Returns:
+            Extracted text with "--- Page N ---" markers, in page order
+        """
+        return pages_to_text(self.extract_pages(pdf_path, is_handwritten))[0]
+
+    def _within_budget(self, pool):
+        """Measured RSS of this process and the pool workers against the memory budget"""
+        # ProcessPoolExecutor keeps its worker processes in a private pid -> Process dict
+        pids = list(getattr(pool, '_processes', None) or {})
+        return tree_rss_mb(pids) < self.memory_budget_mb
+
+    def _run_pool(self, pdf_path, page_numbers, workers, is_handwritten):
+        """
+        Fan the pages out to the pool, retrying once on a fresh pool if it broke
+
+        Pages are submitted as workers free up, and only while the measured
+        RSS of the pool is inside OCR_MEMORY_BUDGET_MB; when it is over, new
+        pages wait for running ones to finish (at least one page always runs).
+        """
+        for attempt in range(2):
+            pool = self._get_pool(workers)
+            pending = deque(page_numbers)
+            in_flight = set()
+            results = []
+            try:
+                while pending or in_flight:
+                    while pending and len(in_flight) < workers and (not in_flight or self._within_budget(pool)):
+                        num = pending.popleft()
+                        in_flight.add(pool.submit(ocr_pdf_page, num, pdf_path, self.dpi, is_handwritten))
+                    done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                    results.extend(future.result() for future in done)
+                return results
+            except BrokenProcessPool as e:
+                logger.error(f"OCR worker pool broke (attempt {attempt + 1}): {e}")
+                self._reset_pool()
+
+        # Pool keeps dying (usually the OOM killer) - finish in-process, one page at a time
+        logger.warning("Falling back to sequential OCR")
+        return [ocr_pdf_page(num, pdf_path, self.dpi, is_handwritten) for num in page_numbers]
+
+
+_engine = None
+_engine_lock = threading.Lock()
+
+
+def get_engine():
+    """Return the process-wide OCR engine so the worker pool is shared between requests"""
+    global _engine
+    with _engine_lock:
+        if _engine is None:
+            _engine = ParallelOCREngine()
+            atexit.register(_engine.shutdown)
+        return _engine
@@ -0,0 +1,160 @@
+"""
+PDF access through PyMuPDF
+
+One parse per document: each page is checked for a usable text layer
+(typed answers, digitally generated sheets) and its text taken directly;
+only the pages without one are rasterized for OCR. Rasterization renders
+straight to an 8-bit grayscale Pixmap and exposes its sample buffer as a
+NumPy array without copying it.
+
+Settings (environment variables):
+    PDF_TEXT_LAYER_MIN_CHARS - characters a page's text layer needs to be used instead of OCR (default: 50)
+"""
+import os
+import logging
+import threading
+
+import fitz  # PyMuPDF
+import numpy as np
+
+from utils.memory_budget import MemoryBudget
+
+logger = logging.getLogger(__name__)
+
+PDF_TEXT_LAYER_MIN_CHARS = int(os.environ.get("PDF_TEXT_LAYER_MIN_CHARS", "50"))
+
+# Lowest DPI a page is rendered at when the memory budget forces a smaller raster
+MIN_RENDER_DPI = 72
+
+
+class PageRaster:
+    """Grayscale render of one page; gray is a view into the Pixmap's own buffer"""
+
+    def __init__(self, pixmap):
+        self.pixmap = pixmap
+        # Rows may be padded to the stride; slice the padding off without copying
+        samples = np.frombuffer(pixmap.samples_mv, dtype=np.uint8)
+        self.gray = samples.reshape(pixmap.height, pixmap.stride)[:, :pixmap.width]
+
+    def release(self):
+        self.gray = None
+        self.pixmap = None
+
+
+class PageInfo:
+    """A page's number (1-based) and its text-layer lines, or None when it needs OCR"""
+
+    def __init__(self, number, lines=None):
+        self.number = number
+        self.lines = lines
+
+    @property
+    def needs_ocr(self):
+        return self.lines is None
+
+    def record(self):
+        """Page record (see utils.ocr_document) for a page read from its text layer"""
+        return {"page": self.number, "source": "text_layer", "engine": "pymupdf",
+                "score": 1.0, "dpi": 72, "lines": self.lines}
+
+
+def text_layer(page, min_chars=None):
+    """
+    The page's embedded text lines if there is enough text to trust, else None
+
+    Lines use the compact utils.ocr_document form, with boxes in PDF points
+    and the text block as the region.
+    """
+    min_chars = PDF_TEXT_LAYER_MIN_CHARS if min_chars is None else min_chars
+    lines = []
+    chars = 0
+    for block_index, block in enumerate(page.get_text("dict", sort=True)["blocks"]):
+        # Image blocks have no "lines"
+        for line in block.get("lines", ()):
+            text = "".join(span["text"] for span in line["spans"])
+            if not text.strip():
+                continue
+            x0, y0, x1, y1 = line["bbox"]
+            lines.append([int(x0), int(y0), int(x1 - x0), int(y1 - y0), text, 1.0, block_index])
+            chars += len(text.strip())
+    return lines if chars >= min_chars else None
+
+
+def classify_pages(pdf_path, max_pages=0):
+    """
+    Read every page's text layer in a single pass over the document
+
+    Args:
+        pdf_path: Path to the PDF
+        max_pages: Optional page limit, 0 means no limit
+
+    Returns:
+        List of PageInfo in page order
+    """
+    with fitz.open(pdf_path) as document:
+        count = document.page_count
+        if max_pages and count > max_pages:
+            logger.warning(f"PDF has {count} pages, limiting processing to first {max_pages} pages")
+            count = max_pages
+        return [PageInfo(number + 1, text_layer(document[number])) for number in range(count)]
+
+
+def render_page(document, page_number, dpi, budget=None):
+    """
+    Rasterize one page to grayscale
+
+    The DPI is lowered (down to MIN_RENDER_DPI) if the raster would not fit
+    in the process memory budget.
+
+    Args:
+        document: Open fitz.Document
+        page_number: 1-based page number
+        dpi: Requested resolution
+
+    Returns:
+        PageRaster
+    """
+    budget = budget or MemoryBudget()
+    page = document[page_number - 1]
+    rect = page.rect
+    needed_mb = (rect.width * dpi / 72) * (rect.height * dpi / 72) / (1024 * 1024)
+    if not budget.fits(needed_mb):
+        scale = (budget.available_mb() / needed_mb) ** 0.5 if needed_mb else 1.0
+        reduced = max(MIN_RENDER_DPI, int(dpi * scale))
+        logger.warning(f"Rendering page {page_number} at {reduced} DPI instead of {dpi} to stay in the memory budget")
+        dpi = reduced
+    return PageRaster(page.get_pixmap(dpi=dpi, colorspace=fitz.csGRAY, alpha=False))
+
+
+class DocumentCache:
+    """Keeps the most recently used document open in this process, so pages of one PDF share a parse"""
+
+    def __init__(self):
+        self._identity = None
+        self._document = None
+        self._lock = threading.Lock()
+
+    def render(self, pdf_path, page_number, dpi):
+        # Spooled uploads reuse temp paths, so the file's identity includes size and mtime
+        stat = os.stat(pdf_path)
+        identity = (pdf_path, stat.st_size, stat.st_mtime_ns)
+        with self._lock:
+            if self._identity != identity:
+                self.close()
+                self._document = fitz.open(pdf_path)
+                self._identity = identity
+            return render_page(self._document, page_number, dpi)
+
+    def close(self):
+        if self._document is not None:
+            self._document.close()
+        self._document = None
+        self._identity = None
+
+
+_documents = DocumentCache()
+
+
+def render_pdf_page(pdf_path, page_number, dpi):
+    """Rasterize a page, reusing this process's open copy of the document"""
+    return _documents.render(pdf_path, page_number, dpi)
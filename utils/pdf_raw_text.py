@@ -0,0 +1,203 @@
+"""
+Last-resort text recovery from a PDF's content streams
+
+Used when PyMuPDF and OCR both come back empty (damaged files, unusual
+producers). Instead of decoding the whole file as UTF-8, the file is read
+in fixed-size chunks and scanned for `stream ... endstream` blocks. Image,
+font and object streams are skipped from their dictionary alone; the rest
+are inflated incrementally with zlib and only the strings shown by the text
+operators (Tj, TJ, ' and ") are kept. Byte-level clean-up uses
+bytes.translate and memoryview slices, never per-byte Python loops.
+"""
+import re
+import zlib
+import logging
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 1024 * 1024
+# Bytes kept before a `stream` keyword to read its dictionary from
+HEADER_BYTES = 1024
+# Decompressed size read from one content stream at most
+MAX_STREAM_BYTES = 16 * 1024 * 1024
+
+STREAM_START = re.compile(rb"(?<!end)stream(\r\n|\n|\r)")
+STREAM_END = b"endstream"
+
+# Streams that never carry page text
+SKIP_MARKERS = (b"/Image", b"/FontFile", b"/Length1", b"/ObjStm", b"/XRef", b"/Metadata",
+                b"/DCTDecode", b"/JPXDecode", b"/CCITTFaxDecode", b"/JBIG2Decode", b"/ICCBased")
+UNSUPPORTED_FILTERS = (b"/LZWDecode", b"/RunLengthDecode", b"/ASCII85Decode", b"/ASCIIHexDecode")
+
+# Text-showing operators and the text-positioning operators that start a new line
+TEXT_OPERATORS = re.compile(
+    rb"\((?P<literal>(?:\\.|[^\\)])*)\)\s*(?:Tj|'|\")"
+    rb"|<(?P<hex>[0-9A-Fa-f\s]*)>\s*(?:Tj|'|\")"
+    rb"|\[(?P<array>(?:\\.|[^\]\\])*)\]\s*TJ"
+    rb"|(?P<newline>\bT\*|\bTD\b|\bTd\b|\bET\b)",
+    re.S
+)
+ARRAY_ITEMS = re.compile(rb"\((?P<literal>(?:\\.|[^\\)])*)\)|<(?P<hex>[0-9A-Fa-f\s]*)>|(?P<kern>-?\d+(?:\.\d+)?)")
+ESCAPES = re.compile(rb"\\([0-7]{1,3}|.)", re.S)
+ESCAPE_MAP = {b"n": b"\n", b"r": b"\r", b"t": b"\t", b"b": b"", b"f": b"", b"\n": b"", b"\r": b""}
+
+# Control bytes other than tab and newline, deleted in one translate() call
+CONTROL_BYTES = bytes(range(0, 9)) + bytes(range(11, 32)) + b"\x7f"
+# Kerning this far left (thousandths of an em) separates words in a TJ array
+WORD_GAP = -200
+
+
+def _unescape(literal):
+    def replace(match):
+        escape = match.group(1)
+        if escape[:1].isdigit():
+            return bytes([int(escape, 8) & 0xFF])
+        return ESCAPE_MAP.get(escape, escape)
+    return ESCAPES.sub(replace, literal)
+
+
+def _decode(raw):
+    """Decode a shown string: UTF-16BE when it looks like two-byte codes, else Latin-1"""
+    if len(raw) >= 2 and len(raw) % 2 == 0 and not raw[0::2].strip(b"\x00"):
+        return raw[1::2].translate(None, CONTROL_BYTES).decode("latin-1")
+    return raw.translate(None, CONTROL_BYTES).decode("latin-1")
+
+
+def _string(match):
+    if match.group("literal") is not None:
+        return _decode(_unescape(match.group("literal")))
+    hex_digits = re.sub(rb"\s", b"", match.group("hex"))
+    if len(hex_digits) % 2:
+        hex_digits += b"0"
+    return _decode(bytes.fromhex(hex_digits.decode("ascii")))
+
+
+def text_from_content(content):
+    """
+    Text shown by the operators of one decompressed content stream
+
+    Args:
+        content: Content stream bytes
+
+    Returns:
+        Text with one line per text-positioning step
+    """
+    parts = []
+    for match in TEXT_OPERATORS.finditer(content):
+        if match.group("newline"):
+            if parts and parts[-1] != "\n":
+                parts.append("\n")
+        elif match.group("array") is not None:
+            for item in ARRAY_ITEMS.finditer(match.group("array")):
+                if item.group("kern") is not None:
+                    if float(item.group("kern")) <= WORD_GAP:
+                        parts.append(" ")
+                else:
+                    parts.append(_string(item))
+        else:
+            parts.append(_string(match))
+    return "".join(parts)
+
+
+def _stream_kind(header):
+    """'flate', 'raw' or None (skip) for the stream whose dictionary ends the header bytes"""
+    dictionary = header[header.rfind(b"obj") + 3:] if b"obj" in header else header
+    if any(marker in dictionary for marker in SKIP_MARKERS):
+        return None
+    if any(name in dictionary for name in UNSUPPORTED_FILTERS):
+        return None
+    if b"/FlateDecode" in dictionary or b"/Fl " in dictionary or b"/Fl]" in dictionary:
+        return "flate"
+    if b"/Filter" in dictionary:
+        return None
+    return "raw"
+
+
+def iter_content_streams(fileobj, chunk_size=CHUNK_SIZE):
+    """
+    Yield the decoded bytes of every content stream that may carry text
+
+    Reads the file chunk by chunk; a stream's data is inflated as it arrives,
+    so memory stays bounded by the chunk size plus one decompressed stream.
+    """
+    buffer = bytearray()
+    kind = None
+    inflater = None
+    content = None
+    in_stream = False
+    pos = 0
+
+    while True:
+        chunk = fileobj.read(chunk_size)
+        buffer += chunk
+        view = memoryview(buffer)
+
+        while True:
+            if not in_stream:
+                match = STREAM_START.search(buffer, pos)
+                # A match at the very end may have a \r whose \n is in the next chunk
+                if match is None or (chunk and match.end() == len(buffer)):
+                    break
+                kind = _stream_kind(bytes(view[max(0, match.start() - HEADER_BYTES):match.start()]))
+                inflater = zlib.decompressobj() if kind == "flate" else None
+                content = bytearray()
+                in_stream = True
+                pos = match.end()
+                continue
+
+            end = buffer.find(STREAM_END, pos)
+            # Without the end marker, consume all but a possible partial marker
+            stop = end if end != -1 else max(pos, len(buffer) - len(STREAM_END))
+            if kind is not None and len(content) < MAX_STREAM_BYTES:
+                with view[pos:stop] as data:
+                    try:
+                        if inflater is not None:
+                            content += inflater.decompress(data, MAX_STREAM_BYTES - len(content))
+                        else:
+                            content += data[:MAX_STREAM_BYTES - len(content)]
+                    except zlib.error:
+                        # Corrupt stream: keep what was inflated so far and skip the rest
+                        kind = None
+            pos = stop
+            if end == -1:
+                break
+
+            if kind is not None and content:
+                yield bytes(content)
+            in_stream = False
+            content = None
+            inflater = None
+            pos = end + len(STREAM_END)
+
+        # Drop consumed bytes, keeping enough before pos to read the next stream's dictionary
+        keep_from = pos if in_stream else max(0, pos - HEADER_BYTES, len(buffer) - HEADER_BYTES - len(STREAM_END))
+        view.release()
+        del buffer[:keep_from]
+        pos = max(0, pos - keep_from)
+
+        if not chunk:
+            break
+
+
+def extract_raw_text(pdf_path, chunk_size=CHUNK_SIZE):
+    """
+    Recover text from a PDF's content streams without rendering it
+
+    Args:
+        pdf_path: Path to the PDF
+        chunk_size: Bytes read per chunk
+
+    Returns:
+        Extracted text (empty if nothing readable was found)
+    """
+    lines = []
+    streams = 0
+    with open(pdf_path, "rb") as pdf_file:
+        for content in iter_content_streams(pdf_file, chunk_size):
+            streams += 1
+            for line in text_from_content(content).splitlines():
+                line = " ".join(line.split())
+                if line:
+                    lines.append(line)
+    logger.debug(f"Recovered {len(lines)} text lines from {streams} content streams")
+    return "\n".join(lines)
@@ -0,0 +1,83 @@
+"""
+MongoDB query counting via pymongo command monitoring
+
+The listener is passed to connect() in app.py. Counting is per thread and
+only active inside count_queries(), so it costs nothing in normal requests.
+
+    with count_queries() as counter:
+        load_exam_report(exam_id)
+    print(counter.count, counter.commands)
+
+    with assert_max_queries(6):
+        load_exam_report(exam_id)
+"""
+import threading
+from contextlib import contextmanager
+
+from pymongo import monitoring
+
+# Connection housekeeping, plus getMore: cursor batches grow with result size,
+# not with the access pattern we want to keep constant
+IGNORED_COMMANDS = {'hello', 'ismaster', 'isMaster', 'ping', 'buildinfo', 'buildInfo',
+                    'saslStart', 'saslContinue', 'endSessions', 'getMore'}
+
+_state = threading.local()
+
+
+class QueryCounter:
+    """Commands seen on the current thread while counting is active"""
+
+    def __init__(self):
+        self.commands = []
+
+    @property
+    def count(self):
+        return len(self.commands)
+
+    def record(self, event):
+        collection = event.command.get(event.command_name)
+        self.commands.append(f"{event.command_name} {collection}" if isinstance(collection, str) else event.command_name)
+
+
+class QueryCountListener(monitoring.CommandListener):
+    """Forwards started commands to the active counters of the issuing thread"""
+
+    def started(self, event):
+        counters = getattr(_state, 'counters', None)
+        if counters and event.command_name not in IGNORED_COMMANDS:
+            for counter in counters:
+                counter.record(event)
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+
+query_listener = QueryCountListener()
+
+
+@contextmanager
+def count_queries():
+    """Count MongoDB commands issued by this thread inside the block"""
+    counter = QueryCounter()
+    counters = getattr(_state, 'counters', None)
+    if counters is None:
+        counters = _state.counters = []
+    counters.append(counter)
+    try:
+        yield counter
+    finally:
+        counters.remove(counter)
+
+
+@contextmanager
+def assert_max_queries(limit):
+    """Fail with AssertionError if the block issues more than `limit` MongoDB commands"""
+    with count_queries() as counter:
+        yield counter
+    if counter.count > limit:
+        raise AssertionError(
+            f"Expected at most {limit} queries, got {counter.count}: " + ", ".join(counter.commands)
+        )
@@ -0,0 +1,247 @@
+"""
+Single-pass answer segmentation
+
+The OCR text is scanned once with one compiled regex that recognizes every
+kind of question marker ("Q3", "Question 3", "Ans 3", "#3", "3.", "(3)")
+for every question number, plus the "--- Page N ---" markers the OCR step
+inserts. Candidate boundaries are then chosen with a dynamic program that
+keeps question numbers in increasing order along the text and prefers
+strong markers (explicit "Question 3" at the start of a line) over weak
+ones ("3." inside an answer's own numbered list). Cost is one regex pass
+plus O(markers x questions).
+
+When markers are missing the text is split at paragraph breaks, or evenly
+by words, with a correspondingly low confidence. Results are cached by
+(text hash, number of questions).
+"""
+import re
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+TOKEN_PATTERN = re.compile(
+    r"(?P<page>^[ \t]*--- Page (?P<page_num>\d+) ---[ \t]*$)"
+    r"|(?P<word>\b(?:question|ques|qn|q|answer|ans)\.?[ \t]*[#:\-]?[ \t]*(?P<word_num>\d{1,3})\b)"
+    r"|(?P<hash>\#[ \t]*(?P<hash_num>\d{1,3})\b)"
+    r"|(?P<list>^[ \t]*\(?(?P<list_num>\d{1,3})[ \t]*[.):](?!\d))",
+    re.IGNORECASE | re.MULTILINE
+)
+PAGE_MARKER = re.compile(r"^[ \t]*--- Page \d+ ---[ \t]*$\n?", re.MULTILINE)
+PARAGRAPH_BREAK = re.compile(r"\n[ \t]*\n")
+WORD = re.compile(r"\S+")
+
+# Marker strength; a marker that starts its line counts extra
+MARKER_WEIGHTS = {"word": 3.0, "hash": 2.0, "list": 1.5}
+LINE_START_BONUS = 1.0
+MAX_MARKER_SCORE = MARKER_WEIGHTS["word"] + LINE_START_BONUS
+# Cost of a question with no marker between two chosen ones
+SKIP_PENALTY = 1.0
+
+# Confidence reported for the fallbacks
+PARAGRAPH_CONFIDENCE = 0.3
+EQUAL_SPLIT_CONFIDENCE = 0.1
+
+CACHE_SIZE = 256
+
+
+class Segmentation:
+    """Answer segments of a text with the character spans they came from"""
+
+    def __init__(self, segments, spans, confidence, method):
+        self.segments = segments
+        self.spans = spans
+        self.confidence = confidence
+        self.method = method
+
+    def __repr__(self):
+        return f'<Segmentation {len(self.segments)} segments via {self.method} confidence={self.confidence:.2f}>'
+
+
+class Marker:
+    __slots__ = ("position", "number", "score")
+
+    def __init__(self, position, number, score):
+        self.position = position
+        self.number = number
+        self.score = score
+
+
+def scan(text, num_questions):
+    """
+    Tokenize the text once
+
+    Returns:
+        (question markers with numbers 1..num_questions, page marker spans)
+    """
+    markers = []
+    pages = []
+    for match in TOKEN_PATTERN.finditer(text):
+        if match.group("page"):
+            pages.append((match.start(), match.end()))
+            continue
+        kind = "word" if match.group("word") else "hash" if match.group("hash") else "list"
+        number = int(match.group(f"{kind}_num"))
+        if not 1 <= number <= num_questions:
+            continue
+        score = MARKER_WEIGHTS[kind]
+        line_start = text.rfind("\n", 0, match.start()) + 1
+        if kind == "list" or not text[line_start:match.start()].strip():
+            score += LINE_START_BONUS
+        markers.append(Marker(match.start(), number, score))
+    return markers, pages
+
+
+def choose_boundaries(markers, num_questions):
+    """
+    Pick at most one marker per question, in increasing question order along the text
+
+    best[i] is the best total score of a chain ending at marker i:
+    its own score plus the best chain ending at a smaller question number,
+    minus SKIP_PENALTY for every question skipped in between.
+
+    Returns:
+        (chosen markers in text order, total score)
+    """
+    if not markers:
+        return [], 0.0
+
+    # Best chain so far ending with each question number (index 0 is the empty chain)
+    best_by_number = [0.0] + [None] * num_questions
+    end_by_number = [None] * (num_questions + 1)
+    best = []
+    previous = []
+    for i, marker in enumerate(markers):
+        best_score, best_prev = None, None
+        for number in range(marker.number):
+            if best_by_number[number] is None:
+                continue
+            candidate = best_by_number[number] - SKIP_PENALTY * (marker.number - number - 1)
+            if best_score is None or candidate > best_score:
+                best_score, best_prev = candidate, end_by_number[number]
+        best.append(best_score + marker.score)
+        previous.append(best_prev)
+        # Strictly better only, so the earliest of equal chains wins
+        current = best_by_number[marker.number]
+        if current is None or best[i] > current:
+            best_by_number[marker.number] = best[i]
+            end_by_number[marker.number] = i
+
+    final_score, last = None, None
+    for number in range(1, num_questions + 1):
+        if best_by_number[number] is None:
+            continue
+        candidate = best_by_number[number] - SKIP_PENALTY * (num_questions - number)
+        if final_score is None or candidate > final_score:
+            final_score, last = candidate, end_by_number[number]
+
+    chain = []
+    while last is not None:
+        chain.append(markers[last])
+        last = previous[last]
+    chain.reverse()
+    return chain, final_score
+
+
+def _strip_pages(text):
+    return PAGE_MARKER.sub("", text).strip()
+
+
+def _by_markers(text, chain, num_questions):
+    spans = [(0, 0)] * num_questions
+    for marker, following in zip(chain, chain[1:] + [None]):
+        end = following.position if following is not None else len(text)
+        spans[marker.number - 1] = (marker.position, end)
+    return spans
+
+
+def _by_paragraphs(text, num_questions):
+    """Group paragraphs into num_questions contiguous runs of roughly equal length, or None"""
+    starts = [0] + [match.end() for match in PARAGRAPH_BREAK.finditer(text)]
+    paragraphs = [(start, end) for start, end in zip(starts, starts[1:] + [len(text)])
+                  if _strip_pages(text[start:end])]
+    if len(paragraphs) < num_questions:
+        return None
+
+    total = sum(end - start for start, end in paragraphs)
+    spans = []
+    group_start = paragraphs[0][0]
+    consumed = 0
+    for index, (start, end) in enumerate(paragraphs):
+        consumed += end - start
+        remaining_paragraphs = len(paragraphs) - index - 1
+        remaining_groups = num_questions - len(spans) - 1
+        target = total * (len(spans) + 1) / num_questions
+        if remaining_groups and (consumed >= target or remaining_paragraphs == remaining_groups):
+            spans.append((group_start, end))
+            group_start = paragraphs[index + 1][0]
+    spans.append((group_start, len(text)))
+    return spans
+
+
+def _equally(text, num_questions):
+    """Split at word boundaries into num_questions runs with equal word counts"""
+    words = [match.span() for match in WORD.finditer(text)]
+    spans = []
+    for index in range(num_questions):
+        first = index * len(words) // num_questions
+        last = (index + 1) * len(words) // num_questions
+        if first >= last:
+            spans.append((0, 0))
+        else:
+            spans.append((words[first][0], words[last - 1][1]))
+    return spans
+
+
+def _segment(text, num_questions):
+    markers, _ = scan(text, num_questions)
+    chain, score = choose_boundaries(markers, num_questions)
+
+    # Markers for at least half the questions: trust them
+    if len(chain) * 2 >= num_questions:
+        confidence = max(0.0, min(1.0, score / (MAX_MARKER_SCORE * num_questions)))
+        return _by_markers(text, chain, num_questions), confidence, "markers"
+
+    spans = _by_paragraphs(text, num_questions)
+    if spans is not None:
+        return spans, PARAGRAPH_CONFIDENCE, "paragraphs"
+    return _equally(text, num_questions), EQUAL_SPLIT_CONFIDENCE, "equal"
+
+
+_cache = OrderedDict()
+_cache_lock = threading.Lock()
+
+
+def segment_text(text, num_questions):
+    """
+    Split OCR text into one answer per question
+
+    Args:
+        text: OCR text, optionally with "--- Page N ---" markers
+        num_questions: Number of questions in the exam
+
+    Returns:
+        Segmentation whose spans index into text; segments have page markers removed
+    """
+    text = text or ""
+    if num_questions <= 0:
+        return Segmentation([], [], 0.0, "none")
+
+    key = (hashlib.blake2b(text.encode("utf-8", "surrogatepass"), digest_size=16).digest(), num_questions)
+    with _cache_lock:
+        cached = _cache.get(key)
+        if cached is not None:
+            _cache.move_to_end(key)
+            return cached
+
+    spans, confidence, method = _segment(text, num_questions)
+    result = Segmentation([_strip_pages(text[start:end]) for start, end in spans], spans, confidence, method)
+    logger.debug(f"Segmented {len(text)} characters: {result}")
+
+    with _cache_lock:
+        _cache[key] = result
+        while len(_cache) > CACHE_SIZE:
+            _cache.popitem(last=False)
+    return result
@@ -0,0 +1,238 @@
+"""
+Background processing of one submission: extraction, segmentation and grading
+
+Runs inside worker.py, never inside a Flask request.
+
+The OCR output is kept as an OCRDocument (pages -> lines -> box, text,
+confidence) and every SubmissionAnswer records the page / line spans it was
+segmented from. Re-segmenting (e.g. after a question is added) works from
+the stored document without OCR, and a bad page can be queued for re-OCR on
+its own; in both cases only answers whose text changed are graded again.
+"""
+import os
+import logging
+from datetime import datetime
+
+from models import Submission, SubmissionAnswer, Grade, OCRDocument, AnswerSpan, feedback_list, grammar_issue_list
+from utils.ocr_processor import process_file_pages, process_stream_pages, reocr_file_pages
+from utils.ocr_document import pages_to_text, answer_spans
+from utils.segmentation import segment_text
+from utils.gemini_grading import get_grader
+from utils.answer_index import load_exam_index
+from utils.exam_stats import SubmissionResult, record_result
+
+logger = logging.getLogger(__name__)
+
+
+def extract_submission_pages(submission, page_numbers=None, base_pages=None):
+    """
+    Run OCR on a submission's file, streaming it out of GridFS
+
+    Args:
+        submission: Submission to extract
+        page_numbers: Re-OCR only these 1-based pages (uncached); all pages by default
+        base_pages: With page_numbers, the stored page records to merge the new
+                    pages into; the merged records are returned and cached
+
+    Returns:
+        List of page records (see utils.ocr_document)
+    """
+    if submission.original_file:
+        filename = submission.get_file_name() or '.pdf'
+        grid_out = submission.open_file()
+        try:
+            return process_stream_pages(grid_out, filename, page_numbers=page_numbers, base_pages=base_pages)
+        finally:
+            grid_out.close()
+
+    # Legacy submissions only have a path on local disk
+    if submission.file_path and os.path.exists(submission.file_path):
+        if page_numbers:
+            return reocr_file_pages(submission.file_path, page_numbers, base_pages=base_pages)
+        return process_file_pages(submission.file_path)
+
+    raise ValueError(f"Submission {submission.id} has no file to process")
+
+
+def extract_submission_text(submission):
+    """
+    Run OCR on a submission's file
+
+    Returns:
+        Extracted text with "--- Page N ---" markers
+    """
+    return pages_to_text(extract_submission_pages(submission))[0]
+
+
+def process_submission(submission_id, grader=None):
+    """
+    Extract, segment and grade a submission, replacing any previous results
+
+    If pages were queued with request_page_reocr, only those pages are OCR'd
+    again and merged into the stored OCR document.
+
+    Args:
+        submission_id: Id of the Submission to process
+        grader: Callable(question, answer_text, key_index) returning a dict
+                with score, similarity_score and feedback (and optionally the
+                Grade fields); defaults to the GRADING_BACKEND grader
+
+    Returns:
+        The updated Submission
+    """
+    submission = Submission.objects(id=submission_id).first()
+    if submission is None:
+        raise ValueError(f"Submission {submission_id} not found")
+
+    document = OCRDocument.objects(submission=submission).first()
+    if document is not None and document.reocr_pages:
+        logger.info(f"Re-OCR of pages {document.reocr_pages} of submission {submission_id}")
+        pages = extract_submission_pages(submission, sorted(set(document.reocr_pages)), document.pages)
+        reuse_scores = True
+    else:
+        pages = extract_submission_pages(submission)
+        reuse_scores = False
+
+    OCRDocument.objects(submission=submission).update_one(
+        upsert=True,
+        set__pages=pages,
+        set__reocr_pages=[],
+        set__updated_at=datetime.utcnow(),
+        set_on_insert__created_at=datetime.utcnow(),
+    )
+    return _grade_submission(submission, pages, grader or get_grader(), reuse_scores)
+
+
+def resegment_submission(submission_id, grader=None):
+    """
+    Segment and grade a submission again from its stored OCR document, without OCR
+
+    Answers whose text did not change keep their scores; falls back to full
+    processing when no OCR document has been stored yet.
+
+    Returns:
+        The updated Submission
+    """
+    submission = Submission.objects(id=submission_id).first()
+    if submission is None:
+        raise ValueError(f"Submission {submission_id} not found")
+
+    document = OCRDocument.objects(submission=submission).only('pages').first()
+    if document is None or not document.pages:
+        logger.info(f"No OCR document for submission {submission_id}, processing in full")
+        return process_submission(submission_id, grader)
+    return _grade_submission(submission, document.pages, grader or get_grader(), reuse_scores=True)
+
+
+def request_page_reocr(submission, page_numbers):
+    """
+    Mark pages of a submission for re-OCR on its next processing run
+
+    Returns:
+        False if the submission has no stored OCR document (it needs full processing)
+    """
+    updated = OCRDocument.objects(submission=submission).update_one(
+        add_to_set__reocr_pages=[int(number) for number in page_numbers]
+    )
+    return bool(updated)
+
+
+def _build_grade(submission, question, answer_text, result):
+    """Grade document for a grader result that carries the rubric fields"""
+    return Grade(
+        submission=submission,
+        question=question,
+        student_answer=answer_text,
+        relevance_score=result.get("relevance_score", 0.0),
+        accuracy_score=result.get("accuracy_score", 0.0),
+        grammar_score=result.get("grammar_score", 0.0),
+        completeness_score=result.get("completeness_score", 0.0),
+        word_count_score=result.get("word_count_score", 0.0),
+        final_score=result["final_score"],
+        detailed_feedback=result.get("detailed_feedback", ""),
+        strengths=feedback_list(result.get("strengths")),
+        improvements=feedback_list(result.get("improvements")),
+        grammar_issues=grammar_issue_list(result.get("grammar_issues")),
+    )
+
+
+def _grade_submission(submission, pages, grader, reuse_scores=False):
+    """Segment the OCR pages into answers, grade them and replace the stored results"""
+    text, line_index = pages_to_text(pages)
+
+    questions = list(submission.exam.questions)
+    segmentation = segment_text(text, len(questions)) if questions else None
+    if segmentation is not None and segmentation.method != "markers":
+        logger.warning(f"No reliable question markers found; segmented by {segmentation.method}")
+    segments = segmentation.segments if segmentation is not None else []
+    spans = answer_spans(segmentation.spans, line_index) if segmentation is not None else []
+    key_indexes = load_exam_index(submission.exam, questions)
+
+    # Capture the previous result so the exam statistics can be adjusted by the difference
+    previous = {}
+    old_result = None
+    if submission.processed:
+        previous = {
+            str(answer.question.id): answer
+            for answer in SubmissionAnswer.objects(submission=submission).no_dereference().only(
+                'question', 'extracted_text', 'score', 'similarity_score', 'feedback'
+            )
+        }
+        old_scores = {question_id: answer.score for question_id, answer in previous.items()}
+        old_result = SubmissionResult(submission.total_score, submission.max_possible_score, old_scores)
+
+    answers = []
+    grades = []
+    total_score = 0.0
+    max_possible_score = 0.0
+    regraded = 0
+    for question, answer_text, answer_span in zip(questions, segments, spans):
+        old_answer = previous.get(str(question.id))
+        if reuse_scores and old_answer is not None and old_answer.extracted_text == answer_text:
+            result = {
+                "score": old_answer.score,
+                "similarity_score": old_answer.similarity_score,
+                "feedback": old_answer.feedback,
+            }
+        else:
+            result = grader(question, answer_text, key_indexes.get(question.id))
+            regraded += 1
+            if "final_score" in result:
+                grades.append(_build_grade(submission, question, answer_text, result))
+        answers.append(SubmissionAnswer(
+            submission=submission,
+            question=question,
+            extracted_text=answer_text,
+            spans=[AnswerSpan(**span) for span in answer_span],
+            sort_order=question.sort_order,
+            score=result["score"],
+            similarity_score=result["similarity_score"],
+            feedback=result.get("feedback", ""),
+        ))
+        total_score += result["score"]
+        max_possible_score += question.max_score
+
+    # Re-processing replaces the previous answers, and the grades of every re-graded answer
+    SubmissionAnswer.objects(submission=submission).delete()
+    if answers:
+        SubmissionAnswer.objects.insert(answers, load_bulk=False)
+    if grades:
+        Grade.objects(submission=submission, question__in=[grade.question for grade in grades]).delete()
+        Grade.objects.insert(grades, load_bulk=False)
+
+    submission.update(
+        set__total_score=round(total_score, 2),
+        set__max_possible_score=max_possible_score,
+        set__processed=True,
+        set__processed_at=datetime.utcnow(),
+    )
+    new_result = SubmissionResult(
+        round(total_score, 2),
+        max_possible_score,
+        {str(answer.question.id): answer.score for answer in answers}
+    )
+    record_result(submission.exam.id, old_result, new_result)
+    logger.info(f"Processed submission {submission.id}: {total_score:.2f}/{max_possible_score} "
+                f"({regraded}/{len(answers)} answers graded)")
+    submission.reload()
+    return submission
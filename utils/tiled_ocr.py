@@ -0,0 +1,197 @@
+"""
+Memory-budgeted OCR for pages of any size
+
+Small pages go through the engine cascade whole. Pages that are larger than
+OCR_TILE_PIXELS, or that would not fit the process RSS budget whole, are cut
+into full-width horizontal strips. Each seam is placed on the lightest row
+(ideally blank paper) inside an overlap window around the nominal tile
+boundary. If that row still has ink, the next strip starts OCR_TILE_OVERLAP
+rows earlier, so a line cut by the seam is fully contained in one strip; the
+duplicated line is then dropped when the strip texts are joined.
+
+Preprocessing copies scale with the strip, not the page, and the RSS budget
+is checked before every strip.
+
+Settings (environment variables):
+    OCR_TILE_PIXELS   - pages above this many pixels are tiled (default: 16000000)
+    OCR_TILE_OVERLAP  - rows searched for a seam / shared by overlapping strips (default: 96)
+"""
+import os
+import math
+import logging
+from difflib import SequenceMatcher
+
+import numpy as np
+from PIL import Image
+
+from utils.image_pipeline import PagePreprocessor
+from utils.layout import LineBox, LineResult
+from utils.memory_budget import MemoryBudget, MemoryBudgetExceeded, PAGE_BUFFER_COPIES
+
+logger = logging.getLogger(__name__)
+
+OCR_TILE_PIXELS = int(os.environ.get("OCR_TILE_PIXELS", "16000000"))
+OCR_TILE_OVERLAP = int(os.environ.get("OCR_TILE_OVERLAP", "96"))
+
+MIN_TILE_HEIGHT = 256
+# Rows are profiled in blocks so the ink mask never covers the whole page
+PROFILE_BLOCK_ROWS = 1024
+INK_LEVEL = 128
+
+
+def load_gray(image_path, budget=None):
+    """
+    Decode an image straight to grayscale, within the memory budget
+
+    JPEGs that would not fit are decoded at a reduced scale by the decoder
+    itself; other formats that would not fit raise MemoryBudgetExceeded.
+    """
+    budget = budget or MemoryBudget()
+    with Image.open(image_path) as image:
+        width, height = image.size
+        needed_mb = width * height / (1024 * 1024)
+        if not budget.fits(needed_mb):
+            scale = math.ceil(math.sqrt(needed_mb / max(budget.available_mb(), 1.0)))
+            if image.format != 'JPEG':
+                raise MemoryBudgetExceeded(
+                    f"Decoding a {width}x{height} image needs {needed_mb:.0f}MB, "
+                    f"{budget.available_mb():.0f}MB left in the {budget.limit_mb}MB budget"
+                )
+            logger.warning(f"Decoding {width}x{height} JPEG at 1/{scale} scale to stay in the memory budget")
+            image.draft('L', (width // scale, height // scale))
+        return np.asarray(image.convert('L'))
+
+
+def ink_profile(gray):
+    """Dark pixels per row, computed block by block"""
+    profile = np.empty(gray.shape[0], dtype=np.int64)
+    for top in range(0, gray.shape[0], PROFILE_BLOCK_ROWS):
+        block = gray[top:top + PROFILE_BLOCK_ROWS]
+        profile[top:top + block.shape[0]] = (block < INK_LEVEL).sum(axis=1)
+    return profile
+
+
+def tile_height_for_budget(width, budget, height):
+    """Tallest strip whose preprocessing buffers fit in what is left of the budget"""
+    available_bytes = budget.available_mb() * 1024 * 1024
+    by_budget = int(available_bytes // (width * PAGE_BUFFER_COPIES))
+    by_pixels = max(1, OCR_TILE_PIXELS // width)
+    return max(MIN_TILE_HEIGHT, min(height, by_budget, by_pixels))
+
+
+def find_strips(profile, tile_height, overlap=None):
+    """
+    Split rows into strips with seams on the lightest rows
+
+    Args:
+        profile: Dark pixels per row
+        tile_height: Nominal strip height
+        overlap: Rows to search for a seam and to share when the seam has ink
+
+    Returns:
+        List of (top, bottom) row ranges
+    """
+    overlap = OCR_TILE_OVERLAP if overlap is None else overlap
+    height = len(profile)
+    strips = []
+    top = 0
+    while top < height:
+        boundary = top + tile_height
+        if boundary >= height:
+            strips.append((top, height))
+            break
+        window_start = max(top + 1, boundary - overlap)
+        cut = window_start + int(np.argmin(profile[window_start:boundary + 1]))
+        strips.append((top, cut))
+        # A seam through ink means a line was cut: let the next strip re-read it
+        top = cut if profile[cut] == 0 else max(top + 1, cut - overlap)
+    return strips
+
+
+def _same_line(a, b):
+    return SequenceMatcher(None, a.strip(), b.strip()).ratio() > 0.8
+
+
+def join_strip_texts(texts):
+    """Join strip texts, dropping a first line that repeats the previous strip's last line"""
+    lines = []
+    for text in texts:
+        strip_lines = [line for line in text.splitlines()]
+        while strip_lines and not strip_lines[0].strip():
+            strip_lines.pop(0)
+        if lines and strip_lines:
+            last = next((line for line in reversed(lines) if line.strip()), "")
+            if last and _same_line(last, strip_lines[0]):
+                strip_lines.pop(0)
+        lines.extend(strip_lines)
+    return "\n".join(lines)
+
+
+def recognize_image(gray, recognize, source_path=None, budget=None):
+    """
+    OCR a grayscale page, whole or in strips depending on size and memory
+
+    Args:
+        gray: 2-D uint8 array
+        recognize: Callable(PagePreprocessor) returning an EngineResult,
+                   e.g. lambda page: get_router().recognize(page)
+        source_path: File the page came from, passed on when the page is not tiled
+        budget: MemoryBudget (defaults to OCR_PROCESS_MEMORY_MB)
+
+    Returns:
+        EngineResult for the page
+    """
+    from utils.ocr_router import EngineResult
+
+    budget = budget or MemoryBudget()
+    height, width = gray.shape[:2]
+    whole_page_mb = width * height * PAGE_BUFFER_COPIES / (1024 * 1024)
+
+    if width * height <= OCR_TILE_PIXELS and budget.fits(whole_page_mb):
+        page = PagePreprocessor(gray, source_path=source_path)
+        try:
+            return recognize(page)
+        finally:
+            page.release()
+
+    tile_height = tile_height_for_budget(width, budget, height)
+    strips = find_strips(ink_profile(gray), tile_height)
+    logger.info(f"OCR of {width}x{height} page in {len(strips)} strips of up to {tile_height} rows")
+
+    results = []
+    lines = []
+    covered = 0
+    for top, bottom in strips:
+        budget.enforce(f"OCR of rows {top}-{bottom}")
+        strip = PagePreprocessor(gray[top:bottom])
+        try:
+            result = recognize(strip)
+        finally:
+            strip.release()
+        results.append(result)
+
+        # Lines in page coordinates; a line the previous strip already covered is dropped
+        region_offset = max((line.box.region for line in lines), default=-1) + 1
+        for line in result.lines:
+            box = line.box
+            if top + box.y + box.height / 2 < covered:
+                continue
+            lines.append(LineResult(
+                LineBox(box.x, top + box.y, box.width, box.height, box.column, region_offset + box.region),
+                line.text,
+                line.confidence
+            ))
+        covered = bottom
+
+    text = join_strip_texts(result.text for result in results)
+    weights = [max(1, len(result.text.strip())) for result in results]
+    score = sum(result.score * weight for result, weight in zip(results, weights)) / sum(weights)
+    engines = "+".join(sorted({result.engine for result in results}))
+    return EngineResult(
+        f"tiled:{engines}",
+        text,
+        score,
+        sum(result.latency for result in results),
+        all(result.accepted for result in results),
+        lines
+    )
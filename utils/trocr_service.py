@@ -0,0 +1,219 @@
+"""
+In-process TrOCR inference service
+
+Loading a VisionEncoderDecoder model takes seconds and a lot of memory, so
+the model is loaded once per process and shared. Recognition requests from
+any thread are queued and a single background thread groups them into
+micro-batches: a batch is run as soon as it is full or the oldest request
+has waited TROCR_MAX_WAIT_MS, whichever comes first. Callers get a Future,
+or block on recognize() / recognize_many().
+
+Settings (environment variables):
+    TROCR_MODEL          - Hugging Face model name (default: microsoft/trocr-base-handwritten)
+    TROCR_NUM_THREADS    - torch CPU threads, 0 keeps the torch default (default: 0)
+    TROCR_QUANTIZE       - "1" for int8 dynamic quantization of Linear layers (default: "1")
+    TROCR_MAX_BATCH      - most images per forward pass (default: 16)
+    TROCR_MAX_WAIT_MS    - longest a request waits for its batch to fill (default: 25)
+    TROCR_MAX_NEW_TOKENS - generation length limit per image (default: 64)
+"""
+import os
+import time
+import queue
+import atexit
+import logging
+import threading
+from concurrent.futures import Future
+
+logger = logging.getLogger(__name__)
+
+TROCR_MODEL = os.environ.get("TROCR_MODEL", "microsoft/trocr-base-handwritten")
+TROCR_NUM_THREADS = int(os.environ.get("TROCR_NUM_THREADS", "0"))
+TROCR_QUANTIZE = os.environ.get("TROCR_QUANTIZE", "1") != "0"
+TROCR_MAX_BATCH = int(os.environ.get("TROCR_MAX_BATCH", "16"))
+TROCR_MAX_WAIT_MS = int(os.environ.get("TROCR_MAX_WAIT_MS", "25"))
+TROCR_MAX_NEW_TOKENS = int(os.environ.get("TROCR_MAX_NEW_TOKENS", "64"))
+
+_STOP = object()
+
+
+def trocr_available():
+    """Whether torch and transformers can be imported"""
+    try:
+        import torch  # noqa: F401
+        import transformers  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+class TrOCRService:
+    """Shared TrOCR model with dynamic micro-batching"""
+
+    def __init__(self, model_name=None, num_threads=None, quantize=None,
+                 max_batch=None, max_wait_ms=None, max_new_tokens=None):
+        self.model_name = model_name or TROCR_MODEL
+        self.num_threads = TROCR_NUM_THREADS if num_threads is None else num_threads
+        self.quantize = TROCR_QUANTIZE if quantize is None else quantize
+        self.max_batch = max_batch or TROCR_MAX_BATCH
+        self.max_wait = (TROCR_MAX_WAIT_MS if max_wait_ms is None else max_wait_ms) / 1000.0
+        self.max_new_tokens = max_new_tokens or TROCR_MAX_NEW_TOKENS
+
+        self._processor = None
+        self._model = None
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+        self._batches = 0
+        self._items = 0
+
+    def _load(self):
+        import torch
+        from transformers import TrOCRProcessor, VisionEncoderDecoderModel
+
+        if self.num_threads:
+            torch.set_num_threads(self.num_threads)
+
+        started = time.perf_counter()
+        processor = TrOCRProcessor.from_pretrained(self.model_name)
+        model = VisionEncoderDecoderModel.from_pretrained(self.model_name).eval()
+        if self.quantize:
+            # int8 weights for every Linear layer: smaller and faster on CPU
+            model = torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+
+        self._processor, self._model = processor, model
+        logger.info(f"Loaded TrOCR model {self.model_name} in {time.perf_counter() - started:.1f}s "
+                    f"(quantized: {self.quantize}, threads: {torch.get_num_threads()})")
+
+    def warm(self):
+        """Load the model and start the batching thread if that has not happened yet"""
+        with self._lock:
+            if self._model is None:
+                self._load()
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._serve, name="trocr-batcher", daemon=True)
+                self._thread.start()
+        return self
+
+    def submit(self, image):
+        """
+        Queue one image for recognition
+
+        Args:
+            image: PIL Image (a text line or small region works best)
+
+        Returns:
+            Future resolving to (text, sequence probability)
+        """
+        self.warm()
+        future = Future()
+        self._queue.put((image.convert('RGB'), future))
+        return future
+
+    def recognize(self, image, timeout=None):
+        """Recognize one image, blocking until its batch has run"""
+        return self.submit(image).result(timeout)
+
+    def recognize_many(self, images, timeout=None):
+        """Recognize several images; they are batched together with any concurrent requests"""
+        futures = [self.submit(image) for image in images]
+        return [future.result(timeout) for future in futures]
+
+    def stop(self):
+        """Stop the batching thread after the queued requests have been served"""
+        with self._lock:
+            thread, self._thread = self._thread, None
+        if thread is not None:
+            self._queue.put(_STOP)
+            thread.join()
+
+    def stats(self):
+        """Number of batches run, images recognized and the mean batch size"""
+        return {
+            "batches": self._batches,
+            "items": self._items,
+            "mean_batch_size": self._items / self._batches if self._batches else 0.0,
+        }
+
+    def _collect(self):
+        """Block for the first request, then gather more until the batch is full or the deadline passes"""
+        item = self._queue.get()
+        if item is _STOP:
+            return None
+
+        batch = [item]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                item = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if item is _STOP:
+                # Serve this batch first, stop on the next pass
+                self._queue.put(_STOP)
+                break
+            batch.append(item)
+        return batch
+
+    def _serve(self):
+        while True:
+            batch = self._collect()
+            if batch is None:
+                return
+            batch = [(image, future) for image, future in batch if future.set_running_or_notify_cancel()]
+            if not batch:
+                continue
+
+            try:
+                results = self._infer([image for image, _ in batch])
+            except Exception as e:
+                logger.error(f"TrOCR batch of {len(batch)} failed: {e}")
+                for _, future in batch:
+                    future.set_exception(e)
+                continue
+
+            self._batches += 1
+            self._items += len(batch)
+            for (_, future), result in zip(batch, results):
+                future.set_result(result)
+
+    def _infer(self, images):
+        """One forward pass over a batch; returns (text, sequence probability) per image"""
+        import torch
+
+        pixel_values = self._processor(images=images, return_tensors="pt").pixel_values
+        with torch.inference_mode():
+            output = self._model.generate(
+                pixel_values,
+                max_new_tokens=self.max_new_tokens,
+                output_scores=True,
+                return_dict_in_generate=True
+            )
+            transition_scores = self._model.compute_transition_scores(
+                output.sequences, output.scores, normalize_logits=True
+            )
+
+        texts = self._processor.batch_decode(output.sequences, skip_special_tokens=True)
+
+        # Mean token log-probability per sequence, ignoring the padding after EOS
+        generated = output.sequences[:, 1:]
+        mask = generated != self._processor.tokenizer.pad_token_id
+        log_probs = transition_scores.masked_fill(~mask, 0.0).sum(dim=1) / mask.sum(dim=1).clamp(min=1)
+        probabilities = torch.exp(log_probs).tolist()
+        return list(zip(texts, probabilities))
+
+
+_service = None
+_service_lock = threading.Lock()
+
+
+def get_trocr_service():
+    """Return the process-wide TrOCR service (the model itself loads on first use or warm())"""
+    global _service
+    with _service_lock:
+        if _service is None:
+            _service = TrOCRService()
+            atexit.register(_service.stop)
+        return _service
@@ -1,5 +1,6 @@
 from app import app
 from models import User, Exam, Question, Submission
+from utils.data_access import exam_overview
 
 app.app_context().push()
 
@@ -18,10 +19,9 @@ for u in User.objects:
     print(f"  - {u.username} ({u.email}) - Dept: {u.department}")
 
 print(f"\n📝 Exams:")
-for e in Exam.objects:
-    question_count = Question.objects(exam=e).count()
-    submission_count = Submission.objects(exam=e).count()
-    print(f"  - {e.title} by {e.faculty.username}")
-    print(f"    Questions: {question_count}, Submissions: {submission_count}")
+for row in exam_overview():
+    faculty_name = row['faculty'].username if row['faculty'] else 'unknown'
+    print(f"  - {row['exam'].title} by {faculty_name}")
+    print(f"    Questions: {row['question_count']}, Submissions: {row['submission_count']}")
 
 print("\n✓ Migration verification complete!")
@@ -0,0 +1,97 @@
+"""
+Submission Processing Worker
+Runs a pool of worker processes that take queued submissions and run
+extraction, segmentation and grading (or only re-segmentation and grading)
+outside the web server.
+
+Usage:
+    python worker.py --workers 4
+"""
+import os
+import sys
+import time
+import socket
+import logging
+import argparse
+import multiprocessing
+
+# Add parent directory to path
+sys.path.insert(0, os.path.abspath(os.path.dirname(__file__)))
+
+logger = logging.getLogger(__name__)
+
+POLL_INTERVAL_SECONDS = float(os.environ.get("WORKER_POLL_INTERVAL", "2"))
+
+
+def run_worker(worker_index):
+    """Claim and process jobs until interrupted"""
+    logging.basicConfig(level=logging.INFO, format=f"[worker {worker_index}] %(levelname)s %(message)s")
+
+    # MongoDB connection is configured when the app module is imported
+    from app import app
+    from utils.job_queue import get_job_queue, LeaseHeartbeat
+    from utils.submission_processor import process_submission, resegment_submission
+
+    # Load the TrOCR model before the first job instead of in the middle of one
+    from utils.ocr_router import get_router
+    if "trocr" in get_router().engine_names and os.environ.get("TROCR_PRELOAD", "1") != "0":
+        from utils.trocr_service import get_trocr_service
+        get_trocr_service().warm()
+
+    # Budget OCR memory on top of what the worker holds once it is warm
+    from utils.memory_budget import set_baseline
+    set_baseline()
+
+    queue = get_job_queue()
+    worker_id = f"{socket.gethostname()}:{os.getpid()}"
+    logger.info(f"Worker {worker_id} started")
+
+    with app.app_context():
+        while True:
+            job = queue.claim(worker_id)
+            if job is None:
+                time.sleep(POLL_INTERVAL_SECONDS)
+                continue
+
+            logger.info(f"Processing submission {job.submission_id} ({job.kind}, attempt {job.attempts})")
+            handler = resegment_submission if job.kind == 'resegment' else process_submission
+            try:
+                # Keep the lease alive for jobs that run longer than JOB_LEASE_SECONDS
+                with LeaseHeartbeat(queue, job):
+                    handler(job.submission_id)
+                queue.complete(job)
+            except Exception as e:
+                logger.exception(f"Submission {job.submission_id} failed: {e}")
+                queue.fail(job, e)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Process queued exam submissions")
+    parser.add_argument('--workers', type=int, default=int(os.environ.get("WORKER_PROCESSES", "2")),
+                        help="number of worker processes (default: 2)")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+
+    if args.workers <= 1:
+        run_worker(0)
+        return
+
+    # Spawn rather than fork so every worker opens its own MongoDB connection pool
+    context = multiprocessing.get_context("spawn")
+    processes = [context.Process(target=run_worker, args=(i,), daemon=True) for i in range(args.workers)]
+    for process in processes:
+        process.start()
+    logger.info(f"Started {len(processes)} worker processes")
+
+    try:
+        for process in processes:
+            process.join()
+    except KeyboardInterrupt:
+        logger.info("Stopping workers")
+        for process in processes:
+            process.terminate()
+
+
+if __name__ == "__main__":
+    main()